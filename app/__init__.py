@@ -1,30 +1,35 @@
 # __init__.py is a special Python file that allows a directory to become
 # a Python package so it can be accessed using the 'import' statement.
 
-from datetime import datetime
-import os
-
 from flask import Flask
-from flask_script import Manager
-from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail
-from flask_migrate import Migrate, MigrateCommand
 from flask_user import UserManager
 from flask_wtf.csrf import CSRFProtect
 
+from .services.database import AppSQLAlchemy
+from .services.startup_profile import StartupTimings
+
 
 # Instantiate Flask extensions
 csrf_protect = CSRFProtect()
-db = SQLAlchemy()
+db = AppSQLAlchemy()  # Flask-SQLAlchemy with pool metrics and SQLite pragmas
 mail = Mail()
-migrate = Migrate()
 
 # Initialize Flask Application
-def create_app(extra_config_settings={}):
+def create_app(extra_config_settings={}, entry_point='web'):
     """Create a Flask application.
+
+    Only the extensions needed by ``entry_point`` are set up:
+    - 'web': everything needed to serve web pages.
+    - 'cli': the database, Flask-Mail and Flask-User, for commands like init_db and import_users.
+    - 'db': the database, models and Flask-Migrate, for 'python manage.py db' migrations.
+    The duration of each step is recorded in app.extensions['startup_timings'].
     """
+    timings = StartupTimings()
+
     # Instantiate Flask
     app = Flask(__name__)
+    app.extensions['startup_timings'] = timings
 
     # Load common settings
     app.config.from_object('app.settings')
@@ -32,22 +37,99 @@ def create_app(extra_config_settings={}):
     app.config.from_object('app.local_settings')
     # Load extra settings from extra_config_settings param
     app.config.update(extra_config_settings)
+    timings.mark('Settings')
 
     # Setup Flask-SQLAlchemy
     db.init_app(app)
 
-    # Setup Flask-Migrate
-    migrate.init_app(app, db)
+    # Register the models with db.metadata
+    from .models.user_models import User
+    from .models import backfill_models, email_models, login_models, session_models
+    timings.mark('Flask-SQLAlchemy')
+
+    if entry_point == 'db':
+        # Setup Flask-Migrate. Alembic is slow to import, so only migrations pay for it.
+        from flask_migrate import Migrate
+        Migrate(app, db)
+        timings.mark('Flask-Migrate')
+        return app
 
     # Setup Flask-Mail
     mail.init_app(app)
 
+    # Setup an error-logger to send emails to app.config.ADMINS
+    init_email_error_handler(app)
+    timings.mark('Flask-Mail')
+
+    # Setup Flask-User
+    user_manager = UserManager(app, db, User)
+
+    # Queue emails in the email outbox instead of sending them during the request
+    if app.config.get('EMAIL_OUTBOX_ENABLED'):
+        from .services.email_outbox import OutboxEmailAdapter
+        user_manager.email_adapter = OutboxEmailAdapter(app)
+
+    # Hash and verify passwords in a process pool
+    if app.config.get('PASSWORD_HASHING_WORKERS'):
+        from .models.user_models import RehashingLoginForm
+        from .services.password_hashing import PoolPasswordManager
+        user_manager.password_manager = PoolPasswordManager(app)
+        user_manager.LoginFormClass = RehashingLoginForm
+    timings.mark('Flask-User')
+
+    if entry_point == 'web':
+        init_web(app, user_manager, timings)
+
+    return app
+
+
+def init_web(app, user_manager, timings):
+    """ Setup the extensions, blueprints and caches that are only needed to serve web pages."""
+    # Measure request, SQL and template times (Server-Timing header and /metrics)
+    from .services.request_metrics import request_metrics
+    request_metrics.init_app(app)
+
+    # Check the SQL query budgets of views
+    from .services.query_budget import query_budget
+    query_budget.init_app(app)
+    timings.mark('Request metrics')
+
+    # Answer over-limit logins, registrations and password resets with '429 Too Many Requests'
+    from .services.rate_limiter import rate_limiter
+    rate_limiter.init_app(app)
+    timings.mark('Rate limiter')
+
+    # Store sessions server-side (SESSION_TYPE)
+    from .services.session_store import init_session_store
+    init_session_store(app, db)
+    timings.mark('Session store')
+
+    # Record last_login_at, login_count and login_events in batches, after the login requests
+    from .services.login_activity import login_activity
+    login_activity.init_app(app, db)
+    timings.mark('Login activity')
+
+    # Delete stale unconfirmed users every PURGE_UNCONFIRMED_INTERVAL seconds
+    from .services.account_purge import unconfirmed_user_purger
+    unconfirmed_user_purger.init_app(app, db)
+    timings.mark('Unconfirmed user purger')
+
     # Setup WTForms CSRFProtect
     csrf_protect.init_app(app)
+    timings.mark('CSRFProtect')
 
     # Register blueprints
     from .views import register_blueprints
     register_blueprints(app)
+    timings.mark('Blueprints')
+
+    # Setup page and template fragment caching
+    from .services.page_cache import page_cache
+    page_cache.init_app(app)
+
+    # Serve fingerprinted, precompressed static files built by 'python manage.py build_assets'
+    from .services.static_assets import init_static_assets
+    init_static_assets(app)
 
     # Define bootstrap_is_hidden_field for flask-bootstrap's bootstrap_wtf.html
     from wtforms.fields import HiddenField
@@ -57,27 +139,27 @@ def create_app(extra_config_settings={}):
 
     app.jinja_env.globals['bootstrap_is_hidden_field'] = is_hidden_field_filter
 
-    # Setup an error-logger to send emails to app.config.ADMINS
-    init_email_error_handler(app)
-
-    # Setup Flask-User to handle user account related forms
-    from .models.user_models import User
-    from .views.main_views import user_profile_page
-
-    # Setup Flask-User
-    user_manager = UserManager(app, db, User)
-
     @app.context_processor
     def context_processor():
         return dict(user_manager=user_manager)
+    timings.mark('Templates and static files')
 
-    return app
+    # Cache current_user between requests
+    from .services.user_cache import user_cache
+    user_cache.init_app(app)
+    timings.mark('User cache')
+
+    # Compress pages and other text responses with gzip or brotli (COMPRESSION_*)
+    from .services.compression import init_compression
+    init_compression(app)
+    timings.mark('Compression')
 
 
 def init_email_error_handler(app):
     """
     Initialize a logger to send emails on error-level messages.
     Unhandled exceptions will now send an email message to app.config.ADMINS.
+    Emails are sent from a background thread, and repeated errors are collapsed into digest emails.
     """
     if app.debug: return  # Do not send error emails while developing
 
@@ -93,20 +175,17 @@ def init_email_error_handler(app):
     to_addr_list = app.config['ADMINS']
     subject = app.config.get('APP_SYSTEM_ERROR_SUBJECT_LINE', 'System Error')
 
-    # Setup an SMTP mail handler for error-level messages
-    import logging
-    from logging.handlers import SMTPHandler
-
-    mail_handler = SMTPHandler(
-        mailhost=(host, port),  # Mail host and port
-        fromaddr=from_addr,  # From address
-        toaddrs=to_addr_list,  # To address
-        subject=subject,  # Subject line
-        credentials=(username, password),  # Credentials
-        secure=secure,
+    # Email error-level messages from a background thread, collapsing repeats into digests
+    from .services.error_mailer import init_error_mailer, smtp_sender
+
+    send_email = smtp_sender(
+        host, port,  # Mail host and port
+        from_addr,  # From address
+        to_addr_list,  # To address
+        username=username, password=password,  # Credentials
+        use_tls=secure is not None,
     )
-    mail_handler.setLevel(logging.ERROR)
-    app.logger.addHandler(mail_handler)
+    init_error_mailer(app, send_email, subject)
 
     # Log errors using: app.logger.error('Some error message')
 
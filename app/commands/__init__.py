@@ -1,4 +1,14 @@
 # __init__.py is a special Python file that allows a directory to become
 # a Python package so it can be accessed using the 'import' statement.
 
-from .init_db import InitDbCommand
\ No newline at end of file
+from .build_assets import BuildAssetsCommand
+from .bulk_users import BulkUsersCommand
+from .calibrate_hashing import CalibrateHashingCommand
+from .check_migrations import CheckMigrationsCommand
+from .email_worker import EmailWorkerCommand
+from .export_users import ExportUsersCommand
+from .import_users import ImportUsersCommand
+from .init_db import InitDbCommand
+from .profile_startup import ProfileStartupCommand
+from .purge_unconfirmed import PurgeUnconfirmedCommand
+from .serve import ServeCommand
@@ -0,0 +1,18 @@
+# This file defines command line commands for manage.py
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from flask import current_app
+from flask_script import Command
+
+from app.services.static_assets import build_assets
+
+
+class BuildAssetsCommand(Command):
+    """ Fingerprint and precompress the files in app/static."""
+
+    def run(self):
+        manifest = build_assets(current_app.static_folder, progress=print)
+        print('Built %d static assets in app/static/dist. Restart the app to serve them.' % len(manifest))
@@ -0,0 +1,50 @@
+# This file defines command line commands for manage.py
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from flask import current_app
+from flask_script import Command, Option
+
+from app.services.bulk_actions import ACTIONS, filtered_id_chunks, id_chunks, run_bulk_action
+
+
+class BulkUsersCommand(Command):
+    """ Activate, deactivate, grant a role to or revoke a role from many users at once."""
+
+    option_list = (
+        Option('action', choices=ACTIONS),
+        Option('--role', dest='role', default=None,
+               help='Role name to grant or revoke'),
+        Option('--ids', dest='ids', default=None,
+               help='Comma separated user IDs'),
+        Option('--ids-file', dest='ids_file', default=None,
+               help='File with one user ID per line'),
+        Option('--search', dest='search', default=None,
+               help='Select the users that match this user directory search'),
+        Option('--with-role', dest='with_role', default=None,
+               help='Select the users that have this role'),
+        Option('--chunk-size', dest='chunk_size', type=int, default=None,
+               help='Number of users per transaction. Defaults to BULK_ACTION_CHUNK_SIZE.'),
+    )
+
+    def run(self, action, role, ids, ids_file, search, with_role, chunk_size):
+        chunk_size = chunk_size or current_app.config.get('BULK_ACTION_CHUNK_SIZE', 1000)
+        if ids or ids_file:
+            user_ids = ids.split(',') if ids else []
+            if ids_file:
+                with open(ids_file) as input_file:
+                    user_ids.extend(line.strip() for line in input_file if line.strip())
+            chunks = id_chunks(user_ids, chunk_size)
+        elif search or with_role:
+            chunks = filtered_id_chunks(search, with_role, chunk_size)
+        else:
+            print('Select users with --ids, --ids-file, --search or --with-role.')
+            return
+
+        counts = run_bulk_action(action, chunks, role_name=role,
+                                 pause=current_app.config.get('BULK_ACTION_CHUNK_PAUSE', 0))
+        print('%s: %d of %d users changed in %d chunks.'
+              % (action, counts['affected'], counts['users'], counts['chunks']))
+        print('Web processes serve cached users for up to CURRENT_USER_CACHE_TTL seconds.')
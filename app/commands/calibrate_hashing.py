@@ -0,0 +1,30 @@
+# This file defines command line commands for manage.py
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from flask import current_app
+from flask_script import Command, Option
+
+from app.services.password_hashing import calibrate_cost
+
+
+class CalibrateHashingCommand(Command):
+    """ Pick the password hash cost that meets PASSWORD_HASH_TARGET_MS on this machine."""
+
+    option_list = (
+        Option('--target-ms', dest='target_ms', type=float, default=None,
+               help='Per-hash latency budget in milliseconds. Defaults to PASSWORD_HASH_TARGET_MS.'),
+    )
+
+    def run(self, target_ms):
+        target_ms = target_ms or current_app.config.get('PASSWORD_HASH_TARGET_MS', 250)
+        scheme = current_app.user_manager.USER_PASSLIB_CRYPTCONTEXT_SCHEMES[0]
+        rounds = calibrate_cost(scheme, target_ms / 1000.0, progress=print)
+        if rounds is None:
+            print('Even the lowest %s cost exceeds %.0f ms on this machine.' % (scheme, target_ms))
+            return
+        print('Add this to app/local_settings.py. Existing hashes are upgraded on the next login:')
+        print('USER_PASSLIB_CRYPTCONTEXT_KEYWORDS = dict(%s__default_rounds=%d, %s__min_rounds=%d)'
+              % (scheme, rounds, scheme, rounds))
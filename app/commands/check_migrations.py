@@ -0,0 +1,25 @@
+# This file defines command line commands for manage.py
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import sys
+
+from flask_script import Command
+
+from app.services.migration_drift import check_migration_drift
+
+
+class CheckMigrationsCommand(Command):
+    """ Check that the migrations create the schema defined by the models. Exits with 1 if not."""
+
+    def run(self):
+        differences = check_migration_drift()
+        if differences:
+            print('The models and the migrations differ:')
+            for difference in differences:
+                print('  ' + difference)
+            print('Add a migration with "python manage.py db migrate" and review it.')
+            sys.exit(1)
+        print('The migrations match the models.')
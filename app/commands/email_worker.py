@@ -0,0 +1,32 @@
+# This file defines command line commands for manage.py
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import time
+
+from flask import current_app
+from flask_script import Command, Option
+
+from app.services.email_outbox import deliver_emails
+
+
+class EmailWorkerCommand(Command):
+    """ Deliver queued emails from the email outbox."""
+
+    option_list = (
+        Option('--once', dest='once', action='store_true', default=False,
+               help='Deliver all due emails and exit instead of polling forever'),
+    )
+
+    def run(self, once):
+        poll_interval = current_app.config.get('EMAIL_OUTBOX_POLL_INTERVAL', 5)
+        while True:
+            counts = deliver_emails()
+            if any(counts.values()):
+                print('Emails sent: %(sent)d, retried: %(retried)d, failed: %(failed)d.' % counts)
+                continue  # More emails may be due
+            if once:
+                break
+            time.sleep(poll_interval)
@@ -0,0 +1,47 @@
+# This file defines command line commands for manage.py
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import sys
+
+from flask import current_app
+from flask_script import Command, Option
+
+from app import db
+from app.services.user_export import FORMATS, export_users
+
+
+class ExportUsersCommand(Command):
+    """ Export users and their role names as CSV or JSONL, streaming them in batches."""
+
+    option_list = (
+        Option('--format', dest='format', choices=FORMATS, default=None,
+               help='Output format. Defaults to the extension of --output, or csv.'),
+        Option('--output', '-o', dest='output', default='-',
+               help='Output file. Defaults to stdout.'),
+        Option('--gzip', dest='compress', action='store_true', default=False,
+               help='Gzip the output. Implied by an --output that ends with .gz.'),
+        Option('--search', dest='search', default=u'',
+               help='Only export the users that match this user directory search'),
+        Option('--role', dest='role', default=None,
+               help='Only export the users that have this role'),
+    )
+
+    def run(self, format, output, compress, search, role):
+        compress = compress or output.endswith('.gz')
+        name = output[:-3] if output.endswith('.gz') else output
+        format = format or ('jsonl' if name.endswith(('.jsonl', '.json')) else 'csv')
+        chunks = export_users(db.engine, format, compress, search=search, role_name=role,
+                              batch_size=current_app.config.get('USER_EXPORT_BATCH_SIZE', 1000))
+        if output == '-':
+            _write(chunks, sys.stdout.buffer)
+        else:
+            with open(output, 'wb') as output_file:
+                _write(chunks, output_file)
+
+
+def _write(chunks, output_file):
+    for chunk in chunks:
+        output_file.write(chunk)
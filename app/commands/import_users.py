@@ -0,0 +1,191 @@
+# This file defines command line commands for manage.py
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import csv
+import datetime
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from flask_script import Command, Option
+from sqlalchemy import func
+
+from app import db
+from app.models.user_models import Role, User, UsersRoles
+from app.services.password_hashing import hash_password, init_hasher
+
+
+class ImportUsersCommand(Command):
+    """ Import users from a CSV or JSONL file."""
+
+    option_list = (
+        Option('path', help='CSV or JSONL file with email, first_name, last_name, password and roles fields'),
+        Option('--format', dest='format', choices=('csv', 'jsonl'), default=None,
+               help='Input format. Defaults to the file extension.'),
+        Option('--chunk-size', dest='chunk_size', type=int, default=1000,
+               help='Number of users per bulk insert'),
+        Option('--workers', dest='workers', type=int, default=None,
+               help='Number of password hashing processes. Defaults to the number of CPUs.'),
+        Option('--checkpoint', dest='checkpoint', default=None,
+               help='Progress file used to resume an interrupted import. Defaults to PATH.checkpoint'),
+    )
+
+    def run(self, path, format, chunk_size, workers, checkpoint):
+        import_users(path, format=format, chunk_size=chunk_size, workers=workers,
+                     checkpoint_path=checkpoint, progress=print)
+
+
+def import_users(path, format=None, chunk_size=1000, workers=None, checkpoint_path=None, progress=None):
+    """ Stream users from ``path`` into the users and users_roles tables.
+
+    Rows are processed in chunks: existing emails are looked up with one IN query,
+    passwords are hashed in a process pool, and new users and their roles are bulk inserted.
+    The number of processed rows is saved in a checkpoint file after each chunk,
+    so that a re-run resumes where an interrupted run left off.
+
+    Each row has an 'email', 'first_name', 'last_name', 'password' and
+    an optional 'roles' field (role names separated by ';').
+
+    Rows without an email or password are not imported, and reported through ``progress``.
+
+    Returns a dict with the number of 'imported', 'skipped' (existing) and 'invalid' users.
+    """
+    format = format or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+    workers = workers or os.cpu_count() or 1
+    checkpoint_path = checkpoint_path or path + '.checkpoint'
+    done_rows = _read_checkpoint(checkpoint_path)
+    counts = dict(imported=0, skipped=0, invalid=0)
+    role_ids = {}
+    start_time = time.time()
+
+    crypt_context = current_app.user_manager.password_manager.password_crypt_context.to_string()
+    with io.open(path, encoding='utf-8', newline='') as input_file, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_hasher,
+                                initargs=(crypt_context,)) as executor:
+        rows = _read_rows(input_file, format)
+        rows = itertools.islice(rows, done_rows, None)  # Resume after the last completed chunk
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            imported, invalid_rows = _import_chunk(chunk, done_rows + 1, executor, workers, role_ids)
+            counts['imported'] += imported
+            counts['invalid'] += len(invalid_rows)
+            counts['skipped'] += len(chunk) - imported - len(invalid_rows)
+            done_rows += len(chunk)
+            _write_checkpoint(checkpoint_path, done_rows)
+
+            if progress:
+                for row_number in invalid_rows:
+                    progress('Row %d: no email or password, not imported.' % row_number)
+                elapsed = time.time() - start_time
+                progress('Processed %d rows: %d imported, %d skipped (%.0f users/s).'
+                         % (done_rows, counts['imported'], counts['skipped'], counts['imported'] / elapsed))
+
+    # The import completed: a re-run should start from scratch
+    os.remove(checkpoint_path)
+    return counts
+
+
+def _import_chunk(chunk, first_row_number, executor, workers, role_ids):
+    # Returns the number of imported users and the numbers of the rows without an email or password
+    invalid_rows, valid_rows = [], []
+    for row_number, row in enumerate(chunk, first_row_number):
+        email = (row.get('email') or u'').strip().lower()
+        if email and row.get('password'):
+            valid_rows.append((email, row))
+        else:
+            invalid_rows.append(row_number)
+
+    # Skip emails that already exist (in any case, using the ix_users_email_lower index),
+    # and duplicates within the chunk
+    emails = [email for email, row in valid_rows]
+    existing = set(email for (email,) in db.session.query(func.lower(User.email))
+                   .filter(func.lower(User.email).in_(emails)))
+    new_rows = []
+    for email, row in valid_rows:
+        if email not in existing:
+            existing.add(email)
+            new_rows.append((email, row))
+    if not new_rows:
+        return 0, invalid_rows
+
+    # Hash passwords in parallel
+    password_hashes = list(executor.map(hash_password, [row['password'] for email, row in new_rows],
+                                        chunksize=max(1, len(new_rows) // (workers * 4))))
+
+    # Bulk insert users
+    now = datetime.datetime.utcnow()
+    db.session.execute(User.__table__.insert(), [
+        dict(email=email,
+             first_name=row.get('first_name') or u'',
+             last_name=row.get('last_name') or u'',
+             password=password_hash,
+             is_active=True,
+             email_confirmed_at=now)
+        for (email, row), password_hash in zip(new_rows, password_hashes)])
+
+    # Bulk insert role memberships, once per role of a row ('admin;admin' is one membership)
+    user_roles = [(email, role_name)
+                  for email, row in new_rows
+                  for role_name in _role_names(row.get('roles'))]
+    if user_roles:
+        user_ids = dict(db.session.query(User.email, User.id)
+                        .filter(User.email.in_([email for email, role_name in user_roles])))
+        db.session.execute(UsersRoles.__table__.insert(), [
+            dict(user_id=user_ids[email], role_id=_get_role_id(role_name, role_ids))
+            for email, role_name in user_roles])
+
+    db.session.commit()
+    return len(new_rows), invalid_rows
+
+
+def _role_names(roles):
+    # Returns the unique role names of a 'roles' field, in order
+    role_names = []
+    for role_name in (roles or u'').split(';'):
+        role_name = role_name.strip()
+        if role_name and role_name not in role_names:
+            role_names.append(role_name)
+    return role_names
+
+
+def _get_role_id(role_name, role_ids):
+    # Find or create a role, remembering its ID for the rest of the import
+    if role_name not in role_ids:
+        role = Role.query.filter(Role.name == role_name).first()
+        if not role:
+            role = Role(name=role_name, label=role_name)
+            db.session.add(role)
+            db.session.flush()
+        role_ids[role_name] = role.id
+    return role_ids[role_name]
+
+
+def _read_rows(input_file, format):
+    if format == 'jsonl':
+        return (json.loads(line) for line in input_file if line.strip())
+    return csv.DictReader(input_file)
+
+
+def _read_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path) as checkpoint_file:
+        return int(checkpoint_file.read().strip() or 0)
+
+
+def _write_checkpoint(checkpoint_path, done_rows):
+    # Write-then-rename so that a crash never leaves a partial checkpoint file
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'w') as checkpoint_file:
+        checkpoint_file.write(str(done_rows))
+    os.replace(temp_path, checkpoint_path)
+
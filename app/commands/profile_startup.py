@@ -0,0 +1,33 @@
+# This file defines command line commands for manage.py
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from flask_script import Command, Option
+
+from app.services.startup_profile import profile_startup
+
+
+class ProfileStartupCommand(Command):
+    """ Report how long it takes to import and create the app, per import and per setup step."""
+
+    option_list = (
+        Option('--entry-point', dest='entry_point', choices=('web', 'cli', 'db'), default='web',
+               help='The create_app() entry point to profile'),
+        Option('--imports', dest='imports', type=int, default=20,
+               help='Number of slowest imports to report'),
+    )
+
+    def run(self, entry_point, imports):
+        result = profile_startup(entry_point)
+        print('Startup of the %s entry point took %.0f ms (%.0f ms importing the app package).'
+              % (entry_point, result['total_seconds'] * 1000, result['import_seconds'] * 1000))
+
+        print('\ncreate_app() steps:')
+        for step, seconds in result['steps']:
+            print('  %8.1f ms  %s' % (seconds * 1000, step))
+
+        print('\nSlowest imports (cumulative, self):')
+        for module, self_seconds, cumulative_seconds in result['imports'][:imports]:
+            print('  %8.1f ms  %8.1f ms  %s' % (cumulative_seconds * 1000, self_seconds * 1000, module))
@@ -0,0 +1,41 @@
+# This file defines command line commands for manage.py
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import datetime
+
+from flask import current_app
+from flask_script import Command, Option
+
+from app import db
+from app.services.account_purge import USER_ROW_TABLES, purge_unconfirmed_users
+
+
+class PurgeUnconfirmedCommand(Command):
+    """ Delete users that did not confirm their email address, in small batches."""
+
+    option_list = (
+        Option('--days', dest='days', type=int, default=None,
+               help='Purge users that registered more than this many days ago. '
+                    'Defaults to PURGE_UNCONFIRMED_AFTER_DAYS.'),
+        Option('--batch-size', dest='batch_size', type=int, default=None,
+               help='Number of users per transaction. Defaults to PURGE_UNCONFIRMED_BATCH_SIZE.'),
+        Option('--dry-run', dest='dry_run', action='store_true', default=False,
+               help='Count the rows that would be deleted, without deleting them'),
+    )
+
+    def run(self, days, batch_size, dry_run):
+        config = current_app.config
+        days = days if days is not None else config.get('PURGE_UNCONFIRMED_AFTER_DAYS', 30)
+        older_than = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+        counts = purge_unconfirmed_users(db.engine, older_than,
+                                         batch_size=batch_size or config.get('PURGE_UNCONFIRMED_BATCH_SIZE', 500),
+                                         pause=config.get('PURGE_UNCONFIRMED_PAUSE', 0.1), dry_run=dry_run)
+        print('%s %d unconfirmed users that registered before %s UTC, in %d batches (%.1fs).'
+              % ('Would delete' if dry_run else 'Deleted', counts['users'], older_than.strftime('%Y-%m-%d %H:%M'),
+                 counts['batches'], counts['seconds']))
+        print(', '.join('%s: %d rows' % (name, counts[name]) for name in USER_ROW_TABLES))
+        if not dry_run:
+            print('Web processes serve cached users for up to CURRENT_USER_CACHE_TTL seconds.')
@@ -0,0 +1,60 @@
+# This file defines command line commands for manage.py
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import logging
+import multiprocessing
+
+from flask import current_app
+from flask_script import Command, Option
+
+from app import db
+from app.services.login_activity import login_activity
+from app.services.prefork_server import PreforkServer
+
+
+class ServeCommand(Command):
+    """ Serve the app with pre-forked worker processes. 'kill -HUP <pid>' reloads gracefully."""
+
+    option_list = (
+        Option('--bind', '-b', dest='bind', default=None,
+               help='host:port to listen on. Defaults to SERVER_BIND.'),
+        Option('--workers', '-w', dest='workers', type=int, default=None,
+               help='Number of worker processes. Defaults to SERVER_WORKERS.'),
+        Option('--threads', '-t', dest='threads', type=int, default=None,
+               help='Number of threads per worker. Defaults to SERVER_THREADS.'),
+    )
+
+    def run(self, bind, workers, threads):
+        logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(process)d %(levelname)s %(message)s')
+        app = current_app._get_current_object()
+        config = app.config
+        workers = workers or config.get('SERVER_WORKERS') or multiprocessing.cpu_count()
+        server = PreforkServer(
+            app,
+            bind=bind or config.get('SERVER_BIND', '127.0.0.1:8000'),
+            workers=workers,
+            threads=threads or config.get('SERVER_THREADS', 8),
+            graceful_timeout=config.get('SERVER_GRACEFUL_TIMEOUT', 30),
+            worker_timeout=config.get('SERVER_WORKER_TIMEOUT', 60),
+            health_file=config.get('SERVER_HEALTH_FILE'),
+            engine_disposer=lambda: dispose_engines(app),
+            worker_exit=lambda: worker_exit(app))
+        server.run()
+
+
+def worker_exit(app):
+    # Workers exit with os._exit(), without running atexit handlers: write buffered logins
+    # and email pending error digests here
+    login_activity.flush()
+    error_mailer = app.extensions.get('error_mailer')
+    if error_mailer:
+        error_mailer.stop()
+
+
+def dispose_engines(app):
+    # Pooled database connections must not be shared by forked processes
+    for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or ()):
+        db.get_engine(app, bind).dispose()
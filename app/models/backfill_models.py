@@ -0,0 +1,18 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from app import db
+
+
+# Define the BackfillCheckpoint data model
+# Records the progress of each data backfill, so that it can resume (see app/services/backfill.py)
+class BackfillCheckpoint(db.Model):
+    __tablename__ = 'backfill_checkpoints'
+    name = db.Column(db.String(100), primary_key=True)
+    last_id = db.Column(db.Integer(), nullable=False, server_default='0')  # Rows up to this ID are done
+    rows = db.Column(db.Integer(), nullable=False, server_default='0')  # Rows changed so far
+    chunks = db.Column(db.Integer(), nullable=False, server_default='0')
+    started_at = db.Column(db.DateTime(), nullable=False)
+    updated_at = db.Column(db.DateTime(), nullable=False)
+    finished_at = db.Column(db.DateTime())
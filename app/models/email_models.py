@@ -0,0 +1,37 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from app import db
+
+
+# Define the EmailOutbox data model
+# Emails are queued here by the web app and delivered by 'python manage.py email_worker'
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.Integer(), primary_key=True)
+
+    # Email message
+    recipient = db.Column(db.Unicode(255), nullable=False)
+    sender = db.Column(db.Unicode(255), nullable=False, server_default=u'')
+    subject = db.Column(db.Unicode(255), nullable=False, server_default=u'')
+    html_message = db.Column(db.UnicodeText(), nullable=False, server_default=u'')
+    text_message = db.Column(db.UnicodeText(), nullable=False, server_default=u'')
+
+    # Delivery status
+    status = db.Column(db.String(10), nullable=False, server_default=STATUS_PENDING)
+    attempts = db.Column(db.Integer(), nullable=False, server_default='0')
+    next_attempt_at = db.Column(db.DateTime(), nullable=False)  # Also serves as the claim lease
+    last_error = db.Column(db.Unicode(255), nullable=False, server_default=u'')
+    created_at = db.Column(db.DateTime(), nullable=False)
+    sent_at = db.Column(db.DateTime())
+
+    # The worker looks up due emails by (status, next_attempt_at)
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
@@ -0,0 +1,26 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from app import db
+
+
+# Define the LoginEvent data model
+# One row per login, written in batches by app/services/login_activity.py
+class LoginEvent(db.Model):
+    __tablename__ = 'login_events'
+    id = db.Column(db.Integer(), primary_key=True)
+    user_id = db.Column(db.Integer(), db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    logged_in_at = db.Column(db.DateTime(), nullable=False)
+    ip_address = db.Column(db.String(45), nullable=False, server_default='')  # Fits IPv6 addresses
+
+    # A user's login history is one index range scan, newest first
+    __table_args__ = (
+        db.Index('ix_login_events_user_id_logged_in_at', 'user_id', 'logged_in_at'),
+    )
+
+    @classmethod
+    def history(cls, user_id, limit=20):
+        """ Return the ``limit`` most recent logins of ``user_id``, newest first."""
+        return cls.query.filter(cls.user_id == user_id) \
+            .order_by(cls.logged_in_at.desc(), cls.id.desc()).limit(limit).all()
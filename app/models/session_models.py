@@ -0,0 +1,16 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from app import db
+
+
+# Define the ServerSession data model
+# Stores Flask sessions server-side when SESSION_TYPE is 'sqlalchemy' (see app/services/session_store.py)
+class ServerSession(db.Model):
+    __tablename__ = 'sessions'
+    # SHA-256 of the session ID in the cookie, so that the table does not contain usable session IDs
+    id = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer(), index=True)  # To revoke all sessions of a user
+    data = db.Column(db.UnicodeText(), nullable=False, server_default=u'')
+    expires_at = db.Column(db.DateTime(), nullable=False, index=True)  # The sweeper deletes expired sessions
@@ -2,34 +2,175 @@
 #
 # Authors: Ling Thio <ling.thio@gmail.com>
 
+import datetime
+import sqlite3
+
+from flask import current_app
 from flask_user import UserMixin
+from flask_user.forms import LoginForm
 # from flask_user.forms import RegisterForm
 from flask_wtf import FlaskForm
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import joinedload, lazyload, object_session, selectinload
 from wtforms import StringField, SubmitField, validators
 from app import db
 
 
+# Answers role checks from a precomputed set of role names
+class RoleSetMixin(object):
+
+    def has_role(self, role_name):
+        """ Return True if the user has the role named ``role_name``."""
+        return role_name in self.role_names
+
+    def has_roles(self, *requirements):
+        """ Same semantics as flask_user.UserMixin.has_roles(): each requirement is a role name,
+        or a tuple of role names of which the user must have at least one."""
+        role_names = self.role_names
+        for requirement in requirements:
+            if isinstance(requirement, (list, tuple)):
+                if role_names.isdisjoint(requirement):
+                    return False
+            elif requirement not in role_names:
+                return False
+        return True
+
+
 # Define the User data model. Make sure to add the flask_user.UserMixin !!
-class User(db.Model, UserMixin):
+class User(RoleSetMixin, db.Model, UserMixin):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
 
     # User authentication information (required for Flask-User)
     email = db.Column(db.Unicode(255), nullable=False, server_default=u'', unique=True)
-    email_confirmed_at = db.Column(db.DateTime())
+    email_confirmed_at = db.Column(db.DateTime(), index=True)  # Finds unconfirmed users to purge
     password = db.Column(db.String(255), nullable=False, server_default='')
     # reset_password_token = db.Column(db.String(100), nullable=False, server_default='')
     active = db.Column(db.Boolean(), nullable=False, server_default='0')
 
     # User information
     active = db.Column('is_active', db.Boolean(), nullable=False, server_default='0')
-    first_name = db.Column(db.Unicode(50), nullable=False, server_default=u'')
+    first_name = db.Column(db.Unicode(50), nullable=False, server_default=u'', index=True)
     last_name = db.Column(db.Unicode(50), nullable=False, server_default=u'')
 
+    # Incremented by every update, for ETags and optimistic concurrency in the profile API
+    version = db.Column(db.Integer(), nullable=False, server_default='1')
+
+    # Login activity, written in batches by app/services/login_activity.py (a few seconds behind)
+    last_login_at = db.Column(db.DateTime())
+    login_count = db.Column(db.Integer(), nullable=False, server_default='0')
+
+    # Registration time. Unconfirmed users are purged some time after it (see app/services/account_purge.py)
+    created_at = db.Column(db.DateTime(), default=datetime.datetime.utcnow)
+
     # Relationships
     roles = db.relationship('Role', secondary='users_roles',
                             backref=db.backref('users', lazy='dynamic'))
 
+    # The user directory pages through users by (last_name, id).
+    # Imports look up existing emails case-insensitively, with lower(email).
+    __table_args__ = (
+        db.Index('ix_users_last_name_id', 'last_name', 'id'),
+        db.Index('ix_users_email_lower', db.func.lower(email)),
+    )
+
+    @property
+    def role_names(self):
+        """ Frozenset of role names, computed once per User object."""
+        role_names = self.__dict__.get('_role_names')
+        if role_names is None:
+            role_names = frozenset(role.name for role in self.roles)
+            self.__dict__['_role_names'] = role_names
+        return role_names
+
+    @classmethod
+    def get_with_roles(cls, user_id):
+        """ Load a User and its roles using the ROLES_LOADING_STRATEGY setting."""
+        strategy = current_app.config.get('ROLES_LOADING_STRATEGY', 'selectin')
+        return cls.query.options(roles_loader_option(strategy)).get(user_id)
+
+    @classmethod
+    def get_user_by_token(cls, token, expiration_in_seconds=None):
+        # Same as UserMixin.get_user_by_token(), but loads the roles along with the user
+        user_manager = current_app.user_manager
+        data_items = user_manager.verify_token(token, expiration_in_seconds)
+        if not data_items:
+            return None
+        user = cls.get_with_roles(data_items[0])
+        if not user or user.password[-8:] != data_items[1]:
+            return None
+        return user
+
+
+def roles_loader_option(strategy):
+    """ Return a query option that loads User.roles with 'selectin', 'joined' or 'select' loading."""
+    loaders = dict(selectin=selectinload, joined=joinedload, select=lazyload)
+    if strategy not in loaders:
+        raise ValueError("ROLES_LOADING_STRATEGY must be one of 'selectin', 'joined' or 'select'.")
+    return loaders[strategy](User.roles)
+
+
+# Forget the precomputed role names whenever User.roles changes
+@event.listens_for(User.roles, 'append')
+@event.listens_for(User.roles, 'remove')
+def _reset_role_names(user, role, initiator):
+    user.__dict__.pop('_role_names', None)
+
+
+# ... and whenever the User object is expired or refreshed from the DB
+@event.listens_for(User, 'expire')
+def _reset_role_names_on_expire(user, attrs):
+    user.__dict__.pop('_role_names', None)
+
+
+@event.listens_for(User, 'refresh')
+def _reset_role_names_on_refresh(user, context, attrs):
+    user.__dict__.pop('_role_names', None)
+
+
+# Increment User.version in the UPDATE statement itself, so that concurrent updates are all counted
+@event.listens_for(User, 'before_update')
+def _increment_version(mapper, connection, user):
+    if object_session(user).is_modified(user, include_collections=False):
+        user.version = User.version + 1
+
+
+# On SQLite, the user directory searches email, first_name and last_name substrings
+# in the users_fts full-text index. Triggers keep it in sync with the users table.
+USERS_FTS_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        email, first_name, last_name, content='users', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, email, first_name, last_name)
+        VALUES (new.id, new.email, new.first_name, new.last_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, email, first_name, last_name)
+        VALUES ('delete', old.id, old.email, old.first_name, old.last_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF email, first_name, last_name ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, email, first_name, last_name)
+        VALUES ('delete', old.id, old.email, old.first_name, old.last_name);
+        INSERT INTO users_fts(rowid, email, first_name, last_name)
+        VALUES (new.id, new.email, new.first_name, new.last_name);
+    END""",
+)
+
+
+def users_fts_available(bind):
+    """ Return True if ``bind`` is a SQLite database with FTS5 trigram support (SQLite 3.34+)."""
+    return bind.dialect.name == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34)
+
+
+def _users_fts_available(ddl, target, bind, **kwargs):
+    return users_fts_available(bind)
+
+
+for _statement in USERS_FTS_DDL:
+    event.listen(User.__table__, 'after_create', DDL(_statement).execute_if(callable_=_users_fts_available))
+event.listen(User.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS users_fts').execute_if(callable_=_users_fts_available))
+
 
 # Define the Role data model
 class Role(db.Model):
@@ -46,6 +187,12 @@ class UsersRoles(db.Model):
     user_id = db.Column(db.Integer(), db.ForeignKey('users.id', ondelete='CASCADE'))
     role_id = db.Column(db.Integer(), db.ForeignKey('roles.id', ondelete='CASCADE'))
 
+    # Role checks look up (user_id, role_id). Role.users looks up role_id.
+    __table_args__ = (
+        db.Index('ix_users_roles_user_id_role_id', 'user_id', 'role_id', unique=True),
+        db.Index('ix_users_roles_role_id', 'role_id'),
+    )
+
 
 # # Define the User registration form
 # # It augments the Flask-User RegisterForm with additional fields
@@ -63,3 +210,23 @@ class UserProfileForm(FlaskForm):
     last_name = StringField('Last name', validators=[
         validators.DataRequired('Last name is required')])
     submit = SubmitField('Save')
+
+
+# Define the User login form
+# It augments the Flask-User LoginForm with a transparent password rehash
+class RehashingLoginForm(LoginForm):
+    def validate(self):
+        if not super(RehashingLoginForm, self).validate():
+            return False
+
+        # Upgrade outdated password hashes before Flask-Login stores the session token,
+        # which includes the last characters of the password hash.
+        # Most logins have no outdated hash: only load the user again when there is one.
+        user_manager = current_app.user_manager
+        if not user_manager.password_manager.has_pending_rehash():
+            return True
+        user, user_email = user_manager.db_manager.get_user_and_user_email_by_email(self.email.data)
+        if user and user_manager.password_manager.apply_pending_rehash(user):
+            user_manager.db_manager.save_object(user)
+            user_manager.db_manager.commit()
+        return True
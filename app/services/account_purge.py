@@ -0,0 +1,153 @@
+# This file defines the purge of stale unconfirmed users.
+#
+# With USER_ENABLE_CONFIRM_EMAIL, abandoned registrations stay in the users table with
+# email_confirmed_at NULL. purge_unconfirmed_users() deletes the ones that registered more than
+# PURGE_UNCONFIRMED_AFTER_DAYS ago, together with their users_roles, login_events and sessions rows:
+#
+# - Candidates are found with the index on users.email_confirmed_at, in ID order (keyset pagination).
+# - Each batch of PURGE_UNCONFIRMED_BATCH_SIZE users is deleted in its own short transaction,
+#   followed by a pause of PURGE_UNCONFIRMED_PAUSE seconds, so that logins and registrations
+#   are not blocked for long.
+# - A dry run counts the rows that would be deleted, without deleting them.
+#
+# Run it with 'python manage.py purge_unconfirmed', or in the web processes every
+# PURGE_UNCONFIRMED_INTERVAL seconds. Running it in several processes at once is harmless:
+# batches are re-checked in their transaction and deleting a deleted user changes nothing.
+#
+# Flask-User's confirmation and password reset tokens are signed, not stored,
+# so there are no expired tokens to delete. Expired sessions are deleted by the session sweeper.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import datetime
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import and_, func, select
+
+logger = logging.getLogger(__name__)
+
+# The tables with rows of users, in the order they are deleted: users last
+USER_ROW_TABLES = ('users_roles', 'login_events', 'sessions')
+
+
+def purge_unconfirmed_users(engine, older_than, batch_size=500, pause=0.1, dry_run=False,
+                            max_batches=None, progress=None):
+    """ Delete the users with an unconfirmed email address that registered before ``older_than``
+    (a UTC datetime), and their rows in USER_ROW_TABLES.
+    Returns a dict with the number of deleted (or, for a dry run, deletable) rows per table,
+    the number of 'batches' and the number of 'seconds' it took."""
+    from app import db
+    users = db.metadata.tables['users']
+    tables = [db.metadata.tables[name] for name in USER_ROW_TABLES]
+    counts = dict((table.name, 0) for table in tables + [users])
+    counts['batches'] = 0
+    started = time.time()
+    stale = and_(users.c.email_confirmed_at.is_(None), users.c.created_at < older_than)
+
+    last_id = 0
+    while max_batches is None or counts['batches'] < max_batches:
+        with engine.begin() as connection:
+            # WHERE email_confirmed_at IS NULL AND id > :last_id ORDER BY id: a range scan of the index
+            user_ids = [row[0] for row in connection.execute(
+                select([users.c.id]).where(and_(stale, users.c.id > last_id))
+                .order_by(users.c.id).limit(batch_size))]
+            if not user_ids:
+                break
+            # Re-checked by each statement: users that confirmed their email since the SELECT are kept
+            batch = select([users.c.id]).where(and_(users.c.id.in_(user_ids), stale))
+            for table in tables:
+                in_batch = table.c.user_id.in_(batch)
+                if dry_run:
+                    counts[table.name] += connection.execute(
+                        select([func.count()]).select_from(table).where(in_batch)).scalar()
+                else:
+                    counts[table.name] += connection.execute(table.delete().where(in_batch)).rowcount
+            if dry_run:
+                counts[users.name] += len(user_ids)
+            else:
+                counts[users.name] += connection.execute(users.delete().where(users.c.id.in_(batch))).rowcount
+        last_id = user_ids[-1]
+        counts['batches'] += 1
+        if progress:
+            progress('Batch %d: up to user ID %d' % (counts['batches'], last_id))
+        if len(user_ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    counts['seconds'] = round(time.time() - started, 3)
+    return counts
+
+
+class UnconfirmedUserPurger(object):
+    """ Runs purge_unconfirmed_users() every PURGE_UNCONFIRMED_INTERVAL seconds in a background thread
+    of each web process, and keeps totals of the deleted rows."""
+
+    def __init__(self, app=None, db=None):
+        self.interval = 0
+        self.totals = {}
+        self.runs = 0
+        self.last_run = None  # The counts of the last run
+        self._pid = None
+        self._lock = threading.Lock()
+        if app:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        self.interval = app.config.get('PURGE_UNCONFIRMED_INTERVAL', 0)
+        if self.interval:
+            app.before_request(self._start_thread)
+
+    def purge(self, dry_run=False):
+        """ Purge the stale unconfirmed users now. Returns the counts of purge_unconfirmed_users()."""
+        from app.services.user_cache import user_cache
+        config = self.app.config
+        days = config.get('PURGE_UNCONFIRMED_AFTER_DAYS', 30)
+        older_than = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+        counts = purge_unconfirmed_users(self.db.get_engine(self.app), older_than,
+                                         batch_size=config.get('PURGE_UNCONFIRMED_BATCH_SIZE', 500),
+                                         pause=config.get('PURGE_UNCONFIRMED_PAUSE', 0.1), dry_run=dry_run)
+        if not dry_run:
+            user_cache.clear()  # Cheaper than invalidating each purged user
+            with self._lock:
+                self.runs += 1
+                self.last_run = counts
+                for name, count in counts.items():
+                    self.totals[name] = self.totals.get(name, 0) + count
+            if counts['users']:
+                logger.info('Purged %(users)d unconfirmed users in %(batches)d batches (%(seconds).1fs).', counts)
+        return counts
+
+    def stats(self):
+        """ Return the number of runs, the counts of the last run and the totals of this process."""
+        with self._lock:
+            return dict(runs=self.runs, last_run=self.last_run, totals=dict(self.totals))
+
+    def _start_thread(self):
+        # Start one purge thread per process, also after a fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                thread = threading.Thread(target=self._purge_forever, name='unconfirmed-user-purger')
+                thread.daemon = True
+                thread.start()
+
+    def _purge_forever(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.purge()
+            except Exception:
+                logger.exception('Could not purge unconfirmed users.')
+
+
+# Shared instance, initialized by create_app()
+unconfirmed_user_purger = UnconfirmedUserPurger()
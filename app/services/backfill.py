@@ -0,0 +1,132 @@
+# This file defines resumable, throttled data backfills for large tables.
+#
+# Instead of one long transaction that locks the table, run_backfill() updates rows in chunks
+# of consecutive primary keys (keyset order) and commits after each chunk:
+#
+# - Progress is saved in the backfill_checkpoints table, in the same transaction as each chunk,
+#   so an interrupted backfill resumes after the last committed chunk.
+# - Chunks are resized to take about ``target_seconds``, and after each chunk the backfill
+#   sleeps so that it uses at most ``duty_cycle`` of the database's time.
+#
+# Use it in a data migration of its own, after the migration that adds the column:
+#
+#     def upgrade():
+#         users = sa.Table('users', sa.MetaData(), sa.Column('id', sa.Integer(), primary_key=True),
+#                          sa.Column('display_name', sa.Unicode(101)), ...)
+#
+#         def update(connection, first_id, last_id):
+#             return connection.execute(users.update()
+#                 .where(users.c.id.between(first_id, last_id))
+#                 .values(display_name=users.c.first_name + ' ' + users.c.last_name)).rowcount
+#
+#         run_backfill(op.get_bind().engine, 'users.display_name', users, update)
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import datetime
+import time
+
+from sqlalchemy import select
+
+
+class Backfill(object):
+    """ Runs ``update(connection, first_id, last_id)`` on chunks of ``table`` in primary key order.
+
+    ``update`` must be idempotent: a chunk may run again if the process is killed before its commit.
+    """
+
+    def __init__(self, engine, name, table, update, chunk_size=1000, min_chunk_size=10,
+                 max_chunk_size=50000, target_seconds=0.2, duty_cycle=0.5, progress=None):
+        from app.models.backfill_models import BackfillCheckpoint
+        self.engine = engine
+        self.name = name
+        self.table = table
+        self.key_column = list(table.primary_key.columns)[0]
+        self.update = update
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.target_seconds = target_seconds
+        self.duty_cycle = duty_cycle
+        self.progress = progress
+        self.checkpoints = BackfillCheckpoint.__table__
+
+    def checkpoint(self, connection=None):
+        """ Return the checkpoint row of this backfill, or None if it has not started."""
+        checkpoints = self.checkpoints
+        query = checkpoints.select().where(checkpoints.c.name == self.name)
+        if connection is not None:
+            return connection.execute(query).first()
+        with self.engine.connect() as connection:
+            return connection.execute(query).first()
+
+    def run(self, max_chunks=None, restart=False):
+        """ Run (or resume) the backfill. Stops after ``max_chunks`` chunks, if given.
+        Returns a dict with the number of 'rows' changed and 'chunks' processed by this call,
+        and whether the backfill is 'finished'."""
+        if restart:
+            with self.engine.begin() as connection:
+                connection.execute(self.checkpoints.delete().where(self.checkpoints.c.name == self.name))
+        checkpoint = self.checkpoint()
+        if checkpoint is not None and checkpoint.finished_at is not None:
+            return dict(rows=0, chunks=0, finished=True)
+        last_id = checkpoint.last_id if checkpoint is not None else 0
+
+        counts = dict(rows=0, chunks=0, finished=False)
+        while max_chunks is None or counts['chunks'] < max_chunks:
+            started = time.time()
+            with self.engine.begin() as connection:
+                chunk_end = self._chunk_end(connection, last_id)
+                if chunk_end is None:
+                    self._save_checkpoint(connection, last_id, 0, finished=True)
+                    counts['finished'] = True
+                    break
+                rows = self.update(connection, last_id + 1, chunk_end) or 0
+                self._save_checkpoint(connection, chunk_end, rows)
+            last_id = chunk_end
+            counts['rows'] += rows
+            counts['chunks'] += 1
+            elapsed = time.time() - started
+            if self.progress:
+                self.progress('%s: up to ID %d, %d rows in %.2fs (chunk size %d)'
+                              % (self.name, last_id, rows, elapsed, self.chunk_size))
+            self._throttle(elapsed)
+        return counts
+
+    def _chunk_end(self, connection, last_id):
+        # The ID of the last row of the next chunk, found with an index range scan
+        key_column = self.key_column
+        ids = select([key_column]).where(key_column > last_id).order_by(key_column) \
+            .limit(self.chunk_size).alias('chunk')
+        return connection.execute(select([ids.c[key_column.name]])
+                                  .order_by(ids.c[key_column.name].desc()).limit(1)).scalar()
+
+    def _save_checkpoint(self, connection, last_id, rows, finished=False):
+        checkpoints = self.checkpoints
+        now = datetime.datetime.utcnow()
+        values = dict(last_id=last_id, updated_at=now)
+        if finished:
+            values['finished_at'] = now
+        updated = connection.execute(checkpoints.update().where(checkpoints.c.name == self.name).values(
+            rows=checkpoints.c.rows + rows, chunks=checkpoints.c.chunks + (0 if finished else 1),
+            **values)).rowcount
+        if not updated:
+            connection.execute(checkpoints.insert().values(
+                name=self.name, rows=rows, chunks=0 if finished else 1, started_at=now, **values))
+
+    def _throttle(self, elapsed):
+        # Aim for chunks of about target_seconds: short enough to keep locks brief
+        if elapsed > self.target_seconds * 1.5:
+            self.chunk_size = max(self.min_chunk_size, self.chunk_size // 2)
+        elif elapsed < self.target_seconds / 2:
+            self.chunk_size = min(self.max_chunk_size, self.chunk_size * 2)
+        # Leave the database to other work for the rest of the duty cycle
+        if self.duty_cycle < 1:
+            time.sleep(elapsed * (1 - self.duty_cycle) / self.duty_cycle)
+
+
+def run_backfill(engine, name, table, update, max_chunks=None, **options):
+    """ Run or resume the backfill ``name``. See Backfill for the ``options``."""
+    return Backfill(engine, name, table, update, **options).run(max_chunks=max_chunks)
@@ -0,0 +1,96 @@
+# This file defines set-based bulk actions on users.
+#
+# Instead of loading each User into the session, each action runs one UPDATE, INSERT ... SELECT
+# or DELETE statement per chunk of user IDs, and commits after each chunk so that locks are short.
+# Cached users are invalidated after each chunk. Cached template fragments need no invalidation:
+# their keys include the role set, and none of them depends on whether a user is active.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import time
+
+from sqlalchemy import and_, exists, literal, not_, select
+
+from app import db
+from app.models.user_models import Role, User, UsersRoles
+from app.services.user_cache import user_cache
+from app.services.user_directory import clear_counts, filtered_query
+
+ACTIONS = ('activate', 'deactivate', 'grant_role', 'revoke_role')
+
+
+def id_chunks(user_ids, chunk_size=1000):
+    """ Split a list of user IDs into chunks."""
+    user_ids = sorted(set(int(user_id) for user_id in user_ids))
+    for start in range(0, len(user_ids), chunk_size):
+        yield user_ids[start:start + chunk_size]
+
+
+def filtered_id_chunks(search=u'', role_name=None, chunk_size=1000):
+    """ Yield the IDs of the users that match a user directory search, in chunks.
+    Chunks are fetched by keyset on the ID, so they stay correct while earlier chunks are updated."""
+    query = filtered_query(search, role_name)
+    if query is None:
+        return
+    last_id = 0
+    while True:
+        chunk = [user_id for (user_id,) in query.with_entities(User.id)
+                 .filter(User.id > last_id).order_by(User.id).limit(chunk_size)]
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]
+
+
+def run_bulk_action(action, user_id_chunks, role_name=None, pause=0):
+    """ Apply ``action`` to the users in ``user_id_chunks``, one transaction per chunk.
+
+    ``action`` is 'activate', 'deactivate', 'grant_role' or 'revoke_role' (with ``role_name``).
+    Sleeps ``pause`` seconds between chunks to let other writers in.
+    Returns a dict with the number of 'affected' rows and of processed 'users' and 'chunks'.
+    """
+    if action not in ACTIONS:
+        raise ValueError('action must be one of %s' % ', '.join(ACTIONS))
+    role_id = None
+    if action in ('grant_role', 'revoke_role'):
+        role_id = db.session.query(Role.id).filter(Role.name == role_name).scalar()
+        if role_id is None:
+            raise ValueError('Role %r does not exist.' % role_name)
+
+    counts = dict(affected=0, users=0, chunks=0)
+    for chunk in user_id_chunks:
+        if counts['chunks'] and pause:
+            time.sleep(pause)
+        statement = _statement(action, chunk, role_id)
+        counts['affected'] += db.session.execute(statement).rowcount
+        db.session.commit()
+        counts['users'] += len(chunk)
+        counts['chunks'] += 1
+
+        # The statements bypass the ORM, so cached users must be invalidated explicitly
+        user_cache.invalidate(*chunk)
+
+    if role_id is not None:
+        clear_counts()  # Role filter counts changed
+    return counts
+
+
+def _statement(action, user_ids, role_id):
+    users_roles = UsersRoles.__table__
+    if action in ('activate', 'deactivate'):
+        active = action == 'activate'
+        # UPDATE users SET is_active=:active WHERE id IN (...) AND is_active != :active
+        return User.__table__.update() \
+            .where(and_(User.id.in_(user_ids), User.active != active)) \
+            .values({User.active: active})
+    if action == 'grant_role':
+        # INSERT INTO users_roles (user_id, role_id) SELECT id, :role_id FROM users WHERE id IN (...)
+        # AND NOT EXISTS (the user already has the role)
+        has_role = exists().where(and_(users_roles.c.user_id == User.id, users_roles.c.role_id == role_id))
+        return users_roles.insert().from_select(
+            ['user_id', 'role_id'],
+            select([User.id, literal(role_id)]).where(and_(User.id.in_(user_ids), not_(has_role))))
+    # DELETE FROM users_roles WHERE role_id=:role_id AND user_id IN (...)
+    return users_roles.delete().where(and_(users_roles.c.role_id == role_id, users_roles.c.user_id.in_(user_ids)))
@@ -0,0 +1,211 @@
+# This file defines WSGI middleware that compresses responses with gzip or brotli.
+#
+# - The encoding is negotiated from the Accept-Encoding header: the first of COMPRESSION_ENCODINGS
+#   with the highest quality value. 'br' needs the optional brotli package.
+# - Only responses with one of COMPRESSION_CONTENT_TYPES and at least COMPRESSION_MIN_SIZE bytes
+#   are compressed. Responses that are already encoded (like the precompressed static files),
+#   partial responses and paths that start with one of COMPRESSION_EXCLUDE_PATHS are not.
+# - Streamed responses (without a Content-Length) are compressed chunk by chunk, and each chunk is
+#   flushed, so clients receive them as they are generated.
+# - Responses with a compressible content type get 'Vary: Accept-Encoding', compressed or not,
+#   so that caches keep the compressed and plain variants apart.
+# - A compressed response's ETag gets an encoding suffix: "1-3" becomes "1-3-gzip". The suffix is
+#   removed from If-Match and If-None-Match headers, so that views compare their own ETags.
+#
+# COMPRESSION_GZIP_LEVEL and COMPRESSION_BROTLI_QUALITY trade CPU time against bytes sent.
+# See 'python -m benchmarks.compression' for the numbers of this app's pages.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+
+# Brotli is an optional requirement
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_CONTENT_TYPES = ('text/html', 'text/css', 'text/plain', 'text/csv', 'text/xml', 'application/json',
+                         'application/javascript', 'application/x-ndjson', 'application/xml', 'image/svg+xml')
+
+
+def available_encodings(encodings):
+    """ Return the ``encodings`` that this process can produce."""
+    return tuple(encoding for encoding in encodings if encoding == 'gzip' or (encoding == 'br' and brotli))
+
+
+def make_compressor(encoding, gzip_level=6, brotli_quality=4):
+    """ Return a compressor with compress(data), flush() and finish() methods, which return bytes."""
+    if encoding == 'br':
+        return BrotliCompressor(brotli_quality)
+    return GzipCompressor(gzip_level)
+
+
+class GzipCompressor(object):
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip format
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor(object):
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressionMiddleware(object):
+    """ Compresses the responses of ``wsgi_app``. See the top of this file."""
+
+    def __init__(self, wsgi_app, encodings=('br', 'gzip'), gzip_level=6, brotli_quality=4, min_size=1024,
+                 content_types=DEFAULT_CONTENT_TYPES, exclude_paths=()):
+        self.wsgi_app = wsgi_app
+        self.encodings = available_encodings(encodings)
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        self.content_types = frozenset(content_types)
+        self.exclude_paths = tuple(exclude_paths)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if self.exclude_paths and path.startswith(self.exclude_paths):
+            return self.wsgi_app(environ, start_response)
+        encoding = self.negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        requested_suffix = _strip_etag_suffixes(environ)
+        chosen = {}
+
+        def compressing_start_response(status, headers, exc_info=None):
+            headers = Headers(headers)
+            chosen['encoding'] = self._response_encoding(environ, encoding, status, headers, requested_suffix)
+            if chosen['encoding']:
+                chosen['streamed'] = 'Content-Length' not in headers
+                del headers['Content-Length']
+                headers['Content-Encoding'] = chosen['encoding']
+            return start_response(status, headers.to_wsgi_list(), exc_info)
+
+        app_iter = self.wsgi_app(environ, compressing_start_response)
+        if 'encoding' in chosen and not chosen['encoding']:
+            return app_iter  # Unchanged, which keeps wsgi.file_wrapper responses efficient
+        return self._compress(app_iter, chosen)
+
+    def negotiate(self, accept_encoding):
+        """ Return the encoding to use for an Accept-Encoding header value, or None."""
+        if not accept_encoding or not self.encodings:
+            return None
+        accept = parse_accept_header(accept_encoding)
+        best, best_quality = None, 0
+        for encoding in self.encodings:
+            quality = accept[encoding]  # Also matches '*'
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def _response_encoding(self, environ, encoding, status, headers, requested_suffix):
+        # Adds Vary and the ETag suffix to ``headers``, and returns the encoding to compress with, or None
+        content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        status_code = int(status.split(None, 1)[0])
+        if status_code == 304:
+            # No body and usually no Content-Type: answer with the ETag that the client sent
+            if requested_suffix and requested_suffix == encoding:
+                _add_etag_suffix(headers, encoding)
+            return None
+        if content_type not in self.content_types:
+            return None
+        vary = [value.strip() for value in headers.get('Vary', '').split(',') if value.strip()]
+        if 'accept-encoding' not in [value.lower() for value in vary] and '*' not in vary:
+            headers['Vary'] = ', '.join(vary + ['Accept-Encoding'])
+
+        if not encoding or environ.get('REQUEST_METHOD') == 'HEAD' or status_code in (204, 206):
+            return None
+        if 'Content-Encoding' in headers or 'Content-Range' in headers \
+                or 'no-transform' in headers.get('Cache-Control', ''):
+            return None
+        content_length = headers.get('Content-Length')
+        if content_length is not None and content_length.isdigit() and int(content_length) < self.min_size:
+            return None
+        _add_etag_suffix(headers, encoding)
+        return encoding
+
+    def _compress(self, app_iter, chosen):
+        # ``chosen`` is filled in by start_response, which some apps only call when iterated
+        compressor = None
+        try:
+            for chunk in app_iter:
+                if compressor is None:
+                    if not chosen['encoding']:
+                        yield chunk
+                        continue
+                    compressor = make_compressor(chosen['encoding'], self.gzip_level, self.brotli_quality)
+                data = compressor.compress(chunk)
+                if chosen['streamed']:
+                    data += compressor.flush()  # Send each chunk of a streamed response as it comes
+                if data:
+                    yield data
+            if chosen.get('encoding'):
+                yield (compressor or make_compressor(chosen['encoding'], self.gzip_level,
+                                                     self.brotli_quality)).finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+ETAG_SUFFIXES = ('gzip', 'br')
+
+
+def _add_etag_suffix(headers, encoding):
+    etag = headers.get('ETag')
+    if etag and etag.endswith('"'):
+        headers['ETag'] = '%s-%s"' % (etag[:-1], encoding)
+
+
+def _strip_etag_suffixes(environ):
+    # Returns the encoding suffix found in If-None-Match, if any
+    found = None
+    for key in ('HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH'):
+        value = environ.get(key)
+        if not value:
+            continue
+        for encoding in ETAG_SUFFIXES:
+            suffix = '-%s"' % encoding
+            if suffix in value:
+                value = value.replace(suffix, '"')
+                if key == 'HTTP_IF_NONE_MATCH':
+                    found = encoding
+        environ[key] = value
+    return found
+
+
+def init_compression(app):
+    """ Compress the responses of ``app`` if COMPRESSION_ENABLED."""
+    config = app.config
+    if not config.get('COMPRESSION_ENABLED', True):
+        return
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app,
+        encodings=config.get('COMPRESSION_ENCODINGS', ('br', 'gzip')),
+        gzip_level=config.get('COMPRESSION_GZIP_LEVEL', 6),
+        brotli_quality=config.get('COMPRESSION_BROTLI_QUALITY', 4),
+        min_size=config.get('COMPRESSION_MIN_SIZE', 1024),
+        content_types=config.get('COMPRESSION_CONTENT_TYPES', DEFAULT_CONTENT_TYPES),
+        exclude_paths=config.get('COMPRESSION_EXCLUDE_PATHS', ()))
@@ -0,0 +1,207 @@
+# This file customizes how Flask-SQLAlchemy creates database engines.
+#
+# - Connection pool settings are read from SQLALCHEMY_ENGINE_OPTIONS, also for file SQLite databases
+#   (for which Flask-SQLAlchemy would otherwise use a NullPool).
+# - SQLite connections get the pragmas from SQLITE_PRAGMAS (WAL mode, busy timeout, ...).
+# - Pool checkouts and checkout wait times are counted (see pool_stats()).
+# - Reads of GET/HEAD requests can be routed to read replicas (see RoutingSession).
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import random
+import threading
+import time
+
+import sqlalchemy
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import UpdateBase
+
+# Engine options that only apply to a QueuePool
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_use_lifo')
+
+# The cookie that pins a user's reads to the primary after they wrote (a UNIX time)
+PRIMARY_PIN_COOKIE = 'db_primary_until'
+
+
+class PoolMetrics(object):
+    """ Counts connection checkouts and the time spent waiting for a pooled connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_checkout(self, wait_seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+
+class MeteredQueuePool(QueuePool):
+    """ A QueuePool that records checkout wait times in ``self.metrics``."""
+
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            connection = QueuePool._do_get(self)
+        except sqlalchemy.exc.TimeoutError:
+            self.metrics.record_checkout(time.time() - start, timed_out=True)
+            raise
+        self.metrics.record_checkout(time.time() - start)
+        return connection
+
+    def recreate(self):
+        # Keep counting across engine.dispose()
+        pool = QueuePool.recreate(self)
+        pool.metrics = self.metrics
+        return pool
+
+
+class RoutingSession(SignallingSession):
+    """ Routes reads of GET and HEAD requests to one of the DATABASE_READ_REPLICAS binds.
+
+    Flushes, INSERT/UPDATE/DELETE statements, and reads outside of GET/HEAD requests use the primary.
+    All replica reads of a transaction use the same replica, chosen at random.
+    Once a transaction has written, its remaining reads use the primary as well.
+    After committing a write, the user's reads stay on the primary for
+    DATABASE_PRIMARY_PIN_SECONDS so that they see their own changes despite replica lag.
+    The pin is kept in its own cookie, which is only set by requests that wrote.
+    """
+
+    def __init__(self, db, **options):
+        SignallingSession.__init__(self, db, **options)
+        self.db = db
+        self.wrote = False
+        self.replica = None  # The bind key of this transaction's replica
+        event.listen(self, 'after_commit', self._after_commit)
+        event.listen(self, 'after_rollback', self._after_rollback)
+        event.listen(self, 'after_transaction_end', self._after_transaction_end)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.wrote = True
+        elif not self.wrote and mapper is not None and not _has_bind_key(mapper):
+            replicas = self.app.config.get('DATABASE_READ_REPLICAS')
+            if replicas and _reads_may_use_replica():
+                if self.replica is None:
+                    self.replica = random.choice(replicas)
+                return self.db.get_engine(self.app, bind=self.replica)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def _after_commit(self, session):
+        if self.wrote and has_request_context() and self.app.config.get('DATABASE_READ_REPLICAS'):
+            pin_seconds = self.app.config.get('DATABASE_PRIMARY_PIN_SECONDS', 5)
+            g._db_primary_until = int(time.time() + pin_seconds) + 1  # Set as a cookie by set_primary_pin_cookie()
+        self.wrote = False
+
+    def _after_rollback(self, session):
+        self.wrote = False
+
+    def _after_transaction_end(self, session, transaction):
+        if transaction.parent is None:
+            self.replica = None  # The next transaction may use another replica
+
+
+def _has_bind_key(mapper):
+    return mapper.persist_selectable.info.get('bind_key') is not None
+
+
+def _reads_may_use_replica():
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return False
+    try:
+        return float(request.cookies.get(PRIMARY_PIN_COOKIE, 0)) < time.time()
+    except ValueError:
+        return True
+
+
+def set_primary_pin_cookie(response):
+    """ after_request handler: pin the user's reads to the primary after a request that wrote."""
+    primary_until = g.pop('_db_primary_until', None)
+    if primary_until:
+        response.set_cookie(PRIMARY_PIN_COOKIE, str(primary_until), max_age=max(primary_until - int(time.time()), 1),
+                            httponly=True, samesite='Lax')
+    return response
+
+
+class AppSQLAlchemy(SQLAlchemy):
+    """ Flask-SQLAlchemy with a metered connection pool, SQLite pragmas and read replica routing."""
+
+    def init_app(self, app):
+        SQLAlchemy.init_app(self, app)
+        if app.config.get('DATABASE_READ_REPLICAS'):
+            app.after_request(set_primary_pin_cookie)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        # Flask-SQLAlchemy picks a NullPool for file SQLite databases unless a pool size is set,
+        # before SQLALCHEMY_ENGINE_OPTIONS are applied: make it see the configured pool size
+        pool_size = (app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}).get('pool_size')
+        if pool_size:
+            options.setdefault('pool_size', pool_size)
+        return SQLAlchemy.apply_driver_hacks(self, app, sa_url, options)
+
+    def create_engine(self, sa_url, engine_opts):
+        poolclass = engine_opts.get('poolclass')
+        if poolclass is None:
+            engine_opts['poolclass'] = MeteredQueuePool
+            if sa_url.drivername.startswith('sqlite'):
+                # Pooled connections are used by one thread at a time, but not always the one that opened them
+                connect_args = engine_opts['connect_args'] = dict(engine_opts.get('connect_args') or {})
+                connect_args.setdefault('check_same_thread', False)
+        elif not issubclass(poolclass, QueuePool):
+            # E.g. the StaticPool used for in-memory SQLite databases
+            for option in QUEUE_POOL_OPTIONS:
+                engine_opts.pop(option, None)
+        engine = sqlalchemy.create_engine(sa_url, **engine_opts)
+
+        if engine.dialect.name == 'sqlite':
+            pragmas = self.get_app().config.get('SQLITE_PRAGMAS') or {}
+            if sa_url.database in (None, '', ':memory:'):
+                pragmas = dict(pragmas)
+                pragmas.pop('journal_mode', None)  # In-memory databases have no journal file
+            if pragmas:
+                event.listen(engine, 'connect', _sqlite_pragmas_setter(pragmas))
+        return engine
+
+
+def _sqlite_pragmas_setter(pragmas):
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s=%s' % (name, value))
+        cursor.close()
+    return set_sqlite_pragmas
+
+
+def pool_stats(engine):
+    """ Return a dict with the pool size, connections in use and checkout metrics of ``engine``."""
+    pool = engine.pool
+    stats = dict(pool_class=pool.__class__.__name__)
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    metrics = getattr(pool, 'metrics', None)
+    if metrics:
+        stats.update(
+            checkouts=metrics.checkouts,
+            timeouts=metrics.timeouts,
+            wait_seconds_total=metrics.wait_seconds_total,
+            wait_seconds_max=metrics.wait_seconds_max)
+    return stats
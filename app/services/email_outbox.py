@@ -0,0 +1,163 @@
+# This file defines a persistent email outbox.
+#
+# The web app only queues emails in the 'email_outbox' table.
+# 'python manage.py email_worker' delivers them in batches from a separate process.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from flask_mail import Message
+from flask_user.email_adapters import EmailAdapterInterface
+
+from app import db, mail
+from app.models.email_models import EmailOutbox
+
+
+class OutboxEmailAdapter(EmailAdapterInterface):
+    """ Implements Flask-User's EmailAdapter interface by queueing emails in the email_outbox table."""
+
+    def send_email_message(self, recipient, subject, html_message, text_message, sender_email, sender_name):
+        """ Queue an email message for delivery by the email worker."""
+        queue_email(recipient, subject, html_message, text_message, sender_email, sender_name)
+        # Flask-User commits its own changes before sending emails, and not always after
+        db.session.commit()
+
+
+def queue_email(recipient, subject, html_message, text_message, sender_email, sender_name=None):
+    """ Add an email message to the outbox. The caller commits it, with the rest of its transaction."""
+    # Construct sender from sender_name and sender_email
+    sender = '"%s" <%s>' % (sender_name, sender_email) if sender_name else sender_email
+    now = datetime.datetime.utcnow()
+    email = EmailOutbox(
+        recipient=recipient,
+        sender=sender,
+        subject=subject,
+        html_message=html_message,
+        text_message=text_message,
+        status=EmailOutbox.STATUS_PENDING,
+        attempts=0,
+        next_attempt_at=now,
+        created_at=now)
+    db.session.add(email)
+    db.session.flush()
+    return email
+
+
+def deliver_emails():
+    """ Deliver one batch of due emails.
+
+    The batch is split across EMAIL_OUTBOX_WORKERS threads.
+    Each thread sends its share over a single SMTP connection.
+    Failed emails are retried with exponential backoff, up to EMAIL_OUTBOX_MAX_ATTEMPTS times.
+    Claiming an email counts as an attempt, so emails that crash the worker are not retried forever.
+
+    Returns a dict with the number of 'sent', 'retried' and 'failed' emails.
+    """
+    config = current_app.config
+    batch_size = config.get('EMAIL_OUTBOX_BATCH_SIZE', 100)
+    workers = config.get('EMAIL_OUTBOX_WORKERS', 4)
+    max_attempts = config.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+    counts = dict(sent=0, retried=0, failed=0)
+
+    counts['failed'] += _fail_abandoned_emails(max_attempts)
+    messages = _claim_emails(batch_size, config.get('EMAIL_OUTBOX_LEASE', 300))
+    if not messages:
+        return counts
+
+    # Send messages in parallel, one SMTP connection per chunk
+    app = current_app._get_current_object()
+    chunks = [messages[i::workers] for i in range(workers) if messages[i::workers]]
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        results = [result
+                   for chunk_results in executor.map(lambda chunk: _send_chunk(app, chunk), chunks)
+                   for result in chunk_results]
+
+    # Record delivery status
+    now = datetime.datetime.utcnow()
+    retry_delay = config.get('EMAIL_OUTBOX_RETRY_DELAY', 60)
+    emails = EmailOutbox.query.filter(EmailOutbox.id.in_([id for id, error in results])).all()
+    errors = dict(results)
+    for email in emails:
+        error = errors[email.id]
+        if error is None:
+            email.status = EmailOutbox.STATUS_SENT
+            email.sent_at = now
+            email.last_error = u''
+            counts['sent'] += 1
+        elif email.attempts >= max_attempts:
+            email.status = EmailOutbox.STATUS_FAILED
+            email.last_error = error[:255]
+            counts['failed'] += 1
+        else:
+            email.status = EmailOutbox.STATUS_PENDING
+            email.next_attempt_at = now + datetime.timedelta(seconds=retry_delay * 2 ** (email.attempts - 1))
+            email.last_error = error[:255]
+            counts['retried'] += 1
+    db.session.commit()
+    return counts
+
+
+def _fail_abandoned_emails(max_attempts):
+    # Emails left in 'sending' by crashed workers after their last attempt are not claimed again
+    now = datetime.datetime.utcnow()
+    count = EmailOutbox.query \
+        .filter(EmailOutbox.status == EmailOutbox.STATUS_SENDING, EmailOutbox.next_attempt_at <= now,
+                EmailOutbox.attempts >= max_attempts) \
+        .update(dict(status=EmailOutbox.STATUS_FAILED, last_error=u'Not delivered after %d attempts' % max_attempts),
+                synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def _claim_emails(batch_size, lease):
+    # Select due emails. Emails left in 'sending' by a crashed worker become due when their lease expires.
+    now = datetime.datetime.utcnow()
+    due_ids = [id for (id,) in db.session.query(EmailOutbox.id)
+               .filter(EmailOutbox.status.in_([EmailOutbox.STATUS_PENDING, EmailOutbox.STATUS_SENDING]))
+               .filter(EmailOutbox.next_attempt_at <= now)
+               .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+               .limit(batch_size)]
+    if not due_ids:
+        return []
+
+    # Claim them with a lease, and count the attempt.
+    # Emails claimed by a concurrent worker keep that worker's lease.
+    lease_until = now + datetime.timedelta(seconds=lease)
+    EmailOutbox.query \
+        .filter(EmailOutbox.id.in_(due_ids), EmailOutbox.next_attempt_at <= now) \
+        .update(dict(status=EmailOutbox.STATUS_SENDING, next_attempt_at=lease_until,
+                     attempts=EmailOutbox.attempts + 1),
+                synchronize_session=False)
+    db.session.commit()
+
+    # Return plain tuples so that the sending threads never touch the DB session
+    return db.session.query(EmailOutbox.id, EmailOutbox.recipient, EmailOutbox.sender, EmailOutbox.subject,
+                            EmailOutbox.html_message, EmailOutbox.text_message) \
+        .filter(EmailOutbox.id.in_(due_ids), EmailOutbox.next_attempt_at == lease_until) \
+        .order_by(EmailOutbox.id).all()
+
+
+def _send_chunk(app, messages):
+    # Send messages over one SMTP connection. Returns a list of (id, error_message_or_None).
+    results = []
+    with app.app_context():
+        try:
+            with mail.connect() as connection:
+                for id, recipient, sender, subject, html_message, text_message in messages:
+                    try:
+                        connection.send(Message(subject, sender=sender, recipients=[recipient],
+                                                html=html_message, body=text_message))
+                        results.append((id, None))
+                    except Exception as e:
+                        results.append((id, u'%s: %s' % (e.__class__.__name__, e)))
+        except Exception as e:
+            # Connection errors fail the remaining messages of this chunk
+            error = u'%s: %s' % (e.__class__.__name__, e)
+            done = set(id for id, _ in results)
+            results.extend((message[0], error) for message in messages if message[0] not in done)
+    return results
@@ -0,0 +1,197 @@
+# This file defines a non-blocking, deduplicating error-email logging handler.
+#
+# Error records are put on a queue by the request thread and emailed from a background thread.
+# Repeats of the same error are collapsed into periodic digest emails.
+#
+# fork() does not copy threads: a forked worker process starts its own listener thread, with its own
+# queue, when it logs its first error. Workers that exit with os._exit() call listener.stop() first.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import atexit
+import hashlib
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from email.message import EmailMessage
+from logging.handlers import QueueHandler
+
+
+def fingerprint(record):
+    """ Identify an error by its exception type and traceback,
+    or by its logger, source location and message template if there is no exception."""
+    if record.exc_info and record.exc_info[0]:
+        exc_type, exc_value, exc_tb = record.exc_info
+        key = exc_type.__module__ + '.' + exc_type.__name__ + '\n' + ''.join(traceback.format_tb(exc_tb))
+    else:
+        key = '%s\n%s:%s\n%s' % (record.name, record.pathname, record.lineno, record.msg)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+class ErrorQueueHandler(QueueHandler):
+    """ Puts fingerprinted, pre-formatted records on a bounded queue.
+    Never blocks: records are dropped (and counted) when the queue is full."""
+
+    def __init__(self, error_queue, listener=None):
+        QueueHandler.__init__(self, error_queue)
+        self.listener = listener
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Fingerprint before QueueHandler.prepare() removes exc_info
+        record_fingerprint = fingerprint(record)
+        record = QueueHandler.prepare(self, record)
+        record.fingerprint = record_fingerprint
+        return record
+
+    def enqueue(self, record):
+        if self.listener is not None and self.listener.pid != os.getpid():
+            self.queue = self.listener.restart_after_fork()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class ErrorDigestListener(object):
+    """ Emails error records from a background thread.
+
+    The first occurrence of an error is emailed right away.
+    Repeats within ``digest_interval`` seconds are counted and emailed as one digest.
+    No more than ``max_emails_per_hour`` emails are sent; the rest wait for the next digest.
+    """
+
+    def __init__(self, error_queue, send_email, subject, digest_interval=300, max_emails_per_hour=20):
+        self.queue = error_queue
+        self.send_email = send_email  # send_email(subject, body)
+        self.subject = subject
+        self.digest_interval = digest_interval
+        self.max_emails_per_hour = max_emails_per_hour
+        self.sent_at = deque()  # Send times within the last hour
+        self.seen = set()  # Fingerprints emailed during this digest interval
+        self.pending = OrderedDict()  # fingerprint -> [count, first message]
+        self.next_digest_at = time.time() + digest_interval
+        self._stop = object()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.pid = None  # The process that runs the thread
+
+    def start(self):
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='error-mailer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def restart_after_fork(self):
+        """ Start this process's own thread, with a new queue, in a forked process. Returns the queue.
+        Records that the parent process queued or counted before the fork are left to the parent."""
+        with self._lock:
+            if self.pid != os.getpid():
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                self.sent_at.clear()
+                self.seen.clear()
+                self.pending.clear()
+                self.next_digest_at = time.time() + self.digest_interval
+                self.start()
+            return self.queue
+
+    def stop(self):
+        """ Stop the background thread after emailing any pending digest."""
+        if self._thread and self.pid == os.getpid():
+            self.queue.put(self._stop)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            timeout = max(0.0, self.next_digest_at - time.time())
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+            if record is self._stop:
+                self.flush()
+                return
+            if record is not None:
+                self.handle(record)
+            if time.time() >= self.next_digest_at:
+                self.flush()
+
+    def handle(self, record):
+        if record.fingerprint not in self.seen and self._may_send():
+            self.seen.add(record.fingerprint)
+            self._send(self.subject, record.getMessage())
+        else:
+            entry = self.pending.setdefault(record.fingerprint, [0, record.getMessage()])
+            entry[0] += 1
+
+    def flush(self):
+        """ Email one digest of the repeated errors and start a new digest interval."""
+        self.next_digest_at = time.time() + self.digest_interval
+        self.seen.clear()
+        if not self.pending or not self._may_send():
+            return  # Keep counting until an email may be sent
+        total = sum(count for count, message in self.pending.values())
+        sections = ['%d occurrence(s) of error %s:\n\n%s' % (count, error_fingerprint, message)
+                    for error_fingerprint, (count, message) in self.pending.items()]
+        self.pending.clear()
+        self._send('%s (digest: %d errors)' % (self.subject, total), ('\n\n' + '-' * 70 + '\n\n').join(sections))
+
+    def _may_send(self):
+        now = time.time()
+        while self.sent_at and self.sent_at[0] <= now - 3600:
+            self.sent_at.popleft()
+        return len(self.sent_at) < self.max_emails_per_hour
+
+    def _send(self, subject, body):
+        self.sent_at.append(time.time())
+        try:
+            self.send_email(subject, body)
+        except Exception:
+            # Never let email problems kill the listener thread
+            traceback.print_exc()
+
+
+def smtp_sender(host, port, from_addr, to_addr_list, username=None, password=None, use_tls=False):
+    """ Return a send_email(subject, body) function that sends through SMTP."""
+    def send_email(subject, body):
+        message = EmailMessage()
+        message['From'] = from_addr
+        message['To'] = ', '.join(to_addr_list)
+        message['Subject'] = subject
+        message.set_content(body)
+        smtp = smtplib.SMTP(host, port, timeout=30)
+        try:
+            if use_tls:
+                smtp.starttls()
+            if username:
+                smtp.login(username, password)
+            smtp.send_message(message)
+        finally:
+            smtp.quit()
+    return send_email
+
+
+def init_error_mailer(app, send_email, subject):
+    """ Attach an ErrorQueueHandler to app.logger and start its ErrorDigestListener."""
+    error_queue = queue.Queue(maxsize=app.config.get('ERROR_EMAIL_QUEUE_SIZE', 1000))
+    listener = ErrorDigestListener(
+        error_queue,
+        send_email,
+        subject,
+        digest_interval=app.config.get('ERROR_EMAIL_DIGEST_INTERVAL', 300),
+        max_emails_per_hour=app.config.get('ERROR_EMAIL_MAX_PER_HOUR', 20))
+    handler = ErrorQueueHandler(error_queue, listener)
+    handler.setLevel(logging.ERROR)
+    listener.start()
+    atexit.register(listener.stop)
+    app.logger.addHandler(handler)
+    app.extensions['error_mailer'] = listener  # Stopped by prefork workers before they exit
+    return listener
@@ -0,0 +1,171 @@
+# This file defines write-behind tracking of logins.
+#
+# Flask-User's user_logged_in signal only appends the login to an in-memory buffer, so the login
+# request does no extra database work. A background thread writes the buffer every
+# LOGIN_ACTIVITY_FLUSH_INTERVAL seconds, in one transaction:
+#
+# - one multi-row INSERT (executemany) of the buffered logins into the login_events table,
+# - one UPDATE of users.last_login_at and users.login_count for all users that logged in.
+#
+# The buffer holds at most LOGIN_ACTIVITY_MAX_BUFFER logins. The thread is woken early when the
+# buffer is half full, and logins are dropped (and counted) only when it is full, e.g. while the
+# database is unavailable. Buffered logins are written when the process exits.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import atexit
+import datetime
+import logging
+import os
+import threading
+
+from flask import has_request_context, request
+from sqlalchemy import case
+
+logger = logging.getLogger(__name__)
+
+
+class LoginActivity(object):
+    """ Buffers logins in memory and writes them in batches."""
+
+    def __init__(self, app=None, db=None):
+        self.enabled = False
+        self.buffer = []  # (user_id, logged_in_at, ip_address) tuples
+        self.dropped = 0
+        self._lock = threading.Lock()  # Guards the buffer
+        self._flush_lock = threading.Lock()  # One flush at a time
+        self._wake = threading.Event()
+        self._pid = None
+        self._thread_pid = None
+        self._atexit_registered = False
+        if app:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.enabled = app.config.get('LOGIN_ACTIVITY_ENABLED', True)
+        if not self.enabled:
+            return
+        self.app = app
+        self.db = db
+        self.flush_interval = app.config.get('LOGIN_ACTIVITY_FLUSH_INTERVAL', 5)
+        self.max_buffer = app.config.get('LOGIN_ACTIVITY_MAX_BUFFER', 10000)
+
+        from flask_user.signals import user_logged_in
+        user_logged_in.connect(self._on_login, app, weak=False)
+        if not self._atexit_registered:
+            atexit.register(self._flush_at_exit)
+            self._atexit_registered = True
+
+    def _on_login(self, sender, user, **extra):
+        ip_address = (request.remote_addr or '') if has_request_context() else ''
+        self.record(user.id, ip_address=ip_address)
+
+    def record(self, user_id, logged_in_at=None, ip_address=''):
+        """ Buffer a login of ``user_id``. Returns False if the buffer was full and the login was dropped."""
+        self._check_pid()
+        login = (user_id, logged_in_at or datetime.datetime.utcnow(), ip_address[:45])
+        flush_now = False
+        with self._lock:
+            if len(self.buffer) >= self.max_buffer:
+                if self.flush_interval:
+                    self.dropped += 1
+                    return False
+                flush_now = True  # No background thread: make room in this thread
+            else:
+                self.buffer.append(login)
+                if self.flush_interval and len(self.buffer) >= self.max_buffer // 2:
+                    self._wake.set()
+        if flush_now:
+            self.flush()
+            return self.record(*login)
+        return True
+
+    def flush(self):
+        """ Write the buffered logins. Returns the number of written logins.
+        If the database write fails, the logins are put back in the buffer and the error is raised."""
+        if not self.enabled:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                logins, self.buffer = self.buffer, []
+            if not logins:
+                return 0
+            try:
+                self._write(logins)
+            except Exception:
+                with self._lock:
+                    # Retry them with the next flush, keeping the newest logins if there are too many
+                    self.buffer = (logins + self.buffer)[-self.max_buffer:]
+                raise
+            return len(logins)
+
+    def _write(self, logins):
+        from app.models.login_models import LoginEvent
+        from app.models.user_models import User
+        # Per user: the number of logins and the time of the last one
+        counts, last_logins = {}, {}
+        for user_id, logged_in_at, ip_address in logins:
+            counts[user_id] = counts.get(user_id, 0) + 1
+            last_logins[user_id] = max(last_logins.get(user_id, logged_in_at), logged_in_at)
+
+        users = User.__table__
+        user_ids = sorted(counts)
+        with self.db.get_engine(self.app).begin() as connection:
+            connection.execute(LoginEvent.__table__.insert(), [
+                dict(user_id=user_id, logged_in_at=logged_in_at, ip_address=ip_address)
+                for user_id, logged_in_at, ip_address in logins])
+            # UPDATE users SET login_count=login_count + CASE id WHEN ... END, last_login_at=CASE ... END
+            #     WHERE id IN (...)
+            # Bypasses the ORM, so users.version (the profile's ETag) does not change.
+            connection.execute(users.update().where(users.c.id.in_(user_ids)).values(
+                login_count=users.c.login_count + case(counts, value=users.c.id, else_=0),
+                last_login_at=case(
+                    [(users.c.id == user_id, last_logins[user_id]) for user_id in user_ids],
+                    else_=users.c.last_login_at)))
+
+    def clear(self):
+        """ Forget the buffered logins without writing them."""
+        with self._lock:
+            self.buffer = []
+            self.dropped = 0
+
+    def _check_pid(self):
+        # Forked worker processes start with an empty buffer (the parent writes its own)
+        # and their own flusher thread
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self.buffer = []
+                    self._pid = os.getpid()
+        if self.flush_interval and self._thread_pid != os.getpid():
+            with self._lock:
+                if self._thread_pid != os.getpid():
+                    self._thread_pid = os.getpid()
+                    thread = threading.Thread(target=self._flush_forever, name='login-activity')
+                    thread.daemon = True
+                    thread.start()
+
+    def _flush_forever(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # The database may be briefly unavailable; the logins are retried next time
+                logger.exception('Could not write %d buffered logins (%d dropped so far).',
+                                 len(self.buffer), self.dropped)
+
+    def _flush_at_exit(self):
+        if self._pid != os.getpid():
+            return  # Only the process that buffered the logins writes them
+        try:
+            self.flush()
+        except Exception:
+            self.app.logger.exception('Could not write %d buffered logins.', len(self.buffer))
+
+
+# Shared instance, initialized by create_app()
+login_activity = LoginActivity()
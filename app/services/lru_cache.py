@@ -0,0 +1,76 @@
+# This file defines a small thread-safe LRU cache with optional time-to-live.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ A size-bounded, thread-safe Least-Recently-Used cache.
+
+    Entries older than ``ttl`` seconds are treated as misses (ttl=None disables expiry).
+    Hit, miss and eviction counters are kept so the cache can be sized from real traffic.
+    """
+
+    def __init__(self, max_size=1000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """ Return the cached value for ``key`` or ``default``."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                # Expired: drop the stale entry
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """ Store ``value`` under ``key``, evicting the least recently used entries if needed."""
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """ Remove ``key`` from the cache. Missing keys are ignored."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """ Return a dict with the cache counters and the current hit ratio."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                size=len(self._data),
+                max_size=self.max_size,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_ratio=(float(self.hits) / lookups) if lookups else 0.0,
+            )
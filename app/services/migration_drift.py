@@ -0,0 +1,83 @@
+# This file detects drift between the models and the migrations.
+#
+# check_migration_drift() applies all migrations to an empty SQLite database and compares the
+# resulting schema with the models, the same way 'python manage.py db migrate' autogenerates
+# a revision. Any difference means that a model change has no migration (or the reverse).
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import os
+import shutil
+import tempfile
+import warnings
+
+# Tables that are created by raw DDL rather than by the models
+UNMODELED_TABLE_PREFIXES = ('users_fts',)
+
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                    'migrations')
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """ Alembic include_object hook: ignore the tables that the models do not define,
+    and indexes on expressions (like lower(email)), which SQLAlchemy cannot reflect from SQLite."""
+    if type_ == 'table' and reflected and compare_to is None:
+        return not name.startswith(UNMODELED_TABLE_PREFIXES)
+    if type_ == 'index' and not reflected and compare_to is None:
+        return all(hasattr(expression, 'table') for expression in object.expressions)
+    return True
+
+
+def check_migration_drift(directory=MIGRATIONS_DIRECTORY):
+    """ Return a list of descriptions of the differences between the migrated schema and the models.
+    An empty list means that there is no drift."""
+    from alembic import command
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    from app import create_app, db
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        database_path = os.path.join(temp_directory, 'drift.sqlite')
+        app = create_app(dict(SQLALCHEMY_DATABASE_URI='sqlite:///' + database_path), entry_point='db')
+        with app.app_context():
+            migrate = app.extensions['migrate'].migrate
+            config = migrate.get_config(directory)
+            config.attributes['configure_logger'] = False
+
+            heads = ScriptDirectory.from_config(config).get_heads()
+            if len(heads) > 1:
+                return ['Multiple heads: %s. Merge them with "python manage.py db merge".' % ', '.join(heads)]
+            command.upgrade(config, 'head')
+
+            engine = db.get_engine(app)
+            with engine.connect() as connection:
+                context = MigrationContext.configure(connection, opts=dict(include_object=include_object))
+                with warnings.catch_warnings():
+                    warnings.filterwarnings('ignore', 'Skipped unsupported reflection of expression-based index')
+                    differences = compare_metadata(context, db.metadata)
+            engine.dispose()
+        return [_describe(difference) for difference in differences]
+    finally:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+
+
+def _describe(difference):
+    # compare_metadata() returns tuples like ('add_table', Table), or lists of column modifications
+    if isinstance(difference, list):
+        return '; '.join(_describe(item) for item in difference)
+    operation, args = difference[0], difference[1:]
+    described = []
+    for arg in args:
+        name = getattr(arg, 'name', None)
+        table = getattr(arg, 'table', None)
+        if name and table is not None and getattr(table, 'name', None):
+            described.append('%s.%s' % (table.name, name))
+        elif name:
+            described.append(str(name))
+        elif arg is not None and not isinstance(arg, dict):
+            described.append(str(arg))
+    return '%s %s' % (operation, ' '.join(described))
@@ -0,0 +1,234 @@
+# This file defines full-page caching for anonymous visitors and a Jinja2 fragment cache.
+#
+# Full pages are cached per URL and served with strong ETags (and '304 Not Modified' responses).
+# Template fragments are cached per user ID and role set with:
+#     {% cache 'header' %}...{% endcache %}
+# Fragments that are the same for every visitor are cached once, for everyone, with:
+#     {% cache 'footer' global %}...{% endcache %}
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+import uuid
+from functools import wraps
+
+from flask import current_app, request, session
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from app.services.lru_cache import LRUCache
+
+
+class MemoryCacheBackend(object):
+    """ Stores cache entries in an in-process LRU cache."""
+
+    def __init__(self, max_entries, ttl):
+        self.cache = LRUCache(max_size=max_entries, ttl=ttl)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class FileSystemCacheBackend(object):
+    """ Stores cache entries as files in a directory that can be shared by several processes.
+
+    The least recently used files are removed when there are more than ``max_entries``.
+    Hit and miss counters are per process.
+    """
+
+    def __init__(self, directory, max_entries, ttl):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                expires_at, value = pickle.load(cache_file)
+            if expires_at is None or expires_at > time.time():
+                os.utime(path, None)  # Mark as recently used
+                self._count('hits')
+                return value
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            pass
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        path = self._path(key)
+        # Write-then-rename so that readers in other processes never see a partial file
+        temp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        with open(temp_path, 'wb') as cache_file:
+            pickle.dump((expires_at, value), cache_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, path)
+        self._evict()
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            self._remove(os.path.join(self.directory, filename))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(os.listdir(self.directory)),
+            max_size=self.max_entries,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_ratio=(float(self.hits) / lookups) if lookups else 0.0,
+        )
+
+    def _evict(self):
+        filenames = os.listdir(self.directory)
+        if len(filenames) <= self.max_entries:
+            return
+        paths = [os.path.join(self.directory, filename) for filename in filenames]
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            if self._remove(path):
+                self._count('evictions')
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False  # Already removed by another process
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+class PageCache(object):
+    """ Caches full pages for anonymous visitors and template fragments per user."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.enabled = False
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PAGE_CACHE_ENABLED', True)
+        max_entries = app.config.get('PAGE_CACHE_MAX_ENTRIES', 1000)
+        ttl = app.config.get('PAGE_CACHE_TTL', 300)
+        if app.config.get('PAGE_CACHE_BACKEND', 'memory') == 'filesystem':
+            self.backend = FileSystemCacheBackend(app.config['PAGE_CACHE_DIR'], max_entries, ttl)
+        else:
+            self.backend = MemoryCacheBackend(max_entries, ttl)
+
+        # Add the {% cache %} tag to Jinja2
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.page_cache = self
+
+    def cached(self, view_function):
+        """ View decorator: cache the page for anonymous GET requests and answer conditional requests."""
+        @wraps(view_function)
+        def decorator(*args, **kwargs):
+            if not self._may_cache_page():
+                return view_function(*args, **kwargs)
+
+            key = 'page:' + request.full_path
+            entry = self.backend.get(key)
+            if entry is None:
+                response = current_app.make_response(view_function(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+                body = response.get_data()
+                etag = hashlib.sha1(body).hexdigest()
+                entry = (body, response.mimetype, etag)
+                self.backend.set(key, entry)
+
+            body, mimetype, etag = entry
+            response = current_app.response_class(body, mimetype=mimetype)
+            response.set_etag(etag)  # Strong ETag
+            response.vary.add('Cookie')  # Logged-in users get a different page
+            return response.make_conditional(request)
+
+        return decorator
+
+    def _may_cache_page(self):
+        if not self.enabled or request.method not in ('GET', 'HEAD'):
+            return False
+        # Pages with one-time flash messages are never cached
+        return not current_user.is_authenticated and '_flashes' not in session
+
+    def fragment_key(self, name, extra_keys, is_global=False):
+        # Fragments vary by user ID and role set. The user's generation changes with invalidate_user().
+        if is_global:
+            user_key = 'global'
+        elif current_user.is_authenticated:
+            user_key = '%s:%s:%s' % (current_user.id, ','.join(sorted(current_user.role_names)),
+                                     self.backend.get('generation:%s' % current_user.id) or '')
+        else:
+            user_key = 'anonymous'
+        return 'fragment:%s:%s:%s' % (name, user_key, ':'.join(str(extra_key) for extra_key in extra_keys))
+
+    def invalidate_user(self, user_id):
+        """ Invalidate all template fragments cached for ``user_id``."""
+        if self.backend:
+            self.backend.set('generation:%s' % user_id, uuid.uuid4().hex)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats()
+
+
+class FragmentCacheExtension(Extension):
+    """ Adds a {% cache name[, extra_key, ...] [global] %}...{% endcache %} tag to Jinja2."""
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        is_global = parser.stream.skip_if('name:global')
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_fragment', [nodes.List(args), nodes.Const(is_global)]),
+                               [], [], body).set_lineno(lineno)
+
+    def _render_fragment(self, args, is_global, caller):
+        page_cache = self.environment.page_cache
+        if not page_cache.enabled:
+            return caller()
+        key = page_cache.fragment_key(args[0], args[1:], is_global)
+        fragment = page_cache.backend.get(key)
+        if fragment is None:
+            fragment = caller()
+            page_cache.backend.set(key, fragment)
+        return fragment
+
+
+# Shared instance, initialized by create_app()
+page_cache = PageCache()
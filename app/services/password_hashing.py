@@ -0,0 +1,119 @@
+# This file defines a PasswordManager that hashes and verifies passwords in a process pool.
+#
+# Password hashing is CPU-bound by design. Running it in separate processes keeps the
+# web worker threads (and their GIL) free to serve other requests during a login spike.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import g
+from flask_user.password_manager import PasswordManager
+from passlib.context import CryptContext
+
+
+class PoolPasswordManager(PasswordManager):
+    """ Hash and verify passwords in a bounded process pool.
+
+    Also detects stored hashes that use an outdated scheme or cost (see 'python manage.py calibrate_hashing')
+    so that LoginForm can transparently replace them after a successful login.
+    """
+
+    def __init__(self, app):
+        super(PoolPasswordManager, self).__init__(app)
+        self.workers = app.config.get('PASSWORD_HASHING_WORKERS', 2)
+        self.max_pending = app.config.get('PASSWORD_HASHING_MAX_PENDING', 64)
+        self._crypt_context_string = self.password_crypt_context.to_string()
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._pending = threading.BoundedSemaphore(self.max_pending)
+
+    def hash_password(self, password):
+        return self._run(hash_password, password)
+
+    def verify_password(self, password, password_hash):
+        valid, new_hash = self._run(verify_and_update_password, password, password_hash)
+        if valid and new_hash:
+            # Remember the upgraded hash for LoginForm (see apply_pending_rehash())
+            g._password_rehash = (password_hash, new_hash)
+        return valid
+
+    def has_pending_rehash(self):
+        """ Return True if the last verify_password() call computed an upgraded hash."""
+        return '_password_rehash' in g
+
+    def apply_pending_rehash(self, user):
+        """ Replace ``user.password`` with an upgraded hash computed by the last verify_password() call.
+        Returns True if the user's password hash was changed."""
+        rehash = g.pop('_password_rehash', None)
+        if rehash and rehash[0] == user.password:
+            user.password = rehash[1]
+            return True
+        return False
+
+    def _run(self, function, *args):
+        # Wait for a free slot so the pool's backlog stays bounded
+        with self._pending:
+            return self._get_executor().submit(function, *args).result()
+
+    def _get_executor(self):
+        # Create the pool lazily, and again after a fork: pools do not survive os.fork()
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, initializer=init_hasher,
+                        initargs=(self._crypt_context_string,))
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+
+# Each hashing process re-creates the app's passlib CryptContext
+_crypt_context = None
+
+
+def init_hasher(crypt_context_string):
+    global _crypt_context
+    _crypt_context = CryptContext.from_string(crypt_context_string)
+
+
+def hash_password(password):
+    return _crypt_context.hash(password)
+
+
+def verify_and_update_password(password, password_hash):
+    # Returns (valid, new_hash). new_hash is None unless password_hash needs an upgrade.
+    return _crypt_context.verify_and_update(password, password_hash)
+
+
+def calibrate_cost(scheme, target_seconds, samples=3, progress=None):
+    """ Return the highest cost (rounds) for ``scheme`` whose median hash time stays within ``target_seconds``."""
+    from passlib.registry import get_crypt_handler
+    handler = get_crypt_handler(scheme)
+    if not getattr(handler, 'min_rounds', None):
+        raise ValueError('Password hash scheme %s has no configurable cost.' % scheme)
+
+    # bcrypt-style schemes use a log2 cost, others a linear number of rounds
+    linear = getattr(handler, 'rounds_cost', 'linear') == 'linear'
+    rounds = max(handler.min_rounds, 1000) if linear else handler.min_rounds
+    best_rounds = None
+    while rounds <= handler.max_rounds:
+        durations = []
+        for i in range(samples):
+            start = time.time()
+            handler.using(rounds=rounds).hash('calibrate-password')
+            durations.append(time.time() - start)
+        duration = sorted(durations)[len(durations) // 2]
+        if progress:
+            progress('%s rounds=%d: %.1f ms' % (scheme, rounds, duration * 1000))
+        if duration > target_seconds:
+            break
+        best_rounds = rounds
+        rounds = int(rounds * 1.25) if linear else rounds + 1
+    return best_rounds
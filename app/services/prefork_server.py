@@ -0,0 +1,322 @@
+# This file defines a pre-forking production WSGI server.
+#
+# The master process loads the app once, opens the listening socket and forks SERVER_WORKERS
+# worker processes, which share the app's memory pages copy-on-write. Each worker serves
+# requests from a pool of SERVER_THREADS threads.
+#
+# - SIGHUP: graceful reload. The master re-executes itself with the listening socket still open,
+#   loads the new code, starts new workers and only then asks the old workers to finish their
+#   requests and exit. Connections keep being accepted throughout.
+# - SIGTERM, SIGINT: graceful shutdown.
+# - Workers that die, or stop sending heartbeats for SERVER_WORKER_TIMEOUT seconds, are replaced.
+# - Worker health (requests, busy threads, last heartbeat) is written to SERVER_HEALTH_FILE.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import errno
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+logger = logging.getLogger(__name__)
+
+# Environment variables that carry state across a graceful reload
+LISTEN_FD_VARIABLE = 'APP_SERVER_LISTEN_FD'
+OLD_WORKERS_VARIABLE = 'APP_SERVER_OLD_WORKERS'
+
+HEARTBEAT_INTERVAL = 1  # Seconds
+
+
+class ThreadPoolWSGIServer(BaseWSGIServer):
+    """ A WSGI server that handles requests in a fixed-size thread pool.
+
+    The accept loop waits while all threads are busy, so that waiting connections stay in the
+    shared listen backlog where an idle worker process can accept them.
+    """
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, app, fd, threads, heartbeat_path):
+        BaseWSGIServer.__init__(self, '127.0.0.1', 0, app, fd=fd)
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.free_threads = threading.BoundedSemaphore(threads)
+        self.heartbeat_path = heartbeat_path
+        self.requests = 0
+        self.busy = 0
+        self.started_at = time.time()
+        self._last_heartbeat = 0
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        while not self.free_threads.acquire(timeout=HEARTBEAT_INTERVAL):
+            self.heartbeat()  # All threads are busy, but this worker is alive
+        with self._lock:
+            self.busy += 1
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._lock:
+                self.busy -= 1
+                self.requests += 1
+            self.free_threads.release()
+
+    def service_actions(self):
+        # Called by serve_forever() about every half second
+        if time.time() - self._last_heartbeat >= HEARTBEAT_INTERVAL:
+            self.heartbeat()
+
+    def heartbeat(self):
+        self._last_heartbeat = time.time()
+        try:
+            _write_json(self.heartbeat_path, dict(
+                pid=os.getpid(), started_at=self.started_at, heartbeat_at=self._last_heartbeat,
+                requests=self.requests, busy_threads=self.busy, threads=self.threads))
+        except (IOError, OSError):
+            pass  # After a graceful reload, the old master's heartbeat directory is gone
+
+    def stop(self, timeout):
+        """ Stop accepting connections, then wait up to ``timeout`` seconds for running requests."""
+        self.shutdown()
+        deadline = time.time() + timeout
+        while self.busy and time.time() < deadline:
+            time.sleep(0.1)
+
+
+class PreforkServer(object):
+    """ The master process: forks, supervises and gracefully reloads the worker processes."""
+
+    def __init__(self, app, bind, workers, threads, graceful_timeout=30, worker_timeout=60,
+                 health_file=None, engine_disposer=None, worker_exit=None):
+        self.app = app
+        self.bind = bind
+        self.worker_count = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.worker_timeout = worker_timeout
+        self.health_file = health_file
+        self.engine_disposer = engine_disposer
+        self.worker_exit = worker_exit  # Called by a worker after its last request, e.g. to write buffers
+        self.heartbeat_dir = tempfile.mkdtemp(prefix='app-server-')
+        self.workers = {}  # pid -> heartbeat path
+        self.listener = None
+        self._signals = []
+
+    def run(self):
+        self.listener = self._open_listener()
+        for signal_number in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signal_number, self._queue_signal)
+        logger.info('Master %d listening on %s with %d workers of %d threads.',
+                    os.getpid(), self.bind, self.worker_count, self.threads)
+
+        # No pooled connections may be shared with the workers
+        self._dispose_engines()
+
+        self._spawn_workers()
+        self._stop_old_workers()  # After a graceful reload
+        try:
+            while True:
+                self._handle_signals()
+                self._reap_workers()
+                self._kill_unresponsive_workers()
+                self._spawn_workers()
+                self._write_health()
+                time.sleep(HEARTBEAT_INTERVAL)
+        except SystemExit:
+            self._stop_workers(list(self.workers))
+            shutil.rmtree(self.heartbeat_dir, ignore_errors=True)
+            raise
+
+    def _open_listener(self):
+        fd = os.environ.pop(LISTEN_FD_VARIABLE, None)
+        if fd is not None:
+            # Inherited from the master before a graceful reload
+            return socket.fromfd(int(fd), socket.AF_INET, socket.SOCK_STREAM)
+        host, port = self.bind.rsplit(':', 1)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, int(port)))
+        listener.listen(2048)
+        return listener
+
+    def _queue_signal(self, signal_number, frame):
+        self._signals.append(signal_number)
+
+    def _handle_signals(self):
+        while self._signals:
+            signal_number = self._signals.pop(0)
+            if signal_number == signal.SIGHUP:
+                self._reload()
+            elif signal_number in (signal.SIGTERM, signal.SIGINT):
+                logger.info('Master %d shutting down.', os.getpid())
+                sys.exit(0)
+
+    def _reload(self):
+        # Re-execute the master with the same listening socket. The new master loads the new code,
+        # starts its workers and then stops the old workers (which remain its child processes).
+        logger.info('Master %d reloading.', os.getpid())
+        os.set_inheritable(self.listener.fileno(), True)
+        os.environ[LISTEN_FD_VARIABLE] = str(self.listener.fileno())
+        os.environ[OLD_WORKERS_VARIABLE] = ','.join(str(pid) for pid in self.workers)
+        for signal_number in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signal_number, signal.SIG_DFL)
+        # The new master has its own heartbeat directory; the old workers are not monitored while they finish
+        shutil.rmtree(self.heartbeat_dir, ignore_errors=True)
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def _spawn_workers(self):
+        while len(self.workers) < self.worker_count:
+            heartbeat_path = os.path.join(self.heartbeat_dir, 'worker-%d.json' % len(self.workers))
+            while heartbeat_path in self.workers.values():
+                heartbeat_path = os.path.join(self.heartbeat_dir, 'worker-%d.json' % (int(time.time() * 1e6)))
+            _write_json(heartbeat_path, dict(heartbeat_at=time.time()))
+            pid = os.fork()
+            if pid == 0:
+                self._run_worker(heartbeat_path)  # Never returns
+            self.workers[pid] = heartbeat_path
+            logger.info('Started worker %d.', pid)
+
+    def _run_worker(self, heartbeat_path):
+        exit_code = 0
+        try:
+            for signal_number in (signal.SIGHUP, signal.SIGCHLD):
+                signal.signal(signal_number, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is handled by the master
+            self._dispose_engines()
+            server = ThreadPoolWSGIServer(self.app, self.listener.fileno(), self.threads, heartbeat_path)
+
+            def stop(signal_number, frame):
+                threading.Thread(target=server.stop, args=(self.graceful_timeout,)).start()
+            signal.signal(signal.SIGTERM, stop)
+
+            server.serve_forever()
+            server.executor.shutdown(wait=True)
+            if self.worker_exit:
+                self.worker_exit()
+        except Exception:
+            logger.exception('Worker %d failed.', os.getpid())
+            exit_code = 1
+        finally:
+            os._exit(exit_code)  # Do not run the master's exit handlers
+
+    def _dispose_engines(self):
+        if self.engine_disposer:
+            self.engine_disposer()
+
+    def _reap_workers(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if not pid:
+                return
+            heartbeat_path = self.workers.pop(pid, None)
+            if heartbeat_path:
+                logger.warning('Worker %d exited with status %d.', pid, status)
+                _remove(heartbeat_path)
+
+    def _kill_unresponsive_workers(self):
+        now = time.time()
+        for pid, heartbeat_path in list(self.workers.items()):
+            health = _read_json(heartbeat_path)
+            if health and now - health['heartbeat_at'] > self.worker_timeout:
+                logger.warning('Worker %d sent no heartbeat for %d seconds: killing it.', pid, self.worker_timeout)
+                _kill(pid, signal.SIGKILL)
+
+    def _stop_old_workers(self):
+        old_workers = os.environ.pop(OLD_WORKERS_VARIABLE, '')
+        pids = [int(pid) for pid in old_workers.split(',') if pid]
+        if pids:
+            logger.info('Stopping old workers %s.', ', '.join(str(pid) for pid in pids))
+            self._stop_workers(pids)
+
+    def _stop_workers(self, pids):
+        # Ask the workers to finish their requests, and kill the ones that take too long
+        for pid in pids:
+            _kill(pid, signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        remaining = set(pids)
+        while remaining and time.time() < deadline:
+            for pid in list(remaining):
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0]:
+                        remaining.discard(pid)
+                except OSError:
+                    remaining.discard(pid)  # Already reaped
+            time.sleep(0.1)
+        for pid in remaining:
+            _kill(pid, signal.SIGKILL)
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        for pid in pids:
+            _remove(self.workers.pop(pid, None))
+
+    def health(self):
+        """ Return a dict with the master PID and the latest heartbeat of each worker."""
+        now = time.time()
+        workers = []
+        for pid, heartbeat_path in sorted(self.workers.items()):
+            health = _read_json(heartbeat_path) or {}
+            health.update(pid=pid, seconds_since_heartbeat=round(now - health.get('heartbeat_at', now), 1))
+            workers.append(health)
+        return dict(master_pid=os.getpid(), bind=self.bind, updated_at=now, workers=workers)
+
+    def _write_health(self):
+        if self.health_file:
+            if not os.path.isdir(os.path.dirname(self.health_file)):
+                os.makedirs(os.path.dirname(self.health_file))
+            _write_json(self.health_file, self.health())
+
+
+def _write_json(path, data):
+    # Write-then-rename so that readers never see a partial file
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp_path, 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _remove(path):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _kill(pid, signal_number):
+    try:
+        os.kill(pid, signal_number)
+    except OSError:
+        pass  # Already exited
@@ -0,0 +1,90 @@
+# This file defines per-view query budgets.
+#
+#     @main_blueprint.route('/member')
+#     @query_budget.limit(5)  # At most 5 SQL queries
+#     @login_required
+#     def member_page(): ...
+#
+# A request that runs more queries than its view's budget, or that runs the same statement
+# (with different parameters) more than QUERY_BUDGET_MAX_REPEATS times, which is the sign
+# of an N+1 query pattern, is logged and recorded in query_budget.violations (the most recent
+# QUERY_BUDGET_MAX_VIOLATIONS only).
+# With QUERY_BUDGET_RAISE, it raises QueryBudgetExceeded instead.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from collections import Counter, deque
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudget(object):
+    """ Checks the number of SQL queries of views decorated with ``limit()``."""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.violations = deque(maxlen=100)
+        self._listening = False
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('QUERY_BUDGET_ENABLED', True)
+        self.max_repeats = app.config.get('QUERY_BUDGET_MAX_REPEATS', 3)
+        self.raise_errors = app.config.get('QUERY_BUDGET_RAISE', False)
+        self.violations = deque(maxlen=app.config.get('QUERY_BUDGET_MAX_VIOLATIONS', 100))
+        if self.enabled and not self._listening:
+            event.listen(Engine, 'before_cursor_execute', _record_statement)
+            self._listening = True
+
+    def limit(self, max_queries):
+        """ View decorator: allow at most ``max_queries`` SQL queries per request."""
+        def decorator(view_function):
+            @wraps(view_function)
+            def budgeted_view(*args, **kwargs):
+                if not self.enabled:
+                    return view_function(*args, **kwargs)
+                g._query_budget_statements = []
+                try:
+                    response = view_function(*args, **kwargs)
+                finally:
+                    statements = g.pop('_query_budget_statements')
+                self._check(max_queries, statements)
+                return response
+            return budgeted_view
+        return decorator
+
+    def _check(self, max_queries, statements):
+        problems = []
+        if len(statements) > max_queries:
+            problems.append('%d queries exceed the budget of %d' % (len(statements), max_queries))
+        for statement, count in Counter(statements).items():
+            if count > self.max_repeats:
+                problems.append('Possible N+1 query: %d times %s' % (count, ' '.join(statement.split())))
+        if not problems:
+            return
+
+        message = '%s %s: %s' % (request.method, request.endpoint, '; '.join(problems))
+        self.violations.append(message)
+        if self.raise_errors:
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+
+
+def _record_statement(connection, cursor, statement, parameters, context, executemany):
+    # Statements differ only in their parameters when their text is the same
+    if has_request_context() and '_query_budget_statements' in g:
+        g._query_budget_statements.append(statement)
+
+
+# Shared instance, initialized by create_app()
+query_budget = QueryBudget()
@@ -0,0 +1,186 @@
+# This file defines rate limits for expensive form posts, such as logins and registrations.
+#
+# Each limit is a token bucket of N requests per S seconds, keyed by client IP address or by the
+# submitted email address. Over-limit requests get a plain '429 Too Many Requests' response
+# before CSRF checks, password hashing, database work or emails.
+#
+# Buckets are kept in a small SQLite database that all worker processes share ('sqlite' backend),
+# or in the process's memory ('memory' backend).
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, request
+
+from app.services.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Bucket key types, in the order in which they are checked
+KEY_TYPES = ('ip', 'email')
+
+# The submitted form fields that identify an account
+ACCOUNT_FIELDS = ('email', 'username')
+
+
+def refill(tokens, updated_at, now, capacity, period):
+    """ Return the number of tokens in a bucket that held ``tokens`` at ``updated_at``."""
+    return min(capacity, tokens + (now - updated_at) * capacity / period)
+
+
+class MemoryRateLimitBackend(object):
+    """ Keeps token buckets in an in-process LRU cache. Limits are per process."""
+
+    def __init__(self, max_entries=100000):
+        self.buckets = LRUCache(max_size=max_entries)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, period, now):
+        """ Take a token from bucket ``key``. Returns 0 if allowed, or else the seconds until the next token."""
+        with self._lock:
+            tokens, updated_at = self.buckets.get(key, (capacity, now))
+            tokens = refill(tokens, updated_at, now, capacity, period)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets.set(key, (tokens, now))
+        return 0 if allowed else (1 - tokens) * period / capacity
+
+    def clear(self):
+        self.buckets.clear()
+
+
+class SQLiteRateLimitBackend(object):
+    """ Keeps token buckets in an SQLite database file that is shared by all processes on this host.
+
+    Each take() is one short write transaction. Full buckets are deleted from time to time.
+    """
+
+    PRUNE_INTERVAL = 60  # Seconds
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._local = threading.local()
+        self._last_prune = 0
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS rate_limits ('
+            'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, full_at REAL NOT NULL)')
+
+    def _connection(self):
+        # One connection per thread, and new connections after a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')  # Losing the last buckets in a crash is harmless
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def take(self, key, capacity, period, now):
+        """ Take a token from bucket ``key``. Returns 0 if allowed, or else the seconds until the next token."""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated_at FROM rate_limits WHERE key=?', (key,)).fetchone()
+            tokens = refill(row[0], row[1], now, capacity, period) if row else capacity
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            full_at = now + (capacity - tokens) * period / capacity
+            connection.execute('INSERT OR REPLACE INTO rate_limits (key, tokens, updated_at, full_at) '
+                               'VALUES (?, ?, ?, ?)', (key, tokens, now, full_at))
+            if now - self._last_prune > self.PRUNE_INTERVAL:
+                # Full buckets are the same as missing buckets
+                self._last_prune = now
+                connection.execute('DELETE FROM rate_limits WHERE full_at < ?', (now,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return 0 if allowed else (1 - tokens) * period / capacity
+
+    def clear(self):
+        self._connection().execute('DELETE FROM rate_limits')
+
+
+class RateLimiter(object):
+    """ Checks the RATE_LIMITS of form posts before any other request processing."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config.get('RATE_LIMIT_BACKEND', 'sqlite') == 'memory':
+            self.backend = MemoryRateLimitBackend()
+        else:
+            self.backend = SQLiteRateLimitBackend(app.config['RATE_LIMIT_DATABASE'])
+        app.before_request(self._check_request)
+
+    def _check_request(self):
+        config = current_app.config
+        if not config.get('RATE_LIMIT_ENABLED', True) or request.method != 'POST':
+            return None
+        limits = config.get('RATE_LIMITS', {}).get(request.endpoint)
+        if not limits:
+            return None
+        retry_after = self.check(request.endpoint, limits, _client_keys())
+        if retry_after:
+            return current_app.response_class(
+                'Too many requests. Please try again in %d seconds.\n' % retry_after, status=429,
+                headers={'Retry-After': str(retry_after)}, mimetype='text/plain')
+        return None
+
+    def check(self, endpoint, limits, client_keys):
+        """ Take a token from each bucket of ``endpoint``.
+
+        ``limits`` maps a key type ('ip' or 'email') to (requests, seconds),
+        and ``client_keys`` maps a key type to the client's key.
+        Returns 0 if the request is allowed, or else the number of seconds to wait.
+        """
+        now = time.time()
+        for key_type in KEY_TYPES:
+            client_key = client_keys.get(key_type)
+            if key_type not in limits or not client_key:
+                continue
+            capacity, period = limits[key_type]
+            try:
+                wait = self.backend.take('%s|%s|%s' % (endpoint, key_type, client_key), capacity, period, now)
+            except sqlite3.Error:
+                # Better to serve the request than to fail while the database is locked
+                logger.warning('Rate limit check of %s failed.', endpoint, exc_info=True)
+                return 0
+            if wait:
+                return int(math.ceil(wait))
+        return 0
+
+    def clear(self):
+        """ Reset all rate limits."""
+        self.backend.clear()
+
+
+def _client_keys():
+    keys = dict(ip=request.remote_addr)
+    for field_name in ACCOUNT_FIELDS:
+        value = request.form.get(field_name, u'').strip().lower()
+        if value:
+            keys['email'] = value
+            break
+    return keys
+
+
+# The rate limiter of the app
+rate_limiter = RateLimiter()
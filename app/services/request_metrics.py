@@ -0,0 +1,316 @@
+# This file defines per-request timing and SQL instrumentation.
+#
+# For each request, the wall time, the number of SQL queries, the SQL time and the
+# template render time are measured. They are sent to the browser in a Server-Timing header
+# and aggregated per endpoint into histograms that Prometheus can scrape from /metrics.
+#
+# With several worker processes, each process saves its histograms to its own file in
+# REQUEST_METRICS_DIR, and /metrics adds up the files of all processes. The files of processes
+# that exited (e.g. workers replaced by a restart) are removed.
+#
+# /metrics is only served to the REQUEST_METRICS_ALLOWED_IPS, and to scrapers that send
+# 'Authorization: Bearer <REQUEST_METRICS_TOKEN>'. By default, it answers '403 Forbidden'.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import atexit
+import errno
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from flask import abort, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Metric name -> (help text, bucket upper bounds)
+HISTOGRAMS = {
+    'app_request_duration_seconds': ('Request wall time', DURATION_BUCKETS),
+    'app_request_sql_duration_seconds': ('Time spent in SQL queries per request', DURATION_BUCKETS),
+    'app_request_sql_queries': ('Number of SQL queries per request', QUERY_COUNT_BUCKETS),
+    'app_request_template_duration_seconds': ('Template render time per request', DURATION_BUCKETS),
+}
+REQUESTS_TOTAL = 'app_requests_total'
+
+
+class MetricsRegistry(object):
+    """ Histograms and request counters of one process, labeled by endpoint (and method and status)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # histograms[name][endpoint] = [bucket counts..., +Inf count, sum]
+            self.histograms = dict((name, {}) for name in HISTOGRAMS)
+            # counters[endpoint|method|status] = count
+            self.counters = {}
+
+    def observe(self, name, endpoint, value):
+        buckets = HISTOGRAMS[name][1]
+        with self._lock:
+            histogram = self.histograms[name].setdefault(endpoint, [0] * (len(buckets) + 2))
+            for i, upper_bound in enumerate(buckets):
+                if value <= upper_bound:
+                    histogram[i] += 1
+            histogram[-2] += 1  # +Inf, which is also the number of observations
+            histogram[-1] += value
+
+    def count_request(self, endpoint, method, status):
+        key = '%s|%s|%s' % (endpoint, method, status)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def to_dict(self):
+        with self._lock:
+            return json.loads(json.dumps(dict(histograms=self.histograms, counters=self.counters)))
+
+
+class RequestMetrics(object):
+    """ Instruments requests, SQL queries and template rendering. Serves the /metrics endpoint."""
+
+    def __init__(self, app=None):
+        self.registry = MetricsRegistry()
+        self.enabled = False
+        self.directory = None
+        self._pid = None
+        self._file_id = None
+        self._last_save = 0
+        self._atexit_registered = False
+        self._save_lock = threading.Lock()
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('REQUEST_METRICS_ENABLED', True)
+        if not self.enabled:
+            return
+        self.directory = app.config.get('REQUEST_METRICS_DIR')
+        self.save_interval = app.config.get('REQUEST_METRICS_SAVE_INTERVAL', 1)
+        self.server_timing = app.config.get('REQUEST_METRICS_SERVER_TIMING', True)
+        self.allowed_ips = frozenset(app.config.get('REQUEST_METRICS_ALLOWED_IPS', ()))
+        self.token = app.config.get('REQUEST_METRICS_TOKEN', '')
+        if self.directory and not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        app.add_url_rule(app.config.get('REQUEST_METRICS_URL', '/metrics'), 'metrics', self.metrics_view)
+        before_render_template.connect(_start_template, app)
+        template_rendered.connect(_end_template, app)
+        _listen_to_sql_queries()
+        if not self._atexit_registered:
+            atexit.register(self.save)
+            self._atexit_registered = True
+
+    def _start_request(self):
+        g._metrics = dict(start=time.time(), sql_queries=0, sql_seconds=0.0, template_seconds=0.0)
+
+    def _end_request(self, response):
+        metrics = g.pop('_metrics', None)
+        if metrics is None:
+            return response
+        duration = time.time() - metrics['start']
+        endpoint = request.endpoint or 'none'
+        self._check_pid()
+        registry = self.registry
+        registry.observe('app_request_duration_seconds', endpoint, duration)
+        registry.observe('app_request_sql_duration_seconds', endpoint, metrics['sql_seconds'])
+        registry.observe('app_request_sql_queries', endpoint, metrics['sql_queries'])
+        registry.observe('app_request_template_duration_seconds', endpoint, metrics['template_seconds'])
+        registry.count_request(endpoint, request.method, response.status_code)
+
+        if self.server_timing:
+            response.headers.add('Server-Timing', ', '.join([
+                'sql;dur=%.1f;desc="%d queries"' % (metrics['sql_seconds'] * 1000, metrics['sql_queries']),
+                'tpl;dur=%.1f' % (metrics['template_seconds'] * 1000),
+                'total;dur=%.1f' % (duration * 1000),
+            ]))
+
+        if self.directory and time.time() - self._last_save >= self.save_interval:
+            self.save()
+        return response
+
+    def _check_pid(self):
+        # Forked worker processes start with an empty registry and their own file
+        if self._pid != os.getpid():
+            self.registry.reset()
+            self._pid = os.getpid()
+            self._file_id = '%d-%s' % (self._pid, uuid.uuid4().hex[:8])
+
+    def save(self):
+        """ Save this process's metrics to its file in REQUEST_METRICS_DIR.
+        Skipped if another thread is saving them. Returns True if the metrics were saved."""
+        if not self.directory or self._pid != os.getpid():
+            return False
+        if not self._save_lock.acquire(blocking=False):
+            return False
+        try:
+            self._last_save = time.time()
+            path = os.path.join(self.directory, 'metrics-%s.json' % self._file_id)
+            # Write-then-rename so that /metrics never reads a partial file
+            temp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+            with open(temp_path, 'w') as metrics_file:
+                json.dump(self.registry.to_dict(), metrics_file)
+            os.replace(temp_path, path)
+            return True
+        except (IOError, OSError):
+            # Never fail a request because the metrics could not be saved
+            logger.exception('Could not save request metrics to %s.', self.directory)
+            return False
+        finally:
+            self._save_lock.release()
+
+    def collect(self):
+        """ Return the metrics of all processes, added up."""
+        self._check_pid()
+        if not self.directory:
+            return self.registry.to_dict()
+        self.save()
+        remove_stale_metrics_files(self.directory)
+        return merge_metrics(load_metrics_files(self.directory))
+
+    def is_allowed(self):
+        """ Return True if the current request may read /metrics."""
+        if request.remote_addr in self.allowed_ips:
+            return True
+        authorization = request.headers.get('Authorization', '')
+        return bool(self.token) and hmac.compare_digest(authorization, 'Bearer %s' % self.token)
+
+    def metrics_view(self):
+        if not self.is_allowed():
+            abort(403)
+        return render_prometheus(self.collect()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def _start_template(app, template, context, **extra):
+    if has_request_context() and '_metrics' in g:
+        g._metrics.setdefault('template_starts', []).append(time.time())
+
+
+def _end_template(app, template, context, **extra):
+    if has_request_context() and g.get('_metrics', {}).get('template_starts'):
+        g._metrics['template_seconds'] += time.time() - g._metrics['template_starts'].pop()
+
+
+_sql_listeners_installed = False
+
+
+def _listen_to_sql_queries():
+    # Listen to the queries of all engines, including read replicas, once per process
+    global _sql_listeners_installed
+    if _sql_listeners_installed:
+        return
+    _sql_listeners_installed = True
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if has_request_context() and '_metrics' in g:
+        connection.info.setdefault('_metrics_query_starts', []).append(time.time())
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    query_starts = connection.info.get('_metrics_query_starts')
+    if query_starts and has_request_context() and '_metrics' in g:
+        g._metrics['sql_queries'] += 1
+        g._metrics['sql_seconds'] += time.time() - query_starts.pop()
+
+
+def remove_stale_metrics_files(directory):
+    """ Remove the metrics files of processes that no longer run. Returns the number of removed files."""
+    removed = 0
+    for filename in os.listdir(directory):
+        if not (filename.startswith('metrics-') and filename.endswith(('.json', '.tmp'))):
+            continue
+        try:
+            pid = int(filename[len('metrics-'):].split('-', 1)[0])
+        except ValueError:
+            continue
+        if not _process_exists(pid):
+            try:
+                os.remove(os.path.join(directory, filename))
+                removed += 1
+            except OSError:
+                pass  # Removed by another process
+    return removed
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM  # Runs, as another user
+    return True
+
+
+def load_metrics_files(directory):
+    metrics_list = []
+    for filename in os.listdir(directory):
+        if filename.startswith('metrics-') and filename.endswith('.json'):
+            try:
+                with open(os.path.join(directory, filename)) as metrics_file:
+                    metrics_list.append(json.load(metrics_file))
+            except (IOError, OSError, ValueError):
+                pass  # Removed or replaced while reading
+    return metrics_list
+
+
+def merge_metrics(metrics_list):
+    """ Add up the histograms and counters of several processes."""
+    merged = dict(histograms=dict((name, {}) for name in HISTOGRAMS), counters={})
+    for metrics in metrics_list:
+        for name, histograms in metrics['histograms'].items():
+            for endpoint, values in histograms.items():
+                total = merged['histograms'][name].setdefault(endpoint, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+        for key, count in metrics['counters'].items():
+            merged['counters'][key] = merged['counters'].get(key, 0) + count
+    return merged
+
+
+def render_prometheus(metrics):
+    """ Render metrics in the Prometheus text exposition format."""
+    lines = []
+    for name in sorted(HISTOGRAMS):
+        help_text, buckets = HISTOGRAMS[name]
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % name)
+        for endpoint, values in sorted(metrics['histograms'].get(name, {}).items()):
+            labels = 'endpoint="%s"' % _escape(endpoint)
+            for upper_bound, count in zip(buckets, values):
+                lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, upper_bound, count))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, values[-2]))
+            lines.append('%s_sum{%s} %s' % (name, labels, repr(float(values[-1]))))
+            lines.append('%s_count{%s} %d' % (name, labels, values[-2]))
+
+    lines.append('# HELP %s Number of requests' % REQUESTS_TOTAL)
+    lines.append('# TYPE %s counter' % REQUESTS_TOTAL)
+    for key, count in sorted(metrics['counters'].items()):
+        endpoint, method, status = key.split('|')
+        lines.append('%s{endpoint="%s",method="%s",status="%s"} %d'
+                     % (REQUESTS_TOTAL, _escape(endpoint), method, status, count))
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(label_value):
+    return label_value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Shared instance, initialized by create_app()
+request_metrics = RequestMetrics()
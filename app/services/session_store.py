@@ -0,0 +1,252 @@
+# This file defines a server-side Flask session interface.
+#
+# The session cookie only holds a random session ID. Session data is kept in a store
+# (SQLAlchemySessionStore: the 'sessions' table), with a bounded in-process LRU cache in front of it.
+#
+# - Sessions are only written when they were modified, or when half of their lifetime has passed.
+# - The session ID changes when a user logs in or out, to prevent session fixation.
+# - Expired sessions are deleted in batches by a background thread.
+# - revoke_user_sessions() logs a user out everywhere, e.g. after a password change.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import datetime
+import hashlib
+import os
+import secrets
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import select
+from werkzeug.datastructures import CallbackDict
+
+from app.services.lru_cache import LRUCache
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """ A session dict that remembers its session ID and whether it was modified."""
+
+    def __init__(self, initial=None, sid=None, new=False, data=None, user_id=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.loaded_data = data
+        self.loaded_user_id = user_id
+        self.expires_at = expires_at
+        self.modified = False
+
+
+class SQLAlchemySessionStore(object):
+    """ Stores sessions in the 'sessions' table, using its own connections
+    so that saving a session never commits the request's db.session."""
+
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def table(self):
+        from app.models.session_models import ServerSession
+        return ServerSession.__table__
+
+    def load(self, key):
+        """ Return (data, user_id, expires_at) or None."""
+        table = self.table
+        with self.db.engine.connect() as connection:
+            row = connection.execute(
+                table.select().where(table.c.id == key)).first()
+        if row is None:
+            return None
+        return row.data, row.user_id, row.expires_at
+
+    def save(self, key, data, user_id, expires_at):
+        table = self.table
+        values = dict(data=data, user_id=user_id, expires_at=expires_at)
+        with self.db.engine.begin() as connection:
+            if not connection.execute(table.update().where(table.c.id == key).values(**values)).rowcount:
+                connection.execute(table.insert().values(id=key, **values))
+
+    def delete(self, key):
+        with self.db.engine.begin() as connection:
+            connection.execute(self.table.delete().where(self.table.c.id == key))
+
+    def delete_user_sessions(self, user_id, except_key=None):
+        table = self.table
+        condition = table.c.user_id == user_id
+        if except_key:
+            condition = condition & (table.c.id != except_key)
+        with self.db.engine.begin() as connection:
+            return connection.execute(table.delete().where(condition)).rowcount
+
+    def delete_expired(self, now, batch_size):
+        """ Delete up to ``batch_size`` expired sessions. Returns the number of deleted sessions."""
+        table = self.table
+        expired = select([table.c.id]).where(table.c.expires_at < now).limit(batch_size)
+        with self.db.engine.begin() as connection:
+            return connection.execute(table.delete().where(table.c.id.in_(expired))).rowcount
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """ A Flask session interface that keeps session data in ``store``, behind an LRU cache."""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, app, store):
+        self.store = store
+        self.cache = LRUCache(max_size=app.config.get('SESSION_CACHE_SIZE', 10000),
+                              ttl=app.config.get('SESSION_CACHE_TTL', 60))
+        self.sweep_interval = app.config.get('SESSION_SWEEP_INTERVAL', 300)
+        self.sweep_batch_size = app.config.get('SESSION_SWEEP_BATCH_SIZE', 1000)
+        self._revoked_at = {}  # user_id -> time of the last revoke_user_sessions() in this process
+        self._sweeper_pid = None
+        self._lock = threading.Lock()
+
+    def open_session(self, app, request):
+        self._start_sweeper()
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            record = self._load(_key(sid))
+            if record is not None:
+                data, user_id, expires_at = record
+                if expires_at > datetime.datetime.utcnow():
+                    return ServerSideSession(self.serializer.loads(data), sid=sid, data=data,
+                                             user_id=user_id, expires_at=expires_at)
+        return ServerSideSession(sid=_new_sid(), new=True)
+
+    def _load(self, key):
+        entry = self.cache.get(key)
+        if entry is not None:
+            record, loaded_at = entry
+            user_id = record[1]
+            if user_id is None or self._revoked_at.get(user_id, 0) < loaded_at:
+                return record
+        record = self.store.load(key)
+        if record is not None:
+            self.cache.set(key, (record, time.time()))
+        return record
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # Flask-User marks every session as permanent: that alone is not worth storing
+        if not any(key != '_permanent' for key in session):
+            # The session was cleared: forget it
+            if not session.new:
+                self._delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        # Flask-User also marks every session as modified: compare the data instead
+        now = datetime.datetime.utcnow()
+        lifetime = app.permanent_session_lifetime
+        data = self.serializer.dumps(dict(session))
+        needs_refresh = session.expires_at is not None and session.expires_at - now < lifetime / 2
+        if not (session.new or needs_refresh or (session.modified and data != session.loaded_data)):
+            return  # Nothing to write
+
+        # Logging in or out changes the session data
+        user_id = _user_id(app, session)
+        if not session.new and user_id != session.loaded_user_id:
+            # Issue a new session ID to prevent session fixation
+            self._delete(session.sid)
+            session.sid = _new_sid()
+
+        key = _key(session.sid)
+        record = (data, user_id, now + lifetime)
+        self.store.save(key, *record)
+        self.cache.set(key, (record, time.time()))
+        response.set_cookie(app.session_cookie_name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+    def _delete(self, sid):
+        key = _key(sid)
+        self.store.delete(key)
+        self.cache.delete(key)
+
+    def revoke_user_sessions(self, user_id, except_sid=None):
+        """ Delete all sessions of ``user_id``, except the session with ID ``except_sid``.
+        Returns the number of deleted sessions. Other processes notice within SESSION_CACHE_TTL seconds."""
+        user_id = int(user_id)
+        except_key = _key(except_sid) if except_sid else None
+        count = self.store.delete_user_sessions(user_id, except_key)
+        self._revoked_at[user_id] = time.time()
+        if except_key:
+            self.cache.delete(except_key)  # Reload the kept session from the store
+        return count
+
+    def sweep(self):
+        """ Delete all expired sessions, in batches. Returns the number of deleted sessions."""
+        deleted = 0
+        while True:
+            count = self.store.delete_expired(datetime.datetime.utcnow(), self.sweep_batch_size)
+            deleted += count
+            if count < self.sweep_batch_size:
+                return deleted
+
+    def _start_sweeper(self):
+        # Start one sweeper thread per process, also after a fork
+        if not self.sweep_interval or self._sweeper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sweeper_pid != os.getpid():
+                self._sweeper_pid = os.getpid()
+                thread = threading.Thread(target=self._sweep_forever, name='session-sweeper')
+                thread.daemon = True
+                thread.start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                pass  # The database may be briefly locked; try again next time
+
+
+def _new_sid():
+    return secrets.token_urlsafe(32)
+
+
+def _key(sid):
+    return hashlib.sha256(sid.encode('utf-8')).hexdigest()
+
+
+def _user_id(app, session):
+    # Flask-Login stores the logged in user's Flask-User token, which contains the user ID
+    user_token = session.get('_user_id', session.get('user_id'))
+    if user_token is None:
+        return None
+    data_items = app.user_manager.verify_token(user_token, None)
+    return int(data_items[0]) if data_items else None
+
+
+def init_session_store(app, db):
+    """ Store sessions server-side if SESSION_TYPE is 'sqlalchemy' (the default).
+    'cookie' keeps Flask's signed cookie sessions."""
+    if app.config.get('SESSION_TYPE', 'sqlalchemy') != 'sqlalchemy':
+        return
+    app.session_interface = ServerSideSessionInterface(app, SQLAlchemySessionStore(db))
+
+    # Log out the user's other sessions after a password change
+    from flask import session
+    from flask_user.signals import user_changed_password
+
+    def revoke_other_sessions(sender, user, **extra):
+        sender.session_interface.revoke_user_sessions(user.id, except_sid=getattr(session, 'sid', None))
+    user_changed_password.connect(revoke_other_sessions, app, weak=False)
+
+
+def revoke_user_sessions(app, user_id):
+    """ Log ``user_id`` out of all sessions. Returns the number of revoked sessions, or None
+    if sessions are stored in cookies (which cannot be revoked)."""
+    if isinstance(app.session_interface, ServerSideSessionInterface):
+        return app.session_interface.revoke_user_sessions(user_id)
+    return None
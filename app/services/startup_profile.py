@@ -0,0 +1,76 @@
+# This file measures how long it takes to start the app.
+#
+# create_app() records the duration of each setup step in app.extensions['startup_timings'],
+# and 'python manage.py profile_startup' reports them, together with per-import timings
+# from a fresh Python process ('python -X importtime').
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Runs in a fresh Python process, so that module imports are not yet cached
+PROFILE_SCRIPT = """
+import json, time
+start = time.time()
+from app import create_app
+import_seconds = time.time() - start
+app = create_app(entry_point=%r)
+print(json.dumps(dict(
+    import_seconds=import_seconds,
+    total_seconds=time.time() - start,
+    steps=app.extensions['startup_timings'].steps)))
+"""
+
+
+class StartupTimings(object):
+    """ Records the duration of consecutive setup steps."""
+
+    def __init__(self):
+        self.steps = []
+        self._last_time = time.time()
+
+    def mark(self, step):
+        """ Record the time since the previous mark as the duration of ``step``."""
+        now = time.time()
+        self.steps.append((step, now - self._last_time))
+        self._last_time = now
+
+
+def profile_startup(entry_point='web'):
+    """ Start the app for ``entry_point`` in a fresh Python process.
+
+    Returns a dict with 'import_seconds', 'total_seconds', the create_app() 'steps'
+    as (step, seconds) tuples, and the 'imports' as (module, self_seconds, cumulative_seconds)
+    tuples, slowest first.
+    """
+    project_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROFILE_SCRIPT % entry_point],
+        cwd=project_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError('The app failed to start:\n' + process.stderr)
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['steps'] = [tuple(step) for step in result['steps']]
+    result['imports'] = parse_import_times(process.stderr)
+    return result
+
+
+def parse_import_times(importtime_output):
+    """ Parse 'python -X importtime' output into (module, self_seconds, cumulative_seconds) tuples,
+    slowest first."""
+    imports = []
+    for line in importtime_output.splitlines():
+        # import time:       291 |      69352 |               sqlalchemy.schema
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        imports.append((module.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    imports.sort(key=lambda item: item[2], reverse=True)
+    return imports
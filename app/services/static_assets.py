@@ -0,0 +1,116 @@
+# This file defines a fingerprinted, precompressed static asset pipeline.
+#
+# 'python manage.py build_assets' copies every file in app/static to app/static/dist,
+# with a content hash in its filename, plus precompressed .gz and .br siblings,
+# and writes a manifest that maps original filenames to fingerprinted filenames.
+#
+# url_for('static', filename=...) then resolves through the manifest, and fingerprinted
+# files are served precompressed with far-future, immutable cache headers.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_from_directory
+
+DIST_DIR = 'dist'
+MANIFEST_FILENAME = 'manifest.json'
+
+# Text files are precompressed; images and fonts like .woff are already compressed
+PRECOMPRESSED_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.html', '.txt', '.json', '.ttf', '.eot')
+
+
+def build_assets(static_folder, progress=None):
+    """ Fingerprint and precompress all files in ``static_folder``. Returns the manifest dict."""
+    dist_folder = os.path.join(static_folder, DIST_DIR)
+    if os.path.isdir(dist_folder):
+        shutil.rmtree(dist_folder)
+
+    # Brotli is an optional requirement
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        if progress:
+            progress('The brotli package is missing: skipping .br files. Install it with "pip install brotli".')
+
+    manifest = {}
+    for directory, subdirectories, filenames in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(static_folder) and DIST_DIR in subdirectories:
+            subdirectories.remove(DIST_DIR)
+        for filename in sorted(filenames):
+            source_path = os.path.join(directory, filename)
+            relative_path = os.path.relpath(source_path, static_folder).replace(os.sep, '/')
+            with open(source_path, 'rb') as source_file:
+                content = source_file.read()
+
+            # Insert a content hash into the filename: css/app.css -> css/app.1a2b3c4d5e6f.css
+            name, extension = os.path.splitext(relative_path)
+            fingerprinted_path = '%s.%s%s' % (name, hashlib.sha256(content).hexdigest()[:12], extension)
+            target_path = os.path.join(dist_folder, fingerprinted_path)
+            if not os.path.isdir(os.path.dirname(target_path)):
+                os.makedirs(os.path.dirname(target_path))
+            with open(target_path, 'wb') as target_file:
+                target_file.write(content)
+
+            if extension.lower() in PRECOMPRESSED_EXTENSIONS:
+                with open(target_path + '.gz', 'wb') as gz_file:
+                    gz_file.write(gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli:
+                    with open(target_path + '.br', 'wb') as br_file:
+                        br_file.write(brotli.compress(content, quality=11))
+
+            manifest[relative_path] = DIST_DIR + '/' + fingerprinted_path
+            if progress:
+                progress('%s -> %s' % (relative_path, manifest[relative_path]))
+
+    with open(os.path.join(dist_folder, MANIFEST_FILENAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    return manifest
+
+
+def init_static_assets(app):
+    """ Resolve url_for('static', ...) through the manifest and serve fingerprinted files precompressed."""
+    manifest_path = os.path.join(app.static_folder, DIST_DIR, MANIFEST_FILENAME)
+    if not app.config.get('STATIC_ASSETS_FINGERPRINTED', True) or not os.path.exists(manifest_path):
+        return
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    max_age = app.config.get('STATIC_ASSETS_MAX_AGE', 31536000)
+
+    @app.url_defaults
+    def fingerprinted_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def static(filename):
+        if not filename.startswith(DIST_DIR + '/'):
+            return app.send_static_file(filename)
+
+        # Serve the smallest precompressed variant that the client accepts
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        serve_filename, encoding = filename, None
+        for candidate_encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if candidate_encoding in request.accept_encodings \
+                    and os.path.isfile(os.path.join(app.static_folder, filename + suffix)):
+                serve_filename, encoding = filename + suffix, candidate_encoding
+                break
+        response = send_from_directory(app.static_folder, serve_filename, mimetype=mimetype,
+                                       cache_timeout=max_age, conditional=True)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        # The filename changes whenever the content does
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.headers['Cache-Control'] += ', immutable'
+        return response
+
+    app.view_functions['static'] = static
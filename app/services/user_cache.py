@@ -0,0 +1,167 @@
+# This file defines an in-process cache for the logged-in user (current_user).
+#
+# Without it, Flask-Login's user_loader reloads the User row (and @roles_required
+# lazily loads User.roles) on every authenticated request.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models.user_models import RoleSetMixin, User, UsersRoles
+from app.services.lru_cache import LRUCache
+
+
+class UserSnapshot(RoleSetMixin):
+    """ A compact, read-only stand-in for the User object.
+
+    Implements just enough of the User/UserMixin interface for Flask-Login,
+    the Flask-User view decorators and the page templates.
+    """
+
+    # Flask-Login properties
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, active, email, first_name, last_name, email_confirmed_at,
+                 password_ends_with, role_names, version=1):
+        self.id = id
+        self.active = active
+        self.email = email
+        self.first_name = first_name
+        self.last_name = last_name
+        self.email_confirmed_at = email_confirmed_at
+        self.password_ends_with = password_ends_with
+        self.role_names = frozenset(role_names)
+        self.version = version
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            active=user.active,
+            email=user.email,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            email_confirmed_at=user.email_confirmed_at,
+            password_ends_with=user.password[-8:],
+            role_names=user.role_names,
+            version=user.version,
+        )
+
+    @property
+    def is_active(self):
+        return self.active
+
+    @property
+    def username(self):
+        return None  # USER_ENABLE_USERNAME is False
+
+    def get_id(self):
+        # Same token format as UserMixin.get_id()
+        return current_app.user_manager.generate_token(self.id, self.password_ends_with)
+
+
+class UserCache(object):
+    """ Caches UserSnapshot objects by user ID and installs a caching Flask-Login user_loader.
+
+    The cache is per process. Entries are invalidated when a User row or its role
+    membership is committed by this process; CURRENT_USER_CACHE_TTL bounds how long
+    other worker processes may serve a stale snapshot.
+    """
+
+    def __init__(self, app=None):
+        self.cache = LRUCache()
+        self.enabled = False
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('CURRENT_USER_CACHE_ENABLED', True)
+        self.cache = LRUCache(
+            max_size=app.config.get('CURRENT_USER_CACHE_SIZE', 1000),
+            ttl=app.config.get('CURRENT_USER_CACHE_TTL', 60))
+        if not self.enabled:
+            return
+
+        # Replace the user_loader installed by Flask-User's UserManager
+        user_manager = app.user_manager
+        user_manager.login_manager.user_loader(self.load_user_by_user_token)
+
+        # Invalidate users that are modified through any session
+        if not getattr(UserCache, '_session_events_installed', False):
+            event.listen(Session, 'after_flush', _collect_modified_users)
+            event.listen(Session, 'after_commit', _invalidate_modified_users)
+            event.listen(Session, 'after_rollback', _discard_modified_users)
+            UserCache._session_events_installed = True
+
+    def load_user_by_user_token(self, user_token):
+        """ Flask-Login user_loader: returns a UserSnapshot for safe (GET/HEAD) requests
+        outside of the Flask-User views, and the real User object otherwise,
+        because those requests may modify and save ``current_user``."""
+        user_manager = current_app.user_manager
+        if request.method not in ('GET', 'HEAD') or request.blueprint == 'user':
+            return user_manager.db_manager.UserClass.get_user_by_token(user_token)
+
+        # Verify token signature and timestamp
+        data_items = user_manager.verify_token(user_token, None)
+        if not data_items:
+            return None
+        user_id, password_ends_with = data_items[0], data_items[1]
+
+        snapshot = self.get(user_id)
+        if snapshot is None:
+            return None
+
+        # Tokens are invalidated by a password change
+        if snapshot.password_ends_with != password_ends_with:
+            return None
+        return snapshot
+
+    def get(self, user_id):
+        """ Return a UserSnapshot for ``user_id``, loading it from the database on a cache miss."""
+        snapshot = self.cache.get(user_id)
+        if snapshot is None:
+            user = User.get_with_roles(user_id)
+            if user is None:
+                return None
+            snapshot = UserSnapshot.from_user(user)
+            self.cache.set(user_id, snapshot)
+        return snapshot
+
+    def invalidate(self, *user_ids):
+        for user_id in user_ids:
+            self.cache.delete(user_id)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+# Shared instance, initialized by create_app()
+user_cache = UserCache()
+
+
+def _collect_modified_users(session, flush_context):
+    # Remember the IDs of flushed User objects and users whose roles changed
+    user_ids = session.info.setdefault('user_cache_invalidate', set())
+    for obj in list(session.dirty) + list(session.deleted) + list(session.new):
+        if isinstance(obj, User) and obj.id is not None:
+            user_ids.add(obj.id)
+        elif isinstance(obj, UsersRoles) and obj.user_id is not None:
+            user_ids.add(obj.user_id)
+
+
+def _invalidate_modified_users(session):
+    user_ids = session.info.pop('user_cache_invalidate', None)
+    if user_ids:
+        user_cache.invalidate(*user_ids)
+
+
+def _discard_modified_users(session):
+    session.info.pop('user_cache_invalidate', None)
@@ -0,0 +1,115 @@
+# This file defines the queries of the admin user directory.
+#
+# - Pages are fetched with keyset (seek) pagination: 'WHERE (last_name, id) > (:last_name, :id)'
+#   instead of 'OFFSET n', so that page 1000 is as fast as page 1.
+# - On SQLite, search terms of 3+ characters are looked up in the users_fts trigram index.
+#   Shorter terms, and other databases, use index-backed prefix searches.
+# - Total counts are capped at USER_DIRECTORY_COUNT_LIMIT and cached for USER_DIRECTORY_COUNT_TTL seconds.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from flask import current_app
+from sqlalchemy import and_, func, or_, select, text
+from sqlalchemy.orm import selectinload
+
+from app import db
+from app.models.user_models import Role, User, UsersRoles, users_fts_available
+from app.services.lru_cache import LRUCache
+
+SORT_ORDERS = ('last_name', 'id')
+
+# Cached (capped) counts, per search term and role
+_counts = LRUCache(max_size=1000, ttl=60)
+
+
+def search_users(search=u'', role_name=None, sort='last_name', after=None, per_page=50):
+    """ Return a page of users, with their roles, and the cursor of the next page (or None).
+
+    ``after`` is the cursor of the previous page's last user, as returned by this function.
+    """
+    if sort not in SORT_ORDERS:
+        raise ValueError('sort must be one of %s' % ', '.join(SORT_ORDERS))
+    query = filtered_query(search, role_name)
+    if query is None:
+        return [], None
+
+    if sort == 'id':
+        if after:
+            query = query.filter(User.id > int(after))
+        query = query.order_by(User.id)
+    else:
+        if after:
+            last_name, user_id = after.rsplit('|', 1)
+            query = query.filter(or_(User.last_name > last_name,
+                                     and_(User.last_name == last_name, User.id > int(user_id))))
+        query = query.order_by(User.last_name, User.id)
+
+    # Fetch one extra user to find out if there is a next page
+    users = query.options(selectinload(User.roles)).limit(per_page + 1).all()
+    next_cursor = None
+    if len(users) > per_page:
+        users = users[:per_page]
+        last_user = users[-1]
+        next_cursor = str(last_user.id) if sort == 'id' else '%s|%d' % (last_user.last_name, last_user.id)
+    return users, next_cursor
+
+
+def filtered_query(search=u'', role_name=None):
+    """ Return a User query filtered by search term and role name, or None if the role does not exist."""
+    query = User.query
+    search = (search or u'').strip()
+    if search:
+        query = query.filter(_search_condition(search))
+    if role_name:
+        role_id = db.session.query(Role.id).filter(Role.name == role_name).scalar()
+        if role_id is None:
+            return None
+        # Uses the ix_users_roles_role_id index
+        query = query.filter(User.id.in_(
+            select([UsersRoles.user_id]).where(UsersRoles.role_id == role_id)))
+    return query
+
+
+def _search_condition(search):
+    if len(search) >= 3 and users_fts_available(db.session.get_bind(User.__mapper__)):
+        # Case-insensitive substring search in the trigram index
+        fts_query = '"%s"' % search.replace('"', '""')
+        return User.id.in_(text('SELECT rowid FROM users_fts WHERE users_fts MATCH :fts_query')
+                           .bindparams(fts_query=fts_query))
+
+    # Prefix search with range conditions, which use the indexes on email, first_name and last_name.
+    # Emails are compared in lower case and names are usually capitalized.
+    conditions = [_prefix_condition(User.email, search.lower())]
+    for name in set([search, search[:1].upper() + search[1:]]):
+        conditions.append(_prefix_condition(User.first_name, name))
+        conditions.append(_prefix_condition(User.last_name, name))
+    return or_(*conditions)
+
+
+def _prefix_condition(column, prefix):
+    return and_(column >= prefix, column < prefix + u'\U0010ffff')
+
+
+def approximate_count(search=u'', role_name=None):
+    """ Return (count, is_exact). Counts stop at USER_DIRECTORY_COUNT_LIMIT and are cached for a while."""
+    limit = current_app.config.get('USER_DIRECTORY_COUNT_LIMIT', 10000)
+    _counts.ttl = current_app.config.get('USER_DIRECTORY_COUNT_TTL', 60)
+    key = (search, role_name, limit)
+    count = _counts.get(key)
+    if count is None:
+        query = filtered_query(search, role_name)
+        if query is None:
+            count = 0
+        else:
+            # Count at most limit + 1 rows instead of all matching rows
+            capped = query.with_entities(User.id).limit(limit + 1).subquery()
+            count = db.session.query(func.count()).select_from(capped).scalar()
+        _counts.set(key, count)
+    return min(count, limit), count <= limit
+
+
+def clear_counts():
+    """ Forget cached counts, e.g. after adding or removing users."""
+    _counts.clear()
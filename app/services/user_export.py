@@ -0,0 +1,121 @@
+# This file defines streaming CSV and JSONL exports of users and their role names.
+#
+# - One query joins users with their roles and aggregates the role names per user,
+#   so there are no per-user queries.
+# - Rows are fetched in batches from a server-side cursor (stream_results) and written out
+#   batch by batch, so memory use does not depend on the number of users.
+# - Output can be gzip-compressed on the fly.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import csv
+import io
+import json
+import zlib
+
+from sqlalchemy import func, literal, literal_column, select
+
+from app.models.user_models import Role, User, UsersRoles
+from app.services.user_directory import filtered_query
+
+FORMATS = ('csv', 'jsonl')
+
+# The exported columns. 'roles' holds role names separated by ';', as read by 'manage.py import_users'.
+FIELDS = ('id', 'email', 'first_name', 'last_name', 'active', 'email_confirmed_at', 'roles')
+
+
+def export_statement(search=u'', role_name=None, dialect_name='sqlite'):
+    """ Return the SELECT statement of the users that match a user directory search,
+    with their role names, in ID order. Returns None if the role does not exist."""
+    users, roles, users_roles = User.__table__, Role.__table__, UsersRoles.__table__
+    statement = select([users.c.id, users.c.email, users.c.first_name, users.c.last_name,
+                        users.c.is_active, users.c.email_confirmed_at,
+                        _aggregate_names(roles.c.name, dialect_name).label('roles')]) \
+        .select_from(users.outerjoin(users_roles, users_roles.c.user_id == users.c.id)
+                     .outerjoin(roles, roles.c.id == users_roles.c.role_id)) \
+        .group_by(users.c.id).order_by(users.c.id)
+    if (search or u'').strip() or role_name:
+        query = filtered_query(search, role_name)
+        if query is None:
+            return None
+        statement = statement.where(users.c.id.in_(query.with_entities(User.id).subquery()))
+    return statement
+
+
+def _aggregate_names(column, dialect_name):
+    if dialect_name == 'postgresql':
+        return func.string_agg(column, literal(';'))
+    if dialect_name == 'mysql':
+        return func.group_concat(column.op('SEPARATOR')(literal_column("';'")))  # GROUP_CONCAT(name SEPARATOR ';')
+    return func.group_concat(column, literal(';'))  # SQLite
+
+
+def export_rows(engine, search=u'', role_name=None, batch_size=1000):
+    """ Return an iterator of the exported users as dicts, which fetches ``batch_size`` rows at a time.
+    The statement is built right away, so the iterator can be consumed after the request context ends."""
+    statement = export_statement(search, role_name, engine.dialect.name)
+    if statement is None:
+        return iter(())
+    return _fetch_rows(engine, statement, batch_size)
+
+
+def _fetch_rows(engine, statement, batch_size):
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(statement)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield dict(
+                    id=row.id, email=row.email, first_name=row.first_name, last_name=row.last_name,
+                    active=bool(row.is_active),
+                    email_confirmed_at=row.email_confirmed_at.isoformat() if row.email_confirmed_at else None,
+                    roles=';'.join(sorted(set(row.roles.split(';')))) if row.roles else u'')
+
+
+def export_chunks(rows, format='csv', rows_per_chunk=1000):
+    """ Yield the text of ``rows`` in ``format``, ``rows_per_chunk`` rows per chunk."""
+    if format not in FORMATS:
+        raise ValueError('format must be one of %s' % ', '.join(FORMATS))
+    output = io.StringIO()
+    writer = None
+    if format == 'csv':
+        writer = csv.DictWriter(output, FIELDS, lineterminator='\n')
+        writer.writeheader()
+    count = 0
+    for row in rows:
+        if writer:
+            writer.writerow(row)
+        else:
+            output.write(json.dumps(row, sort_keys=True) + '\n')
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    if output.tell():
+        yield output.getvalue()
+
+
+def encode_chunks(chunks, compress=False, level=6):
+    """ Yield the UTF-8 bytes of the text ``chunks``, gzip-compressed if ``compress``."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31) if compress else None  # 31: gzip format
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+
+def export_users(engine, format='csv', compress=False, search=u'', role_name=None, batch_size=1000):
+    """ Return an iterator of the bytes of an export of the users that match a user directory search."""
+    if format not in FORMATS:
+        raise ValueError('format must be one of %s' % ', '.join(FORMATS))
+    rows = export_rows(engine, search, role_name, batch_size)
+    return encode_chunks(export_chunks(rows, format, batch_size), compress)
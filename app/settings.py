@@ -7,12 +7,28 @@ import os
 # Application settings
 APP_NAME = "Flask-User starter app"
 APP_SYSTEM_ERROR_SUBJECT_LINE = APP_NAME + " system error"
+ERROR_EMAIL_DIGEST_INTERVAL = 300  # Seconds between digest emails for repeated errors
+ERROR_EMAIL_MAX_PER_HOUR = 20  # Maximum number of error emails per hour (per process)
+ERROR_EMAIL_QUEUE_SIZE = 1000  # Error records beyond this backlog are dropped
 
 # Flask settings
 CSRF_ENABLED = True
 
 # Flask-SQLAlchemy settings
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+SQLALCHEMY_ENGINE_OPTIONS = dict(
+    pool_size=5,  # Connections kept open per process
+    max_overflow=10,  # Extra connections allowed under load
+    pool_timeout=30,  # Seconds to wait for a free connection
+    pool_recycle=1800,  # Seconds before a connection is replaced
+    pool_pre_ping=True,  # Test connections before handing them out
+)
+# Pragmas set on every SQLite connection. WAL lets readers proceed while a writer commits.
+SQLITE_PRAGMAS = dict(journal_mode='WAL', synchronous='NORMAL', busy_timeout=5000, mmap_size=268435456)
+# Reads of GET/HEAD requests go to these SQLALCHEMY_BINDS keys. Empty: all queries use the primary.
+DATABASE_READ_REPLICAS = []
+DATABASE_PRIMARY_PIN_SECONDS = 5  # Seconds a user's reads stay on the primary after they wrote
+ROLES_LOADING_STRATEGY = 'selectin'  # How current_user.roles is loaded: 'selectin', 'joined' or 'select'
 
 # Flask-User settings
 USER_APP_NAME = APP_NAME
@@ -26,4 +42,116 @@ USER_REQUIRE_RETYPE_PASSWORD = True  # Prompt for `retype password` in:
 USER_ENABLE_USERNAME = False  # Register and Login with username
 USER_AFTER_LOGIN_ENDPOINT = 'main.member_page'
 USER_AFTER_LOGOUT_ENDPOINT = 'main.home_page'
+# Password hash cost. Use 'python manage.py calibrate_hashing' to pick rounds for this machine.
+# Hashes with fewer than 'bcrypt__min_rounds' rounds are upgraded on the next login.
+USER_PASSLIB_CRYPTCONTEXT_KEYWORDS = dict(bcrypt__default_rounds=12, bcrypt__min_rounds=12)
 
+# Password hashing settings
+PASSWORD_HASHING_WORKERS = 2  # Hash passwords in this many processes (0 hashes in the request thread)
+PASSWORD_HASHING_MAX_PENDING = 64  # Maximum number of hashes queued for the process pool
+PASSWORD_HASH_TARGET_MS = 250  # Per-hash latency budget used by 'python manage.py calibrate_hashing'
+
+# Current user cache settings
+CURRENT_USER_CACHE_ENABLED = True  # Serve current_user from an in-process cache
+CURRENT_USER_CACHE_SIZE = 1000  # Maximum number of cached users per process
+CURRENT_USER_CACHE_TTL = 60  # Seconds before a cached user is reloaded from the DB
+
+# Email outbox settings (see 'python manage.py email_worker')
+EMAIL_OUTBOX_ENABLED = True  # Queue Flask-User emails instead of sending them during the request
+EMAIL_OUTBOX_BATCH_SIZE = 100  # Maximum number of emails per delivery batch
+EMAIL_OUTBOX_WORKERS = 4  # Sending threads, each with its own SMTP connection
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5  # Mark an email as 'failed' after this many attempts
+EMAIL_OUTBOX_RETRY_DELAY = 60  # Seconds before the first retry. Doubles with each retry.
+EMAIL_OUTBOX_LEASE = 300  # Seconds before an email claimed by a crashed worker is retried
+EMAIL_OUTBOX_POLL_INTERVAL = 5  # Seconds between checks for new emails
+
+# Page cache settings
+PAGE_CACHE_ENABLED = True  # Cache pages for anonymous visitors and {% cache %} template fragments
+PAGE_CACHE_BACKEND = 'memory'  # 'memory' (per process) or 'filesystem' (shared by processes)
+PAGE_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'pages')
+PAGE_CACHE_MAX_ENTRIES = 1000  # Least recently used entries are evicted beyond this number
+PAGE_CACHE_TTL = 300  # Seconds before a cached page or fragment is rendered again
+
+# Response compression (see app/services/compression.py and 'python -m benchmarks.compression')
+COMPRESSION_ENABLED = True  # Disable when a proxy in front of the app compresses responses
+COMPRESSION_ENCODINGS = ('br', 'gzip')  # In order of preference. 'br' needs the brotli package.
+COMPRESSION_GZIP_LEVEL = 6  # 1 (least CPU) to 9 (fewest bytes)
+COMPRESSION_BROTLI_QUALITY = 4  # 0 (least CPU) to 11 (fewest bytes)
+COMPRESSION_MIN_SIZE = 1024  # Smaller responses are sent uncompressed, as compression gains little
+COMPRESSION_CONTENT_TYPES = ('text/html', 'text/css', 'text/plain', 'text/csv', 'text/xml', 'application/json',
+                             'application/javascript', 'application/x-ndjson', 'application/xml', 'image/svg+xml')
+COMPRESSION_EXCLUDE_PATHS = ()  # Path prefixes that are never compressed, e.g. ('/metrics',)
+
+# Static assets (see 'python manage.py build_assets')
+STATIC_ASSETS_FINGERPRINTED = True  # Serve app/static/dist, if built, instead of the raw files
+STATIC_ASSETS_MAX_AGE = 31536000  # Browser cache lifetime in seconds of fingerprinted files
+
+# Request metrics
+REQUEST_METRICS_ENABLED = True  # Measure request, SQL and template times per endpoint
+REQUEST_METRICS_SERVER_TIMING = True  # Send the measured times in a Server-Timing response header
+REQUEST_METRICS_URL = '/metrics'  # Prometheus scrape URL
+REQUEST_METRICS_ALLOWED_IPS = []  # Client IP addresses that may read /metrics, e.g. ['127.0.0.1']
+REQUEST_METRICS_TOKEN = ''  # Scrapers that send 'Authorization: Bearer <token>' may read /metrics. Empty: none.
+# Each worker process saves its metrics here. The files of exited processes are removed by /metrics.
+REQUEST_METRICS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'metrics')
+REQUEST_METRICS_SAVE_INTERVAL = 1  # Seconds between saves of a process's metrics
+
+# User directory (/admin/users)
+USER_DIRECTORY_PER_PAGE = 50  # Users per page
+USER_DIRECTORY_COUNT_LIMIT = 10000  # Show '10,000+' instead of counting all matching users
+USER_DIRECTORY_COUNT_TTL = 60  # Seconds before a count is recomputed
+
+# Bulk actions (/admin/users and 'python manage.py bulk_users')
+BULK_ACTION_CHUNK_SIZE = 1000  # Users per transaction
+BULK_ACTION_CHUNK_PAUSE = 0  # Seconds to sleep between chunks, to let other writers in
+BULK_ACTION_MAX_USERS = 10000  # Users one /admin/users request may change. Use 'manage.py bulk_users' for more.
+
+# User exports (/admin/users/export and 'python manage.py export_users')
+USER_EXPORT_BATCH_SIZE = 1000  # Rows fetched from the database and written out at a time
+
+# Sessions
+SESSION_TYPE = 'sqlalchemy'  # 'sqlalchemy' (server-side, revocable) or 'cookie' (Flask's signed cookies)
+SESSION_CACHE_SIZE = 10000  # Sessions cached per process in front of the sessions table
+SESSION_CACHE_TTL = 60  # Seconds before a cached session is reloaded, e.g. to notice revocations
+SESSION_SWEEP_INTERVAL = 300  # Seconds between deletions of expired sessions (0 disables)
+SESSION_SWEEP_BATCH_SIZE = 1000  # Expired sessions deleted per statement
+
+# Login activity (users.last_login_at, users.login_count and the login_events table)
+LOGIN_ACTIVITY_ENABLED = True
+LOGIN_ACTIVITY_FLUSH_INTERVAL = 5  # Seconds between batched writes of buffered logins (0: write when full)
+LOGIN_ACTIVITY_MAX_BUFFER = 10000  # Logins buffered per process. More are dropped until the next write.
+
+# Purging unconfirmed users (see 'python manage.py purge_unconfirmed')
+PURGE_UNCONFIRMED_AFTER_DAYS = 30  # Delete users that did not confirm their email within this many days
+PURGE_UNCONFIRMED_INTERVAL = 3600  # Seconds between purges by each web process (0: only by the command)
+PURGE_UNCONFIRMED_BATCH_SIZE = 500  # Users deleted per transaction
+PURGE_UNCONFIRMED_PAUSE = 0.1  # Seconds between batches
+
+# Profile API (/api)
+API_BATCH_MAX_IDS = 100  # Maximum number of users per GET /api/users?ids=... request
+
+# Rate limits of form posts, checked before any password hashing, database work or email
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_BACKEND = 'sqlite'  # 'sqlite' (shared by the processes on this host) or 'memory' (per process)
+RATE_LIMIT_DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'rate_limits.sqlite')
+# Per endpoint: (requests, seconds) per client IP address ('ip') and per submitted email ('email').
+# Behind a reverse proxy, use werkzeug's ProxyFix so that the client IP address is not the proxy's.
+RATE_LIMITS = {
+    'user.login': dict(ip=(30, 60), email=(5, 60)),
+    'user.register': dict(ip=(5, 600), email=(3, 3600)),
+    'user.forgot_password': dict(ip=(5, 600), email=(3, 3600)),
+}
+
+# Production server (see 'python manage.py serve')
+SERVER_BIND = '127.0.0.1:8000'  # host:port to listen on
+SERVER_WORKERS = 0  # Worker processes (0: one per CPU)
+SERVER_THREADS = 8  # Request threads per worker process
+SERVER_GRACEFUL_TIMEOUT = 30  # Seconds that stopping workers may take to finish their requests
+SERVER_WORKER_TIMEOUT = 60  # Workers without a heartbeat for this many seconds are replaced
+SERVER_HEALTH_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'server_health.json')
+
+# Query budgets (see @query_budget.limit() in app/views/main_views.py)
+QUERY_BUDGET_ENABLED = True  # Check the number of SQL queries of views with a budget
+QUERY_BUDGET_MAX_REPEATS = 3  # Flag statements that run more often per request (N+1 queries)
+QUERY_BUDGET_RAISE = False  # Raise QueryBudgetExceeded instead of logging a warning
+QUERY_BUDGET_MAX_VIOLATIONS = 100  # Recent violations kept in query_budget.violations, for tests and debugging
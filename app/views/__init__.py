@@ -1,7 +1,9 @@
 # __init__.py is a special Python file that allows a directory to become
 # a Python package so it can be accessed using the 'import' statement.
 
+from .api_views import api_blueprint
 from .main_views import main_blueprint
 
 def register_blueprints(app):
-    app.register_blueprint(main_blueprint)
\ No newline at end of file
+    app.register_blueprint(main_blueprint)
+    app.register_blueprint(api_blueprint)
\ No newline at end of file
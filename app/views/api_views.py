@@ -0,0 +1,177 @@
+# This file defines a JSON API for user profiles, for the SPA and mobile clients.
+#
+# - GET /api/profile returns the logged-in user's profile with an ETag, and '304 Not Modified'
+#   if the client's If-None-Match still matches.
+# - PATCH /api/profile requires an If-Match header with the ETag of the profile the client edited,
+#   and answers '412 Precondition Failed' if the profile was changed since (optimistic concurrency).
+#   A PATCH that changes nothing does not write to the database.
+# - GET /api/users?ids=1,2,3 returns many users with one 'WHERE id IN (...)' query.
+# - '?fields=first_name,last_name' limits the returned fields.
+#
+# Like the HTML forms, PATCH requests must send the CSRF token, in an X-CSRFToken header.
+#
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from functools import wraps
+import hashlib
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_user import current_user
+
+from app import db
+from app.models.user_models import User
+from app.services.page_cache import page_cache
+from app.services.query_budget import query_budget
+from app.services.user_cache import user_cache
+
+api_blueprint = Blueprint('api', __name__, url_prefix='/api')
+
+# The fields of a profile, and the fields that other (non-admin) users may see
+PROFILE_FIELDS = ('id', 'email', 'first_name', 'last_name', 'version')
+PUBLIC_FIELDS = ('id', 'first_name', 'last_name')
+
+# The fields that PATCH may change, with their maximum lengths
+EDITABLE_FIELDS = dict(first_name=50, last_name=50)
+
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+        self.message = message
+
+
+@api_blueprint.errorhandler(APIError)
+def handle_api_error(error):
+    return jsonify(error=error.message), error.status
+
+
+def api_login_required(view):
+    """ Like @login_required, but answers '401 Unauthorized' instead of redirecting to the login page."""
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        if not current_user.is_authenticated:
+            raise APIError(401, 'Login required.')
+        return view(*args, **kwargs)
+    return decorated_view
+
+
+@api_blueprint.route('/profile', methods=['GET'])
+@query_budget.limit(3)
+@api_login_required
+def profile():
+    # current_user may be a cached snapshot that misses another process's update: read the row itself,
+    # so that the ETag is the one that PATCH checks
+    user = db.session.query(*[getattr(User, name) for name in PROFILE_FIELDS]) \
+        .filter(User.id == current_user.id).one()
+    etag = profile_etag(user)
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+    fields = requested_fields(PROFILE_FIELDS)
+    return _json_response(serialize(user, fields), etag)
+
+
+@api_blueprint.route('/profile', methods=['PATCH'])
+@query_budget.limit(5)
+@api_login_required
+def update_profile():
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict) or not changes:
+        raise APIError(400, 'Send a JSON object with the fields to change.')
+    for name, value in changes.items():
+        if name not in EDITABLE_FIELDS:
+            raise APIError(400, 'Editable fields are: %s.' % ', '.join(sorted(EDITABLE_FIELDS)))
+        if not isinstance(value, str) or not value.strip() or len(value.strip()) > EDITABLE_FIELDS[name]:
+            raise APIError(400, '%s must be 1 to %d characters.' % (name, EDITABLE_FIELDS[name]))
+        changes[name] = value.strip()
+    if not request.if_match:
+        raise APIError(428, 'Send the ETag of the profile in an If-Match header.')
+
+    user = current_user
+    fields = requested_fields(PROFILE_FIELDS)
+    if not request.if_match.contains(profile_etag(user)):
+        raise APIError(412, 'The profile was changed by another request. Reload it and try again.')
+    changes = dict((name, value) for name, value in changes.items() if getattr(user, name) != value)
+    if not changes:
+        # Nothing to change: no UPDATE, no commit and no cache invalidation
+        return _json_response(serialize(user, fields), profile_etag(user))
+
+    # UPDATE users SET ..., version=version+1 WHERE id=:id AND version=:version
+    users = User.__table__
+    updated = db.session.execute(users.update()
+                                 .where((users.c.id == user.id) & (users.c.version == user.version))
+                                 .values(version=users.c.version + 1, **changes)).rowcount
+    if not updated:
+        db.session.rollback()
+        raise APIError(412, 'The profile was changed by another request. Reload it and try again.')
+    profile = serialize(user, PROFILE_FIELDS)
+    profile.update(changes, version=user.version + 1)
+    db.session.commit()
+
+    # The statement bypasses the ORM, so cached users must be invalidated explicitly
+    user_cache.invalidate(user.id)
+    page_cache.invalidate_user(user.id)
+    return _json_response(dict((name, profile[name]) for name in fields), '%d-%d' % (user.id, profile['version']))
+
+
+@api_blueprint.route('/users', methods=['GET'])
+@query_budget.limit(3)
+@api_login_required
+def users():
+    try:
+        user_ids = [int(user_id) for user_id in request.args.get('ids', '').split(',') if user_id.strip()]
+    except ValueError:
+        raise APIError(400, 'ids must be a comma separated list of user IDs.')
+    max_ids = current_app.config.get('API_BATCH_MAX_IDS', 100)
+    if not user_ids or len(user_ids) > max_ids:
+        raise APIError(400, 'Request 1 to %d user IDs.' % max_ids)
+    user_ids = list(dict.fromkeys(user_ids))  # Unique, in the requested order
+    fields = requested_fields(PROFILE_FIELDS if current_user.has_role('admin') else PUBLIC_FIELDS)
+
+    # One query for all users, of just the needed columns and without ORM objects
+    columns = [User.id, User.version] + [getattr(User, name) for name in fields if name not in ('id', 'version')]
+    rows = dict((row.id, row) for row in db.session.query(*columns).filter(User.id.in_(user_ids)))
+
+    # The ETag of the batch is a hash of the IDs and versions of the users
+    versions = ','.join('%d:%d' % (user_id, rows[user_id].version) for user_id in user_ids if user_id in rows)
+    etag = hashlib.sha1(('%s|%s' % (versions, ','.join(fields))).encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+    return _json_response(dict(
+        users=[serialize(rows[user_id], fields) for user_id in user_ids if user_id in rows],
+        missing=[user_id for user_id in user_ids if user_id not in rows]), etag)
+
+
+def profile_etag(user):
+    return '%d-%d' % (user.id, user.version)
+
+
+def requested_fields(allowed_fields):
+    """ Return the fields listed in the 'fields' query parameter, or all ``allowed_fields``."""
+    fields = request.args.get('fields')
+    if not fields:
+        return allowed_fields
+    fields = tuple(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+    if not fields or not set(fields).issubset(allowed_fields):
+        raise APIError(400, 'fields must be a comma separated list of: %s.' % ', '.join(allowed_fields))
+    return fields
+
+
+def serialize(user, fields):
+    return dict((name, getattr(user, name)) for name in fields)
+
+
+def _json_response(data, etag):
+    response = jsonify(data)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'  # Browsers must revalidate with the ETag
+    return response
+
+
+def _not_modified(etag):
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -2,24 +2,34 @@
 #
 # Authors: Ling Thio <ling.thio@gmail.com>
 
+import datetime
 
-from flask import Blueprint, redirect, render_template
-from flask import request, url_for
+from flask import Blueprint, abort, flash, redirect, render_template
+from flask import current_app, request, url_for
 from flask_user import current_user, login_required, roles_required
 
 from app import db
-from app.models.user_models import UserProfileForm
+from app.models.user_models import Role, UserProfileForm
+from app.services.bulk_actions import ACTIONS, filtered_id_chunks, id_chunks, run_bulk_action
+from app.services.page_cache import page_cache
+from app.services.query_budget import query_budget
+from app.services.user_directory import SORT_ORDERS, approximate_count, search_users
+from app.services.user_cache import user_cache
+from app.services.user_export import FORMATS, export_users
 
 main_blueprint = Blueprint('main', __name__, template_folder='templates')
 
 # The Home page is accessible to anyone
 @main_blueprint.route('/')
+@query_budget.limit(2)  # At most 2 SQL queries per request
+@page_cache.cached  # Anonymous visitors all get the same page
 def home_page():
     return render_template('main/home_page.html')
 
 
 # The User page is accessible to authenticated users (users that have logged in)
 @main_blueprint.route('/member')
+@query_budget.limit(3)
 @login_required  # Limits access to authenticated users
 def member_page():
     return render_template('main/user_page.html')
@@ -27,12 +37,107 @@ def member_page():
 
 # The Admin page is accessible to users with the 'admin' role
 @main_blueprint.route('/admin')
+@query_budget.limit(3)
 @roles_required('admin')  # Limits access to users with the 'admin' role
 def admin_page():
     return render_template('main/admin_page.html')
 
 
+# The User directory is accessible to users with the 'admin' role
+@main_blueprint.route('/admin/users')
+@query_budget.limit(8)
+@roles_required('admin')
+def user_directory_page():
+    search = request.args.get('q', u'').strip()
+    role_name = request.args.get('role') or None
+    sort = request.args.get('sort', 'last_name')
+    if sort not in SORT_ORDERS:
+        sort = 'last_name'
+    per_page = current_app.config.get('USER_DIRECTORY_PER_PAGE', 50)
+
+    # Keyset pagination: 'after' is the cursor of the previous page's last user
+    try:
+        users, next_cursor = search_users(search, role_name, sort, request.args.get('after'), per_page)
+    except ValueError:
+        abort(400)  # Malformed cursor
+    count, count_is_exact = approximate_count(search, role_name)
+
+    return render_template('main/user_directory_page.html',
+                           users=users, next_cursor=next_cursor,
+                           count=count, count_is_exact=count_is_exact,
+                           search=search, role_name=role_name, sort=sort,
+                           roles=Role.query.order_by(Role.name).all(),
+                           bulk_actions=ACTIONS)
+
+
+# Bulk actions on the users selected in the User directory, or on all matching users
+@main_blueprint.route('/admin/users/bulk', methods=['POST'])
+@roles_required('admin')
+def user_directory_bulk_action():
+    action = request.form.get('action')
+    search = request.form.get('q', u'')
+    role_name = request.form.get('role') or None
+    if action not in ACTIONS:
+        abort(400)
+
+    action_role = request.form.get('action_role')
+    chunk_size = current_app.config.get('BULK_ACTION_CHUNK_SIZE', 1000)
+    max_users = current_app.config.get('BULK_ACTION_MAX_USERS', 10000)
+
+    # Collect at most max_users + 1 IDs: larger actions take too long for a request
+    if request.form.get('apply_to') == 'matching':
+        user_ids = []
+        for chunk in filtered_id_chunks(search, role_name, chunk_size):
+            user_ids.extend(chunk)
+            if len(user_ids) > max_users:
+                break
+    else:
+        user_ids = list(set(request.form.getlist('user_ids', type=int)))
+
+    if len(user_ids) > max_users:
+        flash('Change at most %d users at once. Use "python manage.py bulk_users" for more.' % max_users, 'error')
+    elif current_user.id in user_ids and (action == 'deactivate'
+                                          or (action == 'revoke_role' and action_role == 'admin')):
+        flash('You cannot deactivate yourself or revoke your own admin role.', 'error')
+    else:
+        try:
+            counts = run_bulk_action(action, id_chunks(user_ids, chunk_size), role_name=action_role,
+                                     pause=current_app.config.get('BULK_ACTION_CHUNK_PAUSE', 0))
+        except ValueError:
+            flash('Select an existing role to grant or revoke.', 'error')
+        else:
+            flash('%d of %d users changed.' % (counts['affected'], counts['users']), 'success')
+
+    return redirect(url_for('main.user_directory_page', q=search, role=role_name,
+                            sort=request.form.get('sort')))
+
+
+# Streams a CSV or JSONL export of the users that match a User directory search
+@main_blueprint.route('/admin/users/export')
+@query_budget.limit(4)
+@roles_required('admin')
+def user_export():
+    format = request.args.get('format', 'csv')
+    if format not in FORMATS:
+        abort(400)
+    compress = request.args.get('gzip') == '1'
+    chunks = export_users(db.engine, format, compress,
+                          search=request.args.get('q', u''), role_name=request.args.get('role') or None,
+                          batch_size=current_app.config.get('USER_EXPORT_BATCH_SIZE', 1000))
+
+    filename = 'users-%s.%s' % (datetime.date.today().isoformat(), format)
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    response = current_app.response_class(chunks, mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename=%s' % filename
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
 @main_blueprint.route('/main/profile', methods=['GET', 'POST'])
+@query_budget.limit(5)
 @login_required
 def user_profile_page():
     # Initialize form
@@ -45,6 +150,8 @@ def user_profile_page():
 
         # Save user_profile
         db.session.commit()
+        user_cache.invalidate(current_user.id)
+        page_cache.invalidate_user(current_user.id)
 
         # Redirect to home page
         return redirect(url_for('main.home_page'))
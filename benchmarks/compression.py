@@ -0,0 +1,97 @@
+"""Benchmark the CPU time and the bytes saved by response compression, per encoding and level.
+
+Usage: python -m benchmarks.compression [--users 1000] [--repeat 20]
+                                        [--gzip-levels 1,6,9] [--brotli-qualities 1,4,11]
+
+Renders the app's pages (the home page, the member page, the user directory and a user export)
+uncompressed, then compresses each page --repeat times with every gzip level and brotli quality
+the way the compression middleware does. Streamed pages are compressed in 8 KB chunks with a flush
+after each chunk. Brotli is only measured if the brotli package is installed.
+
+Prints one JSON result per page and setting with the original and compressed sizes,
+the percentage of bytes saved and the CPU milliseconds per response.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import time
+
+from flask import url_for
+
+from app.services.compression import available_encodings, make_compressor
+from benchmarks.page_routes import PASSWORD, create_benchmark_app, user_email
+
+STREAM_CHUNK_SIZE = 8192
+
+# (page name, endpoint, query arguments, streamed)
+PAGES = (
+    ('home_page', 'main.home_page', {}, False),
+    ('member_page', 'main.member_page', {}, False),
+    ('user_directory', 'main.user_directory_page', {}, False),
+    ('user_export_csv', 'main.user_export', dict(format='csv'), True),
+)
+
+
+def render_pages(app):
+    """ Return (page name, body, streamed) tuples of the uncompressed pages, as seen by the admin."""
+    client = app.test_client()
+    pages = []
+    with app.test_request_context():
+        client.post(url_for('user.login'), data=dict(email=user_email(0), password=PASSWORD))
+        for name, endpoint, arguments, streamed in PAGES:
+            response = client.get(url_for(endpoint, **arguments))
+            assert response.status_code == 200, '%s: status %d' % (name, response.status_code)
+            pages.append((name, response.data, streamed))
+        client.get(url_for('user.logout'))
+    return pages
+
+
+def compress(body, encoding, level, streamed):
+    if encoding == 'br':
+        compressor = make_compressor(encoding, brotli_quality=level)
+    else:
+        compressor = make_compressor(encoding, gzip_level=level)
+    if not streamed:
+        return compressor.compress(body) + compressor.finish()
+    parts = []
+    for start in range(0, len(body), STREAM_CHUNK_SIZE):
+        parts.append(compressor.compress(body[start:start + STREAM_CHUNK_SIZE]))
+        parts.append(compressor.flush())
+    parts.append(compressor.finish())
+    return b''.join(parts)
+
+
+def run(pages, settings, repeat):
+    for name, body, streamed in pages:
+        for encoding, level in settings:
+            started = time.process_time()
+            for i in range(repeat):
+                compressed = compress(body, encoding, level, streamed)
+            cpu_seconds = (time.process_time() - started) / repeat
+            yield dict(page=name, encoding=encoding, level=level, streamed=streamed,
+                       bytes=len(body), compressed_bytes=len(compressed),
+                       saved_percent=round(100.0 * (len(body) - len(compressed)) / len(body), 1),
+                       cpu_ms=round(cpu_seconds * 1000, 3),
+                       saved_bytes_per_cpu_ms=int((len(body) - len(compressed)) / max(cpu_seconds * 1000, 0.001)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--gzip-levels', default='1,6,9')
+    parser.add_argument('--brotli-qualities', default='1,4,11')
+    args = parser.parse_args()
+
+    settings = [('gzip', int(level)) for level in args.gzip_levels.split(',')]
+    if 'br' in available_encodings(('br',)):
+        settings += [('br', int(quality)) for quality in args.brotli_qualities.split(',')]
+
+    pages = render_pages(create_benchmark_app(args.users))
+    for result in run(pages, settings, args.repeat):
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark concurrent SQLite reads and writes with and without the engine profile.
+
+Usage: python -m benchmarks.engine_profile [--threads 8] [--seconds 5] [--users 1000]
+
+'default' uses Flask-SQLAlchemy's defaults: a NullPool (a new connection per checkout) and a rollback journal.
+'profile' uses SQLALCHEMY_ENGINE_OPTIONS (a MeteredQueuePool of pool_size connections)
+and SQLITE_PRAGMAS (WAL, ...) from app/settings.py.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from app import create_app, db
+from app.models.user_models import User
+from app.services.database import pool_stats
+
+
+def run(config_name, extra_settings, threads, seconds, users, write_ratio):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    settings = dict(SQLALCHEMY_DATABASE_URI='sqlite:///' + path)
+    settings.update(extra_settings)
+    app = create_app(settings)
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(User.__table__.insert(), [
+            dict(email='user%d@example.com' % i, first_name=u'User', last_name=u'%d' % i,
+                 password='x', is_active=True) for i in range(users)])
+        db.session.commit()
+
+    counts = dict(reads=0, writes=0, errors=0)
+    lock = threading.Lock()
+    stop_at = time.time() + seconds
+
+    def worker():
+        reads = writes = errors = 0
+        with app.app_context():
+            while time.time() < stop_at:
+                user_id = random.randint(1, users)
+                try:
+                    if random.random() < write_ratio:
+                        User.query.filter(User.id == user_id).update(dict(first_name=u'User %d' % writes))
+                        db.session.commit()
+                        writes += 1
+                    else:
+                        User.query.get(user_id).first_name
+                        db.session.rollback()  # End the read transaction, like the end of a request
+                        reads += 1
+                except Exception:
+                    db.session.rollback()
+                    errors += 1
+            db.session.remove()
+        with lock:
+            counts['reads'] += reads
+            counts['writes'] += writes
+            counts['errors'] += errors
+
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    with app.app_context():
+        pool_class = pool_stats(db.engine)['pool_class']
+    return dict(config=config_name, pool_class=pool_class,
+                reads_per_second=round(counts['reads'] / float(seconds), 1),
+                writes_per_second=round(counts['writes'] / float(seconds), 1),
+                errors=counts['errors'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    args = parser.parse_args()
+
+    default_settings = dict(SQLALCHEMY_ENGINE_OPTIONS={}, SQLITE_PRAGMAS={})
+    for config_name, extra_settings in (('default', default_settings), ('profile', {})):
+        result = run(config_name, extra_settings, args.threads, args.seconds, args.users, args.write_ratio)
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
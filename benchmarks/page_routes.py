@@ -0,0 +1,280 @@
+"""Benchmark the latency and throughput of the page routes.
+
+Usage: python -m benchmarks.page_routes [--users 1000] [--requests 200] [--threads 8]
+                                        [--mode client|server|both]
+                                        [--save-baseline FILE] [--baseline FILE] [--threshold 0.2]
+
+'client' drives the routes through the Flask test client, one request at a time.
+'server' drives them through a local multi-threaded WSGI server, from --threads concurrent clients.
+The database is seeded with --users users (1k to 1M).
+
+Prints one JSON result per route and mode with p50/p95/p99 latencies and requests per second.
+With --baseline, exits with status 1 if a route's p95 latency or throughput
+regressed by more than --threshold compared to the stored baseline.
+"""
+
+from __future__ import print_function
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.client import HTTPConnection
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from flask import url_for
+from werkzeug.serving import make_server
+
+from app import create_app, db
+from app.models.user_models import Role, User, UsersRoles
+
+PASSWORD = 'Password1'
+
+# (route name, method, endpoint, log in as: None, 'user' or 'admin')
+ROUTES = (
+    ('home_page', 'GET', 'main.home_page', None),
+    ('login', 'POST', 'user.login', None),
+    ('member_page', 'GET', 'main.member_page', 'user'),
+    ('user_profile_post', 'POST', 'main.user_profile_page', 'user'),
+    ('admin_page', 'GET', 'main.admin_page', 'admin'),
+)
+
+
+def create_benchmark_app(users):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    app = create_app(dict(
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + path,
+        WTF_CSRF_ENABLED=False,  # The benchmark clients do not parse forms
+        MAIL_SUPPRESS_SEND=True,
+        RATE_LIMIT_ENABLED=False,  # The benchmark logs in many times from one IP address
+        RATE_LIMIT_BACKEND='memory',  # Do not share rate limits with other runs
+    ))
+    with app.app_context():
+        seed_users(app, users)
+    return app
+
+
+def seed_users(app, users, chunk_size=10000):
+    """ Insert ``users`` confirmed users that share one password hash. The first user is an admin."""
+    db.create_all()
+    password_hash = app.user_manager.password_manager.hash_password(PASSWORD)
+    confirmed_at = datetime.datetime.utcnow()
+    for start in range(0, users, chunk_size):
+        db.session.execute(User.__table__.insert(), [
+            dict(email=user_email(i), first_name=u'User', last_name=u'%d' % i,
+                 password=password_hash, is_active=True, email_confirmed_at=confirmed_at)
+            for i in range(start, min(users, start + chunk_size))])
+
+    admin_role = Role(name='admin', label=u'Admin')
+    db.session.add(admin_role)
+    db.session.flush()
+    admin_id = db.session.query(User.id).filter(User.email == user_email(0)).scalar()
+    db.session.execute(UsersRoles.__table__.insert(), [dict(user_id=admin_id, role_id=admin_role.id)])
+    db.session.commit()
+
+
+def user_email(i):
+    return 'user%d@example.com' % i
+
+
+class TestClientSession(object):
+    """ Sends requests through the Flask test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code
+
+
+class HTTPSession(object):
+    """ Sends requests to a local WSGI server and keeps the session cookie."""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookies = SimpleCookie()
+
+    def request(self, method, path, data=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join('%s=%s' % (name, morsel.value) for name, morsel in self.cookies.items())
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection = HTTPConnection('127.0.0.1', self.port)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            for header in response.msg.get_all('Set-Cookie') or []:
+                self.cookies.load(header)
+            return response.status
+        finally:
+            connection.close()
+
+
+def run_route(app, new_session, route, users, requests, threads):
+    """ Send ``requests`` requests to ``route`` from ``threads`` concurrent sessions.
+    Returns a dict with latency percentiles, requests per second and errors."""
+    name, method, endpoint, login_as = route
+    with app.test_request_context():
+        path = url_for(endpoint)
+        login_path = url_for('user.login')
+
+    def login(session, i):
+        status = session.request('POST', login_path, dict(email=user_email(i), password=PASSWORD))
+        if status != 302:
+            raise RuntimeError('Login as %s failed with status %d' % (user_email(i), status))
+
+    # Each session logs in as a different user (the admin is user 0)
+    sessions = []
+    for thread_index in range(threads):
+        session = new_session()
+        if login_as:
+            login(session, 0 if login_as == 'admin' else 1 + thread_index % max(1, users - 1))
+        sessions.append(session)
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(session):
+        thread_latencies = []
+        thread_errors = 0
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            data = None
+            if name == 'login':
+                session = new_session()  # Logged in users are redirected without checking the password
+                data = dict(email=user_email(random.randrange(users)), password=PASSWORD)
+            elif name == 'user_profile_post':
+                data = dict(first_name=u'User', last_name=u'%d' % random.randrange(1000000))
+            start = time.time()
+            try:
+                status = session.request(method, path, data)
+            except Exception:
+                status = None
+            thread_latencies.append(time.time() - start)
+            if status not in (200, 302):
+                thread_errors += 1
+        with lock:
+            latencies.extend(thread_latencies)
+            errors[0] += thread_errors
+
+    start = time.time()
+    workers = [threading.Thread(target=worker, args=(session,)) for session in sessions]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    return dict(
+        route=name,
+        requests=len(latencies),
+        errors=errors[0],
+        requests_per_second=round(len(latencies) / elapsed, 1),
+        p50_ms=round(percentile(latencies, 50) * 1000, 2),
+        p95_ms=round(percentile(latencies, 95) * 1000, 2),
+        p99_ms=round(percentile(latencies, 99) * 1000, 2),
+    )
+
+
+def percentile(sorted_values, percent):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+
+def run(users, requests, threads, modes, routes):
+    app = create_benchmark_app(users)
+    results = []
+    for mode in modes:
+        server = None
+        if mode == 'server':
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)  # No request log lines
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            new_session = lambda: HTTPSession(server.server_port)
+            mode_threads = threads
+        else:
+            new_session = lambda: TestClientSession(app)
+            mode_threads = 1
+        try:
+            for route in ROUTES:
+                if routes and route[0] not in routes:
+                    continue
+                result = dict(mode=mode, users=users, threads=mode_threads)
+                result.update(run_route(app, new_session, route, users, requests, mode_threads))
+                print(json.dumps(result))
+                results.append(result)
+        finally:
+            if server:
+                server.shutdown()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Return a list of regressions of ``results`` against ``baseline``, a list of earlier results."""
+    baseline_by_key = dict(((result['mode'], result['users'], result['route']), result) for result in baseline)
+    regressions = []
+    for result in results:
+        base = baseline_by_key.get((result['mode'], result['users'], result['route']))
+        if not base:
+            continue
+        if result['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append('%(mode)s %(route)s: p95 %(p95_ms).1f ms' % result
+                               + ' > baseline %.1f ms' % base['p95_ms'])
+        if result['requests_per_second'] < base['requests_per_second'] / (1 + threshold):
+            regressions.append('%(mode)s %(route)s: %(requests_per_second).1f requests/s' % result
+                               + ' < baseline %.1f requests/s' % base['requests_per_second'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000, help='Number of users to seed (1k to 1M)')
+    parser.add_argument('--requests', type=int, default=200, help='Number of requests per route and mode')
+    parser.add_argument('--threads', type=int, default=8, help='Concurrent clients in server mode')
+    parser.add_argument('--mode', choices=('client', 'server', 'both'), default='both')
+    parser.add_argument('--route', action='append', choices=[route[0] for route in ROUTES],
+                        help='Only benchmark this route. May be repeated.')
+    parser.add_argument('--save-baseline', metavar='FILE', help='Store the results as the new baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='Compare the results against this baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed p95 latency and throughput regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    modes = ('client', 'server') if args.mode == 'both' else (args.mode,)
+    results = run(args.users, args.requests, args.threads, modes, args.route)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
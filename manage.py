@@ -3,18 +3,61 @@
 Use "python manage.py" for a list of available commands.
 Use "python manage.py runserver" to start the development web server on localhost:5000.
 Use "python manage.py runserver --help" for a list of runserver options.
+Use "python manage.py serve" to start the production web server (see SERVER_* in app/settings.py).
+Use "python manage.py check_migrations" before deploying, to check that the migrations match the models.
+Use "python manage.py profile_startup" to see how long it takes to start the app.
 """
 
-from flask_migrate import MigrateCommand
+import sys
+
 from flask_script import Manager
 
 from app import create_app
-from app.commands import InitDbCommand
+from app.commands import BuildAssetsCommand, BulkUsersCommand, CalibrateHashingCommand, CheckMigrationsCommand, \
+    EmailWorkerCommand, ExportUsersCommand, ImportUsersCommand, InitDbCommand, ProfileStartupCommand, \
+    PurgeUnconfirmedCommand, ServeCommand
+
+# The create_app() entry point of commands that do not serve web pages
+COMMAND_ENTRY_POINTS = dict(
+    db='db',
+    init_db='cli',
+    email_worker='cli',
+    import_users='cli',
+    export_users='cli',
+    purge_unconfirmed='cli',
+    calibrate_hashing='cli',
+    build_assets='cli',
+    profile_startup='cli',
+    bulk_users='cli',
+    serve='web',
+    check_migrations='db',
+)
+command_name = sys.argv[1] if len(sys.argv) > 1 else None
+
+
+def create_app_for_command():
+    # Only setup the extensions that the command needs
+    return create_app(entry_point=COMMAND_ENTRY_POINTS.get(command_name, 'web'))
+
 
 # Setup Flask-Script with command line commands
-manager = Manager(create_app)
-manager.add_command('db', MigrateCommand)
+manager = Manager(create_app_for_command)
 manager.add_command('init_db', InitDbCommand)
+manager.add_command('email_worker', EmailWorkerCommand)
+manager.add_command('import_users', ImportUsersCommand)
+manager.add_command('export_users', ExportUsersCommand)
+manager.add_command('purge_unconfirmed', PurgeUnconfirmedCommand)
+manager.add_command('calibrate_hashing', CalibrateHashingCommand)
+manager.add_command('build_assets', BuildAssetsCommand)
+manager.add_command('profile_startup', ProfileStartupCommand)
+manager.add_command('bulk_users', BulkUsersCommand)
+manager.add_command('serve', ServeCommand)
+manager.add_command('check_migrations', CheckMigrationsCommand)
+
+# Flask-Migrate imports Alembic, which is slow to import: only do so when it may be needed
+if command_name in (None, 'db') or command_name.startswith('-') or command_name not in COMMAND_ENTRY_POINTS:
+    from flask_migrate import MigrateCommand
+    manager.add_command('db', MigrateCommand)
 
 if __name__ == "__main__":
     # python manage.py                      # shows available commands
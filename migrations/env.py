@@ -9,13 +9,16 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-fileConfig(config.config_file_name)
+# (Not when called from app code, such as check_migration_drift(), which has its own loggers.)
+if config.attributes.get('configure_logger', True):
+    fileConfig(config.config_file_name)
 
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 from flask import current_app
+from app.services.migration_drift import include_object
 config.set_main_option('sqlalchemy.url', current_app.config.get('SQLALCHEMY_DATABASE_URI'))
 target_metadata = current_app.extensions['migrate'].db.metadata
 
@@ -38,7 +41,7 @@ def run_migrations_offline():
 
     """
     url = config.get_main_option("sqlalchemy.url")
-    context.configure(url=url)
+    context.configure(url=url, transaction_per_migration=True)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -56,8 +59,12 @@ def run_migrations_online():
                                 poolclass=pool.NullPool)
 
     connection = engine.connect()
+    # Commit after each revision, so that a long data migration (see app/services/backfill.py)
+    # does not hold the locks of the schema changes before it, and can resume where it stopped
     context.configure(connection=connection,
                       target_metadata=target_metadata,
+                      include_object=include_object,  # Ignore the users_fts tables and expression indexes
+                      transaction_per_migration=True,
                       **current_app.extensions['migrate'].configure_args)
 
     try:
@@ -15,42 +15,36 @@ import sqlalchemy as sa
 
 
 def upgrade():
-    ### commands auto generated by Alembic - please adjust! ###
-    op.create_table('role',
+    # Creates the tables as defined by app/models/user_models.py at the time
+    op.create_table('roles',
     sa.Column('id', sa.Integer(), nullable=False),
-    sa.Column('name', sa.String(length=50), nullable=True),
-    sa.Column('description', sa.String(length=255), server_default='', nullable=True),
+    sa.Column('name', sa.String(length=50), server_default='', nullable=False),
+    sa.Column('label', sa.Unicode(length=255), server_default='', nullable=True),
     sa.PrimaryKeyConstraint('id'),
     sa.UniqueConstraint('name')
     )
-    op.create_table('user',
+    op.create_table('users',
     sa.Column('id', sa.Integer(), nullable=False),
-    sa.Column('username', sa.String(length=50), nullable=False),
+    sa.Column('email', sa.Unicode(length=255), server_default='', nullable=False),
+    sa.Column('email_confirmed_at', sa.DateTime(), nullable=True),
     sa.Column('password', sa.String(length=255), server_default='', nullable=False),
-    sa.Column('reset_password_token', sa.String(length=100), server_default='', nullable=False),
-    sa.Column('email', sa.String(length=255), nullable=False),
-    sa.Column('confirmed_at', sa.DateTime(), nullable=True),
     sa.Column('is_active', sa.Boolean(), server_default='0', nullable=False),
-    sa.Column('first_name', sa.String(length=50), server_default='', nullable=False),
-    sa.Column('last_name', sa.String(length=50), server_default='', nullable=False),
+    sa.Column('first_name', sa.Unicode(length=50), server_default='', nullable=False),
+    sa.Column('last_name', sa.Unicode(length=50), server_default='', nullable=False),
     sa.PrimaryKeyConstraint('id'),
-    sa.UniqueConstraint('email'),
-    sa.UniqueConstraint('username')
+    sa.UniqueConstraint('email')
     )
-    op.create_table('user_roles',
+    op.create_table('users_roles',
     sa.Column('id', sa.Integer(), nullable=False),
     sa.Column('user_id', sa.Integer(), nullable=True),
     sa.Column('role_id', sa.Integer(), nullable=True),
-    sa.ForeignKeyConstraint(['role_id'], ['role.id'], ondelete='CASCADE'),
-    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['role_id'], ['roles.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
     sa.PrimaryKeyConstraint('id')
     )
-    ### end Alembic commands ###
 
 
 def downgrade():
-    ### commands auto generated by Alembic - please adjust! ###
-    op.drop_table('user_roles')
-    op.drop_table('user')
-    op.drop_table('role')
-    ### end Alembic commands ###
+    op.drop_table('users_roles')
+    op.drop_table('users')
+    op.drop_table('roles')
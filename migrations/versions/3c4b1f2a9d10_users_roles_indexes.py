@@ -0,0 +1,26 @@
+"""Index users_roles on (user_id, role_id) and role_id
+
+Revision ID: 3c4b1f2a9d10
+Revises: 0001c8ac1a69
+Create Date: 2026-10-18 09:12:40.118402
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c4b1f2a9d10'
+down_revision = '0001c8ac1a69'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Role checks look up (user_id, role_id); a user can hold each role only once
+    op.create_index('ix_users_roles_user_id_role_id', 'users_roles', ['user_id', 'role_id'], unique=True)
+    # Role.users looks up users by role_id
+    op.create_index('ix_users_roles_role_id', 'users_roles', ['role_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_users_roles_role_id', table_name='users_roles')
+    op.drop_index('ix_users_roles_user_id_role_id', table_name='users_roles')
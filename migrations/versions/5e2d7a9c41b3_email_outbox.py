@@ -0,0 +1,38 @@
+"""Add email_outbox table
+
+Revision ID: 5e2d7a9c41b3
+Revises: 3c4b1f2a9d10
+Create Date: 2026-10-18 10:02:17.604551
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e2d7a9c41b3'
+down_revision = '3c4b1f2a9d10'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('email_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('recipient', sa.Unicode(length=255), nullable=False),
+    sa.Column('sender', sa.Unicode(length=255), server_default='', nullable=False),
+    sa.Column('subject', sa.Unicode(length=255), server_default='', nullable=False),
+    sa.Column('html_message', sa.UnicodeText(), server_default='', nullable=False),
+    sa.Column('text_message', sa.UnicodeText(), server_default='', nullable=False),
+    sa.Column('status', sa.String(length=10), server_default='pending', nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.Unicode(length=255), server_default='', nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_email_outbox_status_next_attempt_at', 'email_outbox', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_email_outbox_status_next_attempt_at', table_name='email_outbox')
+    op.drop_table('email_outbox')
@@ -0,0 +1,31 @@
+"""Add backfill_checkpoints table
+
+Revision ID: 6f1d2b8e4a70
+Revises: a4c93e1b7d58
+Create Date: 2026-10-18 13:10:52.804113
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6f1d2b8e4a70'
+down_revision = 'a4c93e1b7d58'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('backfill_checkpoints',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('last_id', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('rows', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('chunks', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('backfill_checkpoints')
@@ -0,0 +1,62 @@
+"""Index users for the user directory, and add the users_fts search index on SQLite
+
+Revision ID: 8b7e0d4c2f15
+Revises: 5e2d7a9c41b3
+Create Date: 2026-10-18 11:20:43.671203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8b7e0d4c2f15'
+down_revision = '5e2d7a9c41b3'
+
+import sqlite3
+
+from alembic import op
+import sqlalchemy as sa
+
+
+USERS_FTS_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        email, first_name, last_name, content='users', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, email, first_name, last_name)
+        VALUES (new.id, new.email, new.first_name, new.last_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, email, first_name, last_name)
+        VALUES ('delete', old.id, old.email, old.first_name, old.last_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF email, first_name, last_name ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, email, first_name, last_name)
+        VALUES ('delete', old.id, old.email, old.first_name, old.last_name);
+        INSERT INTO users_fts(rowid, email, first_name, last_name)
+        VALUES (new.id, new.email, new.first_name, new.last_name);
+    END""",
+)
+
+
+def _fts_available():
+    # FTS5's trigram tokenizer requires SQLite 3.34+
+    return op.get_bind().dialect.name == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34)
+
+
+def upgrade():
+    # Keyset pagination by (last_name, id), and prefix searches on last_name and first_name
+    op.create_index('ix_users_last_name_id', 'users', ['last_name', 'id'], unique=False)
+    op.create_index(op.f('ix_users_first_name'), 'users', ['first_name'], unique=False)
+
+    if _fts_available():
+        for statement in USERS_FTS_DDL:
+            op.execute(statement)
+        # Index the existing users
+        op.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if _fts_available():
+        for trigger in ('users_fts_insert', 'users_fts_delete', 'users_fts_update'):
+            op.execute('DROP TRIGGER IF EXISTS %s' % trigger)
+        op.execute('DROP TABLE IF EXISTS users_fts')
+    op.drop_index(op.f('ix_users_first_name'), table_name='users')
+    op.drop_index('ix_users_last_name_id', table_name='users')
@@ -0,0 +1,24 @@
+"""Add users.version for the profile API's ETags
+
+Revision ID: 9c3e5a7b2d41
+Revises: 6f1d2b8e4a70
+Create Date: 2026-10-18 13:42:08.315927
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9c3e5a7b2d41'
+down_revision = '6f1d2b8e4a70'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # A constant server default: existing rows need no backfill and the table is not rewritten
+    op.add_column('users', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('version')
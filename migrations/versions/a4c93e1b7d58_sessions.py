@@ -0,0 +1,32 @@
+"""Add sessions table
+
+Revision ID: a4c93e1b7d58
+Revises: 8b7e0d4c2f15
+Create Date: 2026-10-18 12:05:31.228310
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a4c93e1b7d58'
+down_revision = '8b7e0d4c2f15'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('sessions',
+    sa.Column('id', sa.String(length=64), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('data', sa.UnicodeText(), server_default='', nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_sessions_expires_at'), 'sessions', ['expires_at'], unique=False)
+    op.create_index(op.f('ix_sessions_user_id'), 'sessions', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_sessions_user_id'), table_name='sessions')
+    op.drop_index(op.f('ix_sessions_expires_at'), table_name='sessions')
+    op.drop_table('sessions')
@@ -0,0 +1,23 @@
+"""Index lower(users.email) for case-insensitive email lookups
+
+Revision ID: b5d1e8f3a6c2
+Revises: f4a6e2b8c0d7
+Create Date: 2026-10-18 19:02:17.384512
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b5d1e8f3a6c2'
+down_revision = 'f4a6e2b8c0d7'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # 'python manage.py import_users' looks up existing emails with lower(email) IN (...)
+    op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_users_email_lower', table_name='users')
@@ -0,0 +1,38 @@
+"""Add users.last_login_at, users.login_count and the login_events table
+
+Revision ID: d2a8f6c4e913
+Revises: 9c3e5a7b2d41
+Create Date: 2026-10-18 16:05:37.402118
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd2a8f6c4e913'
+down_revision = '9c3e5a7b2d41'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Nullable and constant-default columns: existing rows need no backfill
+    op.add_column('users', sa.Column('last_login_at', sa.DateTime(), nullable=True))
+    op.add_column('users', sa.Column('login_count', sa.Integer(), server_default='0', nullable=False))
+    op.create_table('login_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('logged_in_at', sa.DateTime(), nullable=False),
+    sa.Column('ip_address', sa.String(length=45), server_default='', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_login_events_user_id_logged_in_at', 'login_events', ['user_id', 'logged_in_at'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_login_events_user_id_logged_in_at', table_name='login_events')
+    op.drop_table('login_events')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('login_count')
+        batch_op.drop_column('last_login_at')
@@ -0,0 +1,26 @@
+"""Add users.created_at and an index on users.email_confirmed_at
+
+Revision ID: e7b3c1d9a5f2
+Revises: d2a8f6c4e913
+Create Date: 2026-10-18 17:21:44.190357
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3c1d9a5f2'
+down_revision = 'd2a8f6c4e913'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Nullable: existing rows get their created_at from the next migration, a resumable backfill
+    op.add_column('users', sa.Column('created_at', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_users_email_confirmed_at'), 'users', ['email_confirmed_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_users_email_confirmed_at'), table_name='users')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('created_at')
@@ -0,0 +1,39 @@
+"""Backfill users.created_at of existing users
+
+Revision ID: f4a6e2b8c0d7
+Revises: e7b3c1d9a5f2
+Create Date: 2026-10-18 17:23:09.551806
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f4a6e2b8c0d7'
+down_revision = 'e7b3c1d9a5f2'
+
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.services.backfill import run_backfill
+
+
+def upgrade():
+    # The registration time of existing users is unknown. Using the time of this migration
+    # gives their unconfirmed accounts the full grace period before they are purged.
+    users = sa.Table('users', sa.MetaData(),
+                     sa.Column('id', sa.Integer(), primary_key=True), sa.Column('created_at', sa.DateTime()))
+    now = datetime.datetime.utcnow()
+
+    def update(connection, first_id, last_id):
+        return connection.execute(users.update()
+                                  .where(users.c.id.between(first_id, last_id) & users.c.created_at.is_(None))
+                                  .values(created_at=now)).rowcount
+
+    run_backfill(op.get_bind().engine, 'users.created_at', users, update)
+
+
+def downgrade():
+    # The column is dropped by the previous migration. Forget the checkpoint, so that upgrading again backfills.
+    checkpoints = sa.table('backfill_checkpoints', sa.column('name'))
+    op.execute(checkpoints.delete().where(checkpoints.c.name == 'users.created_at'))
@@ -6,25 +6,98 @@
 #
 # Authors: Ling Thio <ling.thio@gmail.com>
 
+import datetime
+import fcntl
+import os
+import socketserver
+import sqlite3
+import tempfile
+import threading
+
 import pytest
 from app import create_app, db as the_db
 
 # Initialize the Flask-App with test-specific settings
 the_app = create_app(dict(
     TESTING=True,  # Propagate exceptions
+    LOGIN_ACTIVITY_FLUSH_INTERVAL=0,  # No background writes: tests call login_activity.flush()
     LOGIN_DISABLED=False,  # Enable @register_required
     MAIL_SUPPRESS_SEND=True,  # Disable Flask-Mail send
+    PURGE_UNCONFIRMED_INTERVAL=0,  # No background purges
+    RATE_LIMIT_BACKEND='memory',  # Do not share rate limits with other test runs
+    RATE_LIMIT_ENABLED=False,  # Tests log in many times
+    REQUEST_METRICS_DIR=tempfile.mkdtemp(prefix='test-metrics-'),  # Per test process
     SERVER_NAME='localhost',  # Enable url_for() without request context
-    SQLALCHEMY_DATABASE_URI='sqlite:///:memory:',  # In-memory SQLite DB
+    SQLALCHEMY_DATABASE_URI='sqlite:///:memory:',  # In-memory SQLite DB, one per test process
+    # Cheap password hashes: the minimum bcrypt cost is 4, so 4-round hashes can still be 'outdated'
+    USER_PASSLIB_CRYPTCONTEXT_KEYWORDS=dict(bcrypt__default_rounds=5, bcrypt__min_rounds=5),
     WTF_CSRF_ENABLED=False,  # Disable CSRF form validation
 ))
 
 # Setup an application context (since the tests run outside of the webserver context)
 the_app.app_context().push()
 
-# Create and populate roles and users tables
-from app.commands.init_db import init_db
-init_db()
+
+def save_database(path):
+    """ Copy the in-memory test database to the file ``path`` with SQLite's backup API."""
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    target = sqlite3.connect(temp_path)
+    connection = the_db.engine.raw_connection()
+    try:
+        connection.connection.backup(target)
+    finally:
+        connection.close()
+        target.close()
+    os.rename(temp_path, path)
+
+
+def restore_database(path):
+    """ Replace the in-memory test database with a copy of the file ``path``."""
+    the_db.session.remove()
+    source = sqlite3.connect(path)
+    connection = the_db.engine.raw_connection()
+    try:
+        source.backup(connection.connection)
+    finally:
+        connection.close()
+        source.close()
+
+    # Forget what the app cached about the previous database
+    from app.services.login_activity import login_activity
+    from app.services.page_cache import page_cache
+    from app.services.user_cache import user_cache
+    from app.services.user_directory import clear_counts
+    user_cache.clear()
+    page_cache.clear()
+    login_activity.clear()
+    clear_counts()
+    if hasattr(the_app.session_interface, 'cache'):
+        the_app.session_interface.cache.clear()
+
+
+@pytest.fixture(scope='session', autouse=True)
+def template_db(tmp_path_factory):
+    """ Seeds a template database once per test run and loads it into this process's database.
+    Under pytest-xdist ('pytest -n auto'), the first worker seeds it and the others copy it.
+    Returns the path of the template database."""
+    root = tmp_path_factory.getbasetemp()
+    if os.environ.get('PYTEST_XDIST_WORKER'):
+        root = root.parent  # Shared by all workers of this test run
+    path = str(root / 'template.sqlite')
+    with open(str(root / 'template.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)  # Other workers wait until the template is seeded
+        try:
+            if not os.path.exists(path):
+                # Create and populate roles and users tables
+                from app.commands.init_db import init_db
+                init_db()
+                save_database(path)
+                return path
+        finally:
+            # Unlock explicitly: forked password hashing processes share the lock file
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    restore_database(path)
+    return path
 
 
 @pytest.fixture(scope='session')
@@ -61,3 +134,128 @@ def session(db, request):
 def client(app):
     return app.test_client()
 
+@pytest.fixture(autouse=True)
+def query_budgets():
+    """ Fails any test in which a view exceeds its @query_budget.limit() or runs N+1 queries. """
+    from app.services.query_budget import query_budget
+    query_budget.violations.clear()
+    yield query_budget
+    violations = list(query_budget.violations)
+    query_budget.violations.clear()
+    assert not violations, 'Query budget exceeded:\n' + '\n'.join(violations)
+
+
+@pytest.fixture(scope='function')
+def fresh_db(db, template_db):
+    """ Gives the test an untouched copy of the template database, and restores it again afterwards,
+    so that the test needs no clean-up of the rows it adds or changes."""
+    restore_database(template_db)
+    yield db
+    restore_database(template_db)
+
+
+@pytest.fixture(scope='function')
+def seed_users(fresh_db):
+    """ Returns seed(count, role_name=None), which quickly adds ``count`` users and returns their IDs.
+
+    Users are inserted with one executemany() per 10,000 users and share one password hash,
+    so thousands of users take a fraction of a second. Their password is 'Password1'.
+    """
+    from app.models.user_models import Role, User, UsersRoles
+    password = the_app.user_manager.password_manager.hash_password('Password1')
+    now = datetime.datetime.utcnow()
+    users = User.__table__
+
+    def seed(count, role_name=None):
+        first_id = (fresh_db.session.query(fresh_db.func.max(User.id)).scalar() or 0) + 1
+        for start in range(0, count, 10000):
+            fresh_db.session.execute(users.insert(), [
+                dict(id=first_id + i, email='seed%d@example.com' % (first_id + i), password=password,
+                     first_name=u'Seed', last_name=u'User%07d' % (first_id + i),
+                     is_active=True, email_confirmed_at=now)
+                for i in range(start, min(count, start + 10000))])
+        user_ids = list(range(first_id, first_id + count))
+        if role_name:
+            role_id = fresh_db.session.query(Role.id).filter(Role.name == role_name).scalar()
+            fresh_db.session.execute(UsersRoles.__table__.insert(),
+                                     [dict(user_id=user_id, role_id=role_id) for user_id in user_ids])
+        fresh_db.session.commit()
+        return user_ids
+    return seed
+
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """ A minimal local SMTP server that records connections and received messages.
+    Recipients listed in ``reject`` are refused with a 550 reply."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), SMTPStandInHandler)
+        self.port = self.server_address[1]
+        self.connections = 0
+        self.messages = []
+        self.reject = set()
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('ascii'))
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply('220 localhost SMTP stand-in')
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode('utf-8', 'replace').strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            elif command == 'RCPT':
+                recipient = line.split(':', 1)[1].strip().strip('<>')
+                if recipient in server.reject:
+                    self.reply('550 Mailbox unavailable')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b'.\r\n', b'.\n', b''):
+                        break
+                    data.append(data_line)
+                server.messages.append((recipients, b''.join(data)))
+                recipients = []
+                self.reply('250 OK')
+            elif command in ('MAIL', 'RSET'):
+                recipients = []
+                self.reply('250 OK')
+            else:  # HELO, EHLO, NOOP
+                self.reply('250 OK')
+
+
+@pytest.fixture(scope='function')
+def smtp_server(app, monkeypatch):
+    """ Starts a local SMTP stand-in and points Flask-Mail at it."""
+    server = SMTPStandIn()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    mail_state = app.extensions['mail']
+    monkeypatch.setattr(mail_state, 'server', '127.0.0.1')
+    monkeypatch.setattr(mail_state, 'port', server.port)
+    monkeypatch.setattr(mail_state, 'use_tls', False)
+    monkeypatch.setattr(mail_state, 'use_ssl', False)
+    monkeypatch.setattr(mail_state, 'username', None)
+    monkeypatch.setattr(mail_state, 'suppress', False)
+
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,49 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import datetime
+
+from app.commands.purge_unconfirmed import PurgeUnconfirmedCommand
+from app.models.login_models import LoginEvent
+from app.models.user_models import User, UsersRoles
+from app.services.account_purge import purge_unconfirmed_users, unconfirmed_user_purger
+
+
+def test_purge_unconfirmed_users(fresh_db, seed_users, capsys):
+    db = fresh_db
+    users = User.__table__
+    now = datetime.datetime.utcnow()
+    user_ids = seed_users(6, role_name='admin')
+    stale_ids, recent_id = user_ids[:3], user_ids[3]
+    db.session.execute(users.update().where(users.c.id.in_(stale_ids))
+                       .values(email_confirmed_at=None, created_at=now - datetime.timedelta(days=40)))
+    db.session.execute(users.update().where(users.c.id == recent_id).values(email_confirmed_at=None))
+    db.session.execute(LoginEvent.__table__.insert(), [dict(user_id=user_id, logged_in_at=now) for user_id in user_ids])
+    db.session.commit()
+    older_than = now - datetime.timedelta(days=30)
+
+    # Candidates are found with the index
+    plan = ' '.join(str(row[-1]) for row in db.session.execute(
+        'EXPLAIN QUERY PLAN SELECT id FROM users WHERE email_confirmed_at IS NULL AND id > 0 ORDER BY id'))
+    assert 'ix_users_email_confirmed_at' in plan
+
+    # A dry run only counts
+    counts = purge_unconfirmed_users(db.engine, older_than, batch_size=2, pause=0, dry_run=True)
+    assert (counts['users'], counts['users_roles'], counts['login_events'], counts['batches'])==(3, 3, 3, 2)
+    assert User.query.filter(User.id.in_(stale_ids)).count()==3
+    PurgeUnconfirmedCommand().run(days=30, batch_size=None, dry_run=True)
+    assert 'Would delete 3 unconfirmed users' in capsys.readouterr().out
+
+    # Stale unconfirmed users and their rows are deleted in batches
+    counts = purge_unconfirmed_users(db.engine, older_than, batch_size=2, pause=0)
+    assert (counts['users'], counts['users_roles'], counts['login_events'], counts['batches'])==(3, 3, 3, 2)
+    assert [user_id for user_id, in db.session.query(User.id).filter(User.id.in_(user_ids))]==user_ids[3:]
+    assert UsersRoles.query.filter(UsersRoles.user_id.in_(stale_ids)).count()==0
+    assert LoginEvent.query.filter(LoginEvent.user_id.in_(user_ids)).count()==3
+
+    # The in-process purger keeps totals
+    users_before = User.query.count()
+    counts = unconfirmed_user_purger.purge()
+    assert counts['users']==0 and User.query.count()==users_before
+    assert unconfirmed_user_purger.stats()['runs'] >= 1
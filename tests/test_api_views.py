@@ -0,0 +1,112 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import json
+
+from flask import url_for
+
+from app.models.user_models import User
+
+
+def patch(client, data, etag=None):
+    headers = {'If-Match': '"%s"' % etag} if etag else {}
+    return client.patch(url_for('api.update_profile'), data=json.dumps(data),
+                        content_type='application/json', headers=headers)
+
+
+def test_profile_api(app, db):
+    client = app.test_client()
+    assert client.get(url_for('api.profile')).status_code==401
+
+    client.post(url_for('user.login'), data=dict(email='member@example.com', password='Password1'))
+    member = User.query.filter(User.email == 'member@example.com').one()
+    member_id, version = member.id, member.version
+    try:
+        response = client.get(url_for('api.profile'))
+        assert response.status_code==200
+        assert json.loads(response.data)==dict(id=member_id, email='member@example.com',
+                                               first_name='Member', last_name='Example', version=version)
+        etag = response.headers['ETag'].strip('"')
+        assert client.get(url_for('api.profile'), headers={'If-None-Match': '"%s"' % etag}).status_code==304
+        response = client.get(url_for('api.profile', fields='first_name'))
+        assert json.loads(response.data)==dict(first_name='Member')
+        assert client.get(url_for('api.profile', fields='password')).status_code==400
+
+        # Updates require the ETag of the edited profile
+        assert patch(client, dict(first_name='Changed')).status_code==428
+        assert patch(client, dict(password='x'), etag).status_code==400
+        response = patch(client, dict(first_name='Changed'), etag)
+        assert response.status_code==200
+        assert json.loads(response.data)['version']==version + 1
+        new_etag = response.headers['ETag'].strip('"')
+        assert new_etag != etag
+        assert patch(client, dict(first_name='Lost update'), etag).status_code==412
+
+        # The next GET has the new ETag
+        response = client.get(url_for('api.profile'), headers={'If-None-Match': '"%s"' % etag})
+        assert response.status_code==200
+        assert json.loads(response.data)['first_name']=='Changed'
+
+        # Unchanged profiles are not written
+        response = patch(client, dict(first_name='Changed'), new_etag)
+        assert response.status_code==200
+        assert response.headers['ETag'].strip('"')==new_etag
+    finally:
+        client.get(url_for('user.logout'))
+        db.session.rollback()
+        member = User.query.get(member_id)
+        member.first_name = u'Member'
+        db.session.commit()
+
+
+def test_batch_users_api(app, db):
+    client = app.test_client()
+    client.post(url_for('user.login'), data=dict(email='member@example.com', password='Password1'))
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id.desc())]
+
+    # Non-admin users only see public fields
+    response = client.get(url_for('api.users', ids='%d,%d,999999' % (user_ids[1], user_ids[0])))
+    assert response.status_code==200
+    data = json.loads(response.data)
+    assert [user['id'] for user in data['users']]==[user_ids[1], user_ids[0]]
+    assert set(data['users'][0])==set(['id', 'first_name', 'last_name'])
+    assert data['missing']==[999999]
+    assert client.get(url_for('api.users', ids='1', fields='email')).status_code==400
+    assert client.get(url_for('api.users', ids='x')).status_code==400
+
+    etag = response.headers['ETag']
+    response = client.get(url_for('api.users', ids='%d,%d,999999' % (user_ids[1], user_ids[0])),
+                          headers={'If-None-Match': etag})
+    assert response.status_code==304
+
+    admin = app.test_client()
+    admin.post(url_for('user.login'), data=dict(email='admin@example.com', password='Password1'))
+    response = admin.get(url_for('api.users', ids=str(user_ids[0]), fields='id,email'))
+    assert set(json.loads(response.data)['users'][0])==set(['id', 'email'])
+    client.get(url_for('user.logout'))
+    admin.get(url_for('user.logout'))
+
+
+def test_profile_api_after_update_by_another_process(app, fresh_db):
+    db = fresh_db
+    client = app.test_client()
+    client.post(url_for('user.login'), data=dict(email='member@example.com', password='Password1'))
+    try:
+        etag = client.get(url_for('api.profile')).headers['ETag'].strip('"')
+
+        # Another worker process updates the profile: this process's cached current_user does not know
+        users = User.__table__
+        db.session.execute(users.update().where(users.c.email == 'member@example.com')
+                           .values(first_name=u'Elsewhere', version=users.c.version + 1))
+        db.session.commit()
+
+        response = client.get(url_for('api.profile'), headers={'If-None-Match': '"%s"' % etag})
+        assert response.status_code==200
+        assert json.loads(response.data)['first_name']=='Elsewhere'
+        new_etag = response.headers['ETag'].strip('"')
+        assert new_etag != etag
+        assert patch(client, dict(first_name='Changed'), new_etag).status_code==200
+    finally:
+        client.get(url_for('user.logout'))
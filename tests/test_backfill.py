@@ -0,0 +1,61 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import pytest
+
+from app.models.backfill_models import BackfillCheckpoint
+from app.models.user_models import User
+from app.services.backfill import Backfill, run_backfill
+from app.services.migration_drift import check_migration_drift
+
+
+def test_resumable_backfill(app, db):
+    db.session.execute(User.__table__.insert(), [
+        dict(email='backfill%d@example.com' % i, first_name=u'', last_name=u'Backfill', password='x')
+        for i in range(25)])
+    db.session.commit()
+    users = User.__table__
+    calls = []
+
+    def update(connection, first_id, last_id):
+        calls.append((first_id, last_id))
+        if len(calls)==3 and fail:
+            raise RuntimeError('Interrupted')
+        return connection.execute(users.update()
+                                  .where(users.c.id.between(first_id, last_id) & (users.c.last_name == u'Backfill'))
+                                  .values(first_name=u'Filled')).rowcount
+
+    options = dict(chunk_size=10, min_chunk_size=10, max_chunk_size=10, duty_cycle=1)
+    try:
+        # The third chunk fails: the first two chunks stay committed
+        fail = True
+        with pytest.raises(RuntimeError):
+            run_backfill(db.engine, 'test.first_name', users, update, **options)
+        checkpoint = BackfillCheckpoint.query.get('test.first_name')
+        assert checkpoint.chunks==2 and checkpoint.finished_at is None
+        filled = User.query.filter(User.last_name == u'Backfill', User.first_name == u'Filled').count()
+        assert 0 < filled < 25
+
+        # Resume after the last committed chunk
+        fail = False
+        resumed_from = calls[-1][0]
+        counts = run_backfill(db.engine, 'test.first_name', users, update, **options)
+        assert counts['finished']
+        assert calls[3][0]==resumed_from
+        assert User.query.filter(User.last_name == u'Backfill', User.first_name != u'Filled').count()==0
+        assert Backfill(db.engine, 'test.first_name', users, update).checkpoint().rows==25
+
+        # A finished backfill does not run again
+        assert run_backfill(db.engine, 'test.first_name', users, update, **options)==dict(
+            rows=0, chunks=0, finished=True)
+    finally:
+        db.session.rollback()
+        BackfillCheckpoint.query.delete()
+        User.query.filter(User.last_name == u'Backfill').delete(synchronize_session=False)
+        db.session.commit()
+
+
+def test_migrations_match_models():
+    assert check_migration_drift()==[]
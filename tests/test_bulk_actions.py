@@ -0,0 +1,82 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+from flask import url_for
+
+from app.models.user_models import Role, User, UsersRoles
+from app.services.bulk_actions import filtered_id_chunks, id_chunks, run_bulk_action
+from app.services.user_cache import user_cache
+
+
+def test_bulk_actions(app, db):
+    db.session.execute(User.__table__.insert(), [
+        dict(email='bulk%d@example.com' % i, first_name=u'Bulk', last_name=u'Bulkowski',
+             password='x', is_active=True) for i in range(5)])
+    db.session.commit()
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.email.like('bulk%'))]
+    try:
+        user_cache.get(user_ids[0])
+        counts = run_bulk_action('deactivate', id_chunks(user_ids, chunk_size=2))
+        assert counts==dict(affected=5, users=5, chunks=3)
+        assert User.query.filter(User.id.in_(user_ids), User.active == True).count()==0
+        assert user_cache.cache.get(user_ids[0]) is None  # Invalidated
+
+        # Already inactive users are not changed again
+        assert run_bulk_action('deactivate', id_chunks(user_ids))['affected']==0
+
+        # Grant a role to all users that match a search; users that have it already are skipped
+        run_bulk_action('grant_role', id_chunks(user_ids[:1]), role_name='admin')
+        counts = run_bulk_action('grant_role', filtered_id_chunks(u'bulkowski', chunk_size=2), role_name='admin')
+        assert counts['affected']==4
+        assert user_cache.get(user_ids[1]).has_role('admin')
+
+        counts = run_bulk_action('revoke_role', id_chunks(user_ids), role_name='admin')
+        assert counts['affected']==5
+    finally:
+        UsersRoles.query.filter(UsersRoles.user_id.in_(user_ids)).delete(synchronize_session=False)
+        User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def test_bulk_action_endpoint(client, db):
+    client.post(url_for('user.login'), data=dict(email='admin@example.com', password='Password1'))
+    member = User.query.filter(User.email == 'member@example.com').one()
+    response = client.post(url_for('main.user_directory_bulk_action'),
+                           data=dict(action='grant_role', action_role='admin', user_ids=[member.id]))
+    assert response.status_code==302
+    admin_role = Role.query.filter(Role.name == 'admin').one()
+    assert UsersRoles.query.filter_by(user_id=member.id, role_id=admin_role.id).count()==1
+    run_bulk_action('revoke_role', id_chunks([member.id]), role_name='admin')
+    client.get(url_for('user.logout'))
+
+
+def test_bulk_action_endpoint_limits(app, fresh_db, seed_users, monkeypatch):
+    client = app.test_client()
+    client.post(url_for('user.login'), data=dict(email='admin@example.com', password='Password1'))
+    try:
+        admin = User.query.filter(User.email == 'admin@example.com').one()
+        admin_id = admin.id
+
+        # Admins cannot lock themselves out
+        for data in (dict(action='deactivate'), dict(action='revoke_role', action_role='admin')):
+            response = client.post(url_for('main.user_directory_bulk_action'), follow_redirects=True,
+                                   data=dict(data, user_ids=[admin_id]))
+            assert b'You cannot deactivate yourself' in response.data
+        fresh_db.session.expire_all()
+        admin = User.query.get(admin_id)
+        assert admin.active and admin.has_role('admin')
+
+        # Larger actions are left to 'manage.py bulk_users'
+        user_ids = seed_users(6)
+        monkeypatch.setitem(app.config, 'BULK_ACTION_MAX_USERS', 5)
+        response = client.post(url_for('main.user_directory_bulk_action'), follow_redirects=True,
+                               data=dict(action='deactivate', apply_to='matching', q='seed'))
+        assert b'Change at most 5 users at once' in response.data
+        assert User.query.filter(User.id.in_(user_ids), User.active == False).count()==0
+        response = client.post(url_for('main.user_directory_bulk_action'), follow_redirects=True,
+                               data=dict(action='deactivate', user_ids=user_ids[:5]))
+        assert b'5 of 5 users changed' in response.data
+    finally:
+        client.get(url_for('user.logout'))
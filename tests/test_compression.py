@@ -0,0 +1,87 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import gzip
+import zlib
+
+from flask import Flask, Response, request, url_for
+
+from app.services.compression import CompressionMiddleware
+
+PAGE = u'<p>Compressible page content</p>\n' * 100
+
+
+def test_compressed_pages(app):
+    client = app.test_client()
+    response = client.get(url_for('main.home_page'), headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code==200
+    assert response.headers['Content-Encoding']=='gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    html = gzip.decompress(response.data)
+    assert b'</html>' in html and len(response.data) < len(html)
+
+    # Clients that do not accept gzip get the plain page, which caches must not mix up
+    response = client.get(url_for('main.home_page'))
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.data==html
+
+
+def test_compression_middleware():
+    app = Flask(__name__)
+    chunks_sent = []
+
+    @app.route('/page')
+    def page():
+        response = Response(PAGE, mimetype=request.args.get('mimetype', 'text/html'))
+        response.set_etag('page-1')
+        return response.make_conditional(request)
+
+    @app.route('/small')
+    def small():
+        return u'<p>Small</p>'
+
+    @app.route('/stream')
+    def stream():
+        def generate():
+            for i in range(3):
+                chunks_sent.append(i)
+                yield u'<p>Chunk %d</p>\n' % i * 50
+        return Response(generate(), mimetype='text/html')
+
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, encodings=('gzip',), gzip_level=1, min_size=1024,
+                                         exclude_paths=('/excluded',))
+    client = app.test_client()
+    gzip_headers = {'Accept-Encoding': 'br;q=1.0, gzip;q=0.8'}
+
+    response = client.get('/page', headers=gzip_headers)
+    assert response.headers['Content-Encoding']=='gzip'
+    assert 'Content-Length' not in response.headers
+    assert gzip.decompress(response.data).decode('utf-8')==PAGE
+    assert response.headers['ETag']=='"page-1-gzip"'
+
+    # The view compares its own ETag, and the client gets the one it sent back
+    response = client.get('/page', headers=dict(gzip_headers, **{'If-None-Match': '"page-1-gzip"'}))
+    assert response.status_code==304
+    assert response.headers['ETag']=='"page-1-gzip"'
+
+    # Small, incompressible, excluded or unaccepted responses are sent as they are
+    assert 'Content-Encoding' not in client.get('/small', headers=gzip_headers).headers
+    assert 'Content-Encoding' not in client.get('/page?mimetype=image/png', headers=gzip_headers).headers
+    assert 'Content-Encoding' not in client.get('/page', headers={'Accept-Encoding': 'gzip;q=0'}).headers
+    assert 'Content-Encoding' in client.get('/page', headers={'Accept-Encoding': '*'}).headers
+
+    # Streamed responses are compressed chunk by chunk: the first chunk arrives before the others are generated
+    response = client.get('/stream', headers=gzip_headers, buffered=False)
+    assert response.headers['Content-Encoding']=='gzip'
+    decompressor = zlib.decompressobj(31)
+    body = iter(response.response)
+    first = decompressor.decompress(next(body))
+    assert first.decode('utf-8')==u'<p>Chunk 0</p>\n' * 50 and chunks_sent==[0]
+    rest = b''.join(decompressor.decompress(data) for data in body) + decompressor.flush()
+    assert rest.decode('utf-8')==u'<p>Chunk 1</p>\n' * 50 + u'<p>Chunk 2</p>\n' * 50
+    response.close()
+
+    app.add_url_rule('/excluded/page', 'excluded', page)
+    assert 'Content-Encoding' not in client.get('/excluded/page', headers=gzip_headers).headers
@@ -0,0 +1,48 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+from flask_sqlalchemy import get_state
+from sqlalchemy.engine.url import make_url
+
+from app.services.database import MeteredQueuePool, pool_stats
+
+
+def test_sqlite_engine_profile(app, db, tmpdir):
+    url = make_url('sqlite:///' + str(tmpdir.join('profile.sqlite')))
+    engine = db.create_engine(url, dict(app.config['SQLALCHEMY_ENGINE_OPTIONS']))
+    assert isinstance(engine.pool, MeteredQueuePool)
+
+    # Pragmas are set on every connection
+    with engine.connect() as connection:
+        assert connection.execute('PRAGMA journal_mode').scalar()=='wal'
+        assert connection.execute('PRAGMA synchronous').scalar()==1  # NORMAL
+        assert connection.execute('PRAGMA busy_timeout').scalar()==5000
+
+    # Checkouts are counted and survive engine.dispose()
+    engine.dispose()
+    with engine.connect() as connection:
+        connection.execute('SELECT 1')
+    stats = pool_stats(engine)
+    assert stats['checkouts']==2
+    assert stats['size']==5 and stats['checked_out']==0
+    engine.dispose()
+
+
+def test_file_sqlite_app_engine(app, db, tmpdir, monkeypatch):
+    # Engines created by Flask-SQLAlchemy (with its driver hacks) keep the configured pool
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS', dict(profile='sqlite:///' + str(tmpdir.join('app.sqlite'))))
+    engine = db.get_engine(app, bind='profile')
+    try:
+        stats = pool_stats(engine)
+        assert stats['pool_class']=='MeteredQueuePool'
+        assert stats['size']==app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size']
+    finally:
+        engine.dispose()
+        get_state(app).connectors.pop('profile')
+
+
+def test_in_memory_engine(db):
+    # In-memory SQLite uses a StaticPool: QueuePool options are ignored
+    assert pool_stats(db.engine)['pool_class']=='StaticPool'
@@ -0,0 +1,74 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import datetime
+
+from flask import url_for
+
+from app.models.email_models import EmailOutbox
+from app.models.user_models import User
+from app.services.email_outbox import _claim_emails, deliver_emails, queue_email
+
+
+def test_register_queues_email(app, db):
+    client = app.test_client()
+    response = client.post(url_for('user.register'), follow_redirects=True,
+                           data=dict(email='outbox@example.com', password='Password1', retype_password='Password1'))
+    assert response.status_code==200
+    email = EmailOutbox.query.filter(EmailOutbox.recipient=='outbox@example.com').first()
+    assert email.status==EmailOutbox.STATUS_PENDING
+    db.session.delete(email)
+    User.query.filter(User.email=='outbox@example.com').delete()
+    db.session.commit()
+
+
+def test_deliver_emails(app, db, smtp_server, monkeypatch):
+    monkeypatch.setitem(app.config, 'EMAIL_OUTBOX_WORKERS', 2)
+    monkeypatch.setitem(app.config, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 2)
+    smtp_server.reject.add('bounce@example.com')
+    for i in range(6):
+        queue_email('user%d@example.com' % i, 'Subject', '<p>Hi</p>', 'Hi', 'app@example.com', 'App')
+    queue_email('bounce@example.com', 'Subject', '<p>Hi</p>', 'Hi', 'app@example.com')
+    db.session.commit()
+
+    # Two threads, one SMTP connection each
+    counts = deliver_emails()
+    assert counts==dict(sent=6, retried=1, failed=0)
+    assert smtp_server.connections==2
+    assert len(smtp_server.messages)==6
+
+    # The bounced email is retried after a backoff
+    bounce = EmailOutbox.query.filter(EmailOutbox.recipient=='bounce@example.com').one()
+    assert bounce.status==EmailOutbox.STATUS_PENDING
+    assert bounce.next_attempt_at > datetime.datetime.utcnow()
+    assert deliver_emails()==dict(sent=0, retried=0, failed=0)
+
+    # ... and marked as failed after EMAIL_OUTBOX_MAX_ATTEMPTS attempts
+    bounce.next_attempt_at = datetime.datetime.utcnow()
+    db.session.commit()
+    assert deliver_emails()==dict(sent=0, retried=0, failed=1)
+
+    EmailOutbox.query.delete()
+    db.session.commit()
+
+
+def test_abandoned_emails_fail(app, db, smtp_server, monkeypatch):
+    monkeypatch.setitem(app.config, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 2)
+    email_id = queue_email('crash@example.com', 'Subject', '<p>Hi</p>', 'Hi', 'app@example.com').id
+    db.session.commit()
+
+    # A worker that crashes while sending leaves the email in 'sending' until its lease expires
+    for attempt in range(2):
+        assert [message.id for message in _claim_emails(10, lease=-1)]==[email_id]
+    email = EmailOutbox.query.get(email_id)
+    assert (email.status, email.attempts)==(EmailOutbox.STATUS_SENDING, 2)
+
+    # ... and it is not claimed again after EMAIL_OUTBOX_MAX_ATTEMPTS attempts
+    assert deliver_emails()==dict(sent=0, retried=0, failed=1)
+    assert EmailOutbox.query.get(email_id).status==EmailOutbox.STATUS_FAILED
+    assert smtp_server.messages==[]
+
+    EmailOutbox.query.delete()
+    db.session.commit()
@@ -0,0 +1,89 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import logging
+import os
+import queue
+
+from app.services.error_mailer import ErrorDigestListener, ErrorQueueHandler
+
+
+def test_error_digest():
+    sent = []
+    error_queue = queue.Queue(maxsize=100)
+    handler = ErrorQueueHandler(error_queue)
+    logger = logging.getLogger('test_error_digest')
+    logger.propagate = False
+    logger.addHandler(handler)
+    listener = ErrorDigestListener(error_queue, lambda subject, body: sent.append((subject, body)),
+                                   'System error', digest_interval=60, max_emails_per_hour=10)
+    listener.start()
+
+    # Ten identical exceptions and one different one
+    for i in range(10):
+        try:
+            {}['missing']
+        except KeyError:
+            logger.exception('Lookup failed')
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception('Division failed')
+
+    # The first occurrence of each error is emailed, repeats are collapsed into one digest
+    listener.stop()
+    assert len(sent)==3
+    assert 'KeyError' in sent[0][1]
+    assert 'ZeroDivisionError' in sent[1][1]
+    assert sent[2][0]=='System error (digest: 9 errors)'
+    assert '9 occurrence(s)' in sent[2][1]
+
+
+def test_error_rate_limit():
+    sent = []
+    error_queue = queue.Queue(maxsize=1)
+    handler = ErrorQueueHandler(error_queue)
+    listener = ErrorDigestListener(error_queue, lambda subject, body: sent.append(subject),
+                                   'System error', digest_interval=60, max_emails_per_hour=1)
+
+    # The queue never blocks the caller
+    for i in range(3):
+        handler.handle(logging.makeLogRecord(dict(msg='Error %d', args=(i,), lineno=i, levelno=logging.ERROR)))
+    assert handler.dropped==2
+
+    # Only one email per hour: the digest waits
+    for lineno in (1, 2):
+        listener.handle(handler.prepare(logging.makeLogRecord(dict(msg='Error', lineno=lineno))))
+    listener.flush()
+    assert sent==['System error']
+    assert len(listener.pending)==1
+
+
+def test_error_mailer_in_forked_worker(tmpdir):
+    from flask import Flask
+    from app.services.error_mailer import init_error_mailer
+    sent_path = str(tmpdir.join('sent.txt'))
+
+    def send_email(subject, body):
+        with open(sent_path, 'a') as sent_file:
+            sent_file.write('%s|%s|%d\n' % (subject, body, os.getpid()))
+
+    app = Flask('test_error_mailer_in_forked_worker')
+    listener = init_error_mailer(app, send_email, 'System error')
+    try:
+        # Like a prefork worker: the listener thread of the parent is not copied by fork()
+        pid = os.fork()
+        if pid==0:
+            try:
+                app.logger.error('Error in worker')
+                listener.stop()  # Called by the worker_exit hook of 'manage.py serve'
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        with open(sent_path) as sent_file:
+            lines = sent_file.read().splitlines()
+        assert lines==['System error|Error in worker|%d' % pid]
+    finally:
+        listener.stop()
@@ -0,0 +1,53 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import json
+import os
+
+from app.commands.import_users import import_users
+from app.models.user_models import Role, User, UsersRoles
+
+
+def test_import_users(app, db, tmpdir):
+    db.session.add(User(email='Import3@Example.com', password='x'))  # Registered with another case
+    db.session.commit()
+    path = str(tmpdir.join('users.jsonl'))
+    with open(path, 'w') as f:
+        for row in [
+            dict(email='import1@example.com', first_name='One', last_name='Import', password='Password1', roles='admin'),
+            dict(email='admin@example.com', first_name='Admin', last_name='Example', password='Password1'),
+            dict(email='import2@example.com', first_name='Two', last_name='Import', password='Password1',
+                 roles='admin;importer;admin'),
+            dict(email='import3@example.com', first_name='Three', last_name='Import', password='Password1'),
+            dict(email='import4@example.com', first_name='Four', last_name='Import'),  # No password
+        ]:
+            f.write(json.dumps(row) + '\n')
+
+    # Resume after a crash that happened after the first chunk of 1 row
+    with open(path + '.checkpoint', 'w') as f:
+        f.write('1')
+    messages = []
+    counts = import_users(path, chunk_size=1, workers=2, progress=messages.append)
+    assert counts==dict(imported=1, skipped=2, invalid=1)
+    assert 'Row 5: no email or password, not imported.' in messages
+    assert not os.path.exists(path + '.checkpoint')
+    assert User.query.filter(User.email=='import1@example.com').first() is None
+
+    user = User.query.filter(User.email=='import2@example.com').one()
+    assert user.role_names==frozenset(['admin', 'importer'])
+    assert UsersRoles.query.filter(UsersRoles.user_id==user.id).count()==2
+    assert app.user_manager.verify_password('Password1', user.password)
+
+    # Re-running the import skips existing users
+    counts = import_users(path, chunk_size=2, workers=2)
+    assert counts==dict(imported=1, skipped=3, invalid=1)
+    assert User.query.filter(User.email.like('import3@example.com')).count()==1
+
+    # SQLite does not enforce ON DELETE CASCADE without 'PRAGMA foreign_keys'
+    import_user_ids = db.session.query(User.id).filter(User.email.like('import%')).subquery()
+    UsersRoles.query.filter(UsersRoles.user_id.in_(import_user_ids)).delete(synchronize_session=False)
+    User.query.filter(User.email.like('import%')).delete(synchronize_session=False)
+    Role.query.filter(Role.name=='importer').delete(synchronize_session=False)
+    db.session.commit()
@@ -0,0 +1,56 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import datetime
+
+from flask import url_for
+from sqlalchemy import event
+
+from app.models.login_models import LoginEvent
+from app.models.user_models import User
+from app.services.login_activity import login_activity
+
+
+def test_login_activity(app, fresh_db, monkeypatch):
+    db = fresh_db
+    member = User.query.filter(User.email == 'member@example.com').one()
+    member_id, version = member.id, member.version
+    client = app.test_client()
+    for i in range(3):
+        client.post(url_for('user.login'), data=dict(email='member@example.com', password='Password1'))
+        client.get(url_for('user.logout'))
+
+    # Logins are only buffered by the login requests
+    db.session.expire_all()
+    assert User.query.get(member_id).login_count==0
+    assert len(login_activity.buffer)==3
+
+    # ... and written by one INSERT and one UPDATE
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        assert login_activity.flush()==3
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert [statement.split()[0] for statement in statements]==['INSERT', 'UPDATE']
+    assert login_activity.flush()==0
+
+    db.session.expire_all()
+    member = User.query.get(member_id)
+    assert member.login_count==3
+    assert member.last_login_at > datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+    assert member.version==version  # Logins do not change the profile's ETag
+    history = LoginEvent.history(member_id)
+    assert len(history)==3 and history[0].logged_in_at==member.last_login_at
+    assert history[0].ip_address=='127.0.0.1'
+
+    # A full buffer is written before more logins are added
+    monkeypatch.setattr(login_activity, 'max_buffer', 2)
+    admin = User.query.filter(User.email == 'admin@example.com').one()
+    for i in range(3):
+        assert login_activity.record(admin.id)
+    assert len(login_activity.buffer)==1
+    db.session.expire_all()
+    assert User.query.get(admin.id).login_count==2
@@ -0,0 +1,60 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+from flask import url_for
+from flask_login import login_user
+
+from app.services.page_cache import FileSystemCacheBackend, page_cache
+
+
+def test_anonymous_page_cache(app):
+    client = app.test_client()
+    page_cache.clear()
+
+    response = client.get(url_for('main.home_page'))
+    assert response.status_code==200
+    etag = response.headers['ETag']
+    assert not etag.startswith('W/')  # Strong ETag
+    hits = page_cache.stats()['hits']
+
+    # Served from the cache
+    response = client.get(url_for('main.home_page'))
+    assert response.headers['ETag']==etag
+    assert page_cache.stats()['hits']==hits+1
+
+    # Conditional requests get a '304 Not Modified'
+    response = client.get(url_for('main.home_page'), headers={'If-None-Match': etag})
+    assert response.status_code==304
+    assert response.data==b''
+
+
+def test_fragment_cache(app):
+    template = app.jinja_env.from_string("{% cache 'test', 1 %}{{ value }}{% endcache %}")
+    with app.test_request_context('/'):
+        assert template.render(value='first')=='first'
+        assert template.render(value='second')=='first'
+
+
+def test_global_fragment_cache(app, db):
+    from app.models.user_models import User
+    template = app.jinja_env.from_string("{% cache 'test_global' global %}{{ value }}{% endcache %}")
+    with app.test_request_context('/'):
+        assert template.render(value='anonymous')=='anonymous'
+    # Global fragments are rendered once for everyone, logged in or not
+    with app.test_request_context('/'):
+        login_user(User.query.filter(User.email=='member@example.com').one())
+        assert template.render(value='member')=='anonymous'
+
+
+def test_filesystem_backend(tmpdir):
+    backend = FileSystemCacheBackend(str(tmpdir), max_entries=2, ttl=None)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    backend.set('c', 3)
+    assert backend.stats()['evictions']==1
+    assert backend.stats()['size']==2
+    assert backend.get('c')==3
+    assert backend.get('missing') is None
+    assert backend.stats()['hit_ratio']==0.5
@@ -0,0 +1,66 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import datetime
+
+from flask import url_for
+from passlib.hash import bcrypt
+from sqlalchemy import event
+
+from app.models.user_models import User
+from app.services.password_hashing import PoolPasswordManager, calibrate_cost
+
+
+def test_pool_password_manager(app):
+    password_manager = app.user_manager.password_manager
+    assert isinstance(password_manager, PoolPasswordManager)
+    password_hash = password_manager.hash_password('Password1')
+    assert password_manager.verify_password('Password1', password_hash)
+    assert not password_manager.verify_password('Password2', password_hash)
+
+
+def test_rehash_on_login(app, db):
+    # A user whose password was hashed with an outdated cost
+    user = User(email='rehash@example.com', password=bcrypt.using(rounds=4).hash('Password1'),
+                active=True, email_confirmed_at=datetime.datetime.utcnow())
+    db.session.add(user)
+    db.session.commit()
+
+    client = app.test_client()
+    client.post(url_for('user.login'), data=dict(email='rehash@example.com', password='Password1'))
+
+    # The hash was upgraded, and the user stays logged in
+    db.session.refresh(user)
+    rounds = app.config['USER_PASSLIB_CRYPTCONTEXT_KEYWORDS']['bcrypt__default_rounds']
+    assert rounds > 4
+    assert bcrypt.from_string(user.password).rounds==rounds
+    response = client.get(url_for('main.member_page'))
+    assert response.status_code==200
+
+    client.get(url_for('user.logout'))
+    db.session.delete(user)
+    db.session.commit()
+
+
+def test_login_without_rehash_looks_up_user_once(app, db):
+    # Without an outdated hash, the login form does not load the user a second time
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    client = app.test_client()
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        response = client.post(url_for('user.login'), data=dict(email='member@example.com', password='Password1'))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert response.status_code==302
+    # Flask-User's LoginForm.validate() and login view each look up the user by email
+    assert len([statement for statement in statements if 'lower(users.email)' in statement])==2
+    client.get(url_for('user.logout'))
+
+
+def test_calibrate_cost():
+    # Cheap bcrypt costs fit in 50 ms on any machine, none fit in 0 ms
+    assert calibrate_cost('bcrypt', 0.05, samples=1) >= 4
+    assert calibrate_cost('bcrypt', 0.0, samples=1) is None
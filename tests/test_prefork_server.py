@@ -0,0 +1,177 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+
+from app.services.prefork_server import PreforkServer
+
+
+def hello_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid()).encode('ascii')]
+
+
+def get(port, path='/'):
+    # Retry while the workers start
+    for attempt in range(50):
+        try:
+            connection = HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', path)
+            response = connection.getresponse()
+            return response.status, int(response.read())
+        except (IOError, OSError):
+            time.sleep(0.1)
+    raise AssertionError('The server did not respond')
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.1)
+    raise AssertionError('Timed out')
+
+
+def free_port():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+
+def test_prefork_server(tmpdir):
+    port = free_port()
+    health_file = str(tmpdir.join('health.json'))
+    disposed = tmpdir.join('disposed')
+
+    master_pid = os.fork()
+    if master_pid == 0:
+        try:
+            server = PreforkServer(hello_app, '127.0.0.1:%d' % port, workers=2, threads=2,
+                                   graceful_timeout=5, health_file=health_file,
+                                   engine_disposer=lambda: disposed.write('%d\n' % os.getpid(), mode='a'))
+            server.run()
+        finally:
+            os._exit(0)
+
+    try:
+        status, worker_pid = get(port)
+        assert status==200
+        assert worker_pid != master_pid
+
+        # Worker health is reported
+        def healthy_workers():
+            health = json.load(open(health_file)) if os.path.exists(health_file) else {}
+            workers = [worker for worker in health.get('workers', []) if 'requests' in worker]
+            return workers if len(workers)==2 else None
+        workers = wait_for(healthy_workers)
+        assert set(worker['threads'] for worker in workers)=={2}
+
+        # Engines are disposed before forking and in each worker
+        assert str(master_pid) in disposed.read().split()
+        assert str(worker_pid) in disposed.read().split()
+
+        # Dead workers are replaced
+        os.kill(worker_pid, signal.SIGKILL)
+        def replaced():
+            workers = healthy_workers()
+            return workers and worker_pid not in [worker['pid'] for worker in workers]
+        wait_for(replaced)
+        status, pid = get(port)
+        assert status==200
+    finally:
+        # Graceful shutdown stops the workers
+        os.kill(master_pid, signal.SIGTERM)
+        os.waitpid(master_pid, 0)
+    worker_pids = [worker['pid'] for worker in json.load(open(health_file))['workers']]
+    for pid in worker_pids:
+        try:
+            os.kill(pid, 0)
+            assert False, 'Worker %d is still running' % pid
+        except OSError:
+            pass
+
+
+# A graceful reload re-executes the master's command line, so the master runs as a script
+RELOAD_SERVER_SCRIPT = """
+import os
+import sys
+import time
+
+from app.services.prefork_server import PreforkServer
+
+
+def slow_app(environ, start_response):
+    if environ['PATH_INFO'] == '/slow':
+        time.sleep(2)
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid()).encode('ascii')]
+
+
+PreforkServer(slow_app, '127.0.0.1:%s' % sys.argv[1], workers=2, threads=2, graceful_timeout=10,
+              health_file=sys.argv[2]).run()
+"""
+
+
+def test_graceful_reload(tmpdir):
+    port = free_port()
+    health_file = str(tmpdir.join('health.json'))
+    script = tmpdir.join('server.py')
+    script.write(RELOAD_SERVER_SCRIPT)
+    temp_directory = tmpdir.mkdir('tmp')
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ, PYTHONPATH=repository, TMPDIR=str(temp_directory))
+    master = subprocess.Popen([sys.executable, str(script), str(port), health_file], env=environment)
+
+    def worker_pids():
+        health = json.load(open(health_file)) if os.path.exists(health_file) else {}
+        pids = [worker['pid'] for worker in health.get('workers', []) if 'requests' in worker]
+        return set(pids) if len(pids)==2 else None
+
+    try:
+        assert get(port)[0]==200
+        old_pids = wait_for(worker_pids)
+        assert len(temp_directory.listdir())==1  # The master's heartbeat directory
+
+        # A slow request is in flight during the reload
+        slow = {}
+        slow_thread = threading.Thread(target=lambda: slow.update(response=get(port, '/slow')))
+        slow_thread.start()
+        time.sleep(0.5)
+        os.kill(master.pid, signal.SIGHUP)
+
+        # New workers take over, and the old ones exit once the slow request has completed
+        new_pids = wait_for(lambda: worker_pids() if worker_pids() and not worker_pids() & old_pids else None)
+        slow_thread.join(10)
+        assert slow['response'][0]==200
+        assert slow['response'][1] in old_pids
+
+        def old_workers_exited():
+            for pid in old_pids:
+                try:
+                    os.kill(pid, 0)
+                    return False
+                except OSError:
+                    pass
+            return True
+        wait_for(old_workers_exited)
+        status, pid = get(port)
+        assert status==200 and pid in new_pids
+
+        # The old master's heartbeat directory was removed
+        assert len(temp_directory.listdir())==1
+    finally:
+        master.terminate()
+        master.wait(30)
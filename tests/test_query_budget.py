@@ -0,0 +1,37 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import pytest
+
+from app.models.user_models import User
+from app.services.query_budget import QueryBudgetExceeded
+
+
+def test_query_budget(app, query_budgets):
+    @query_budgets.limit(1)
+    def two_queries():
+        User.query.filter(User.id == 1).first()
+        User.query.filter(User.id == 2).first()
+
+    with app.test_request_context('/'):
+        two_queries()
+    assert 'exceed the budget of 1' in query_budgets.violations.pop()
+
+
+def test_n_plus_one_detection(app, query_budgets):
+    @query_budgets.limit(100)
+    def repeated_queries():
+        for user_id in range(5):
+            User.query.filter(User.id == user_id).first()
+
+    query_budgets.raise_errors = True
+    try:
+        with app.test_request_context('/'):
+            with pytest.raises(QueryBudgetExceeded) as exception:
+                repeated_queries()
+    finally:
+        query_budgets.raise_errors = False
+    assert 'Possible N+1 query: 5 times SELECT' in str(exception.value)
+    query_budgets.violations.clear()
@@ -0,0 +1,53 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import os
+
+from flask import url_for
+
+from app.services.rate_limiter import MemoryRateLimitBackend, SQLiteRateLimitBackend, rate_limiter
+
+
+def test_token_buckets(tmpdir):
+    shared_path = str(tmpdir.join('rate_limits.sqlite'))
+    for backend in (MemoryRateLimitBackend(), SQLiteRateLimitBackend(shared_path)):
+        now = 1000.0
+        assert backend.take('key', 2, 60, now)==0
+        assert backend.take('key', 2, 60, now)==0
+        assert backend.take('key', 2, 60, now)==30  # One token per 30 seconds
+        assert backend.take('other', 2, 60, now)==0
+        assert backend.take('key', 2, 60, now + 30)==0  # Refilled
+
+    # Processes share the SQLite buckets
+    if os.fork()==0:
+        SQLiteRateLimitBackend(shared_path).take('child', 1, 60, 1000.0)
+        os._exit(0)
+    os.wait()
+    assert SQLiteRateLimitBackend(shared_path).take('child', 1, 60, 1000.0)==60
+
+
+def test_login_rate_limit(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {'user.login': dict(ip=(5, 60), email=(2, 60))})
+    rate_limiter.clear()
+    try:
+        # Wrong passwords for one account
+        for attempt in range(2):
+            response = client.post(url_for('user.login'), data=dict(email='Member@example.com', password='wrong'))
+            assert response.status_code==200
+        response = client.post(url_for('user.login'), data=dict(email='member@example.com', password='Password1'))
+        assert response.status_code==429
+        assert response.headers['Retry-After']=='30'
+
+        # Other accounts, until the IP address is over its limit
+        for email in ('user@example.com', 'admin@example.com'):
+            response = client.post(url_for('user.login'), data=dict(email=email, password='wrong'))
+            assert response.status_code==200
+        response = client.post(url_for('user.login'), data=dict(email='other@example.com', password='wrong'))
+        assert response.status_code==429
+
+        # The login page itself is not limited
+        assert client.get(url_for('user.login')).status_code==200
+    finally:
+        rate_limiter.clear()
@@ -0,0 +1,69 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import time
+
+from flask import Response
+
+from app import create_app, db
+from app.models.user_models import User
+from app.services.database import PRIMARY_PIN_COOKIE
+
+
+def test_read_replica_routing(tmpdir):
+    # Two SQLite files stand in for the primary and the replica
+    replica_app = create_app(dict(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmpdir.join('primary.sqlite')),
+        SQLALCHEMY_BINDS=dict(replica='sqlite:///' + str(tmpdir.join('replica.sqlite')),
+                              replica2='sqlite:///' + str(tmpdir.join('replica2.sqlite'))),
+        DATABASE_READ_REPLICAS=['replica', 'replica2'],
+    ))
+    with replica_app.app_context():
+        db.create_all()
+        for bind in ('replica', 'replica2'):
+            db.Model.metadata.create_all(db.get_engine(bind=bind))
+            db.get_engine(bind=bind).execute(User.__table__.insert(), email='replica@example.com')
+
+    def find_user(method, email, headers=None):
+        with replica_app.test_request_context('/', method=method, headers=headers):
+            user = User.query.filter(User.email==email).first()
+            db.session.rollback()
+            return user
+
+    # GET reads use the replica, other reads use the primary
+    assert find_user('GET', 'replica@example.com') is not None
+    assert find_user('POST', 'replica@example.com') is None
+
+    # All reads of a transaction use the same replica
+    with replica_app.test_request_context('/', method='GET'):
+        engines = set(db.session.get_bind(User.__mapper__) for i in range(20))
+        assert len(engines)==1 and engines!=set([db.get_engine()])
+        db.session.remove()
+
+    # Writes use the primary, and later reads of the same transaction as well
+    with replica_app.test_request_context('/', method='GET') as request_context:
+        db.session.add(User(email='primary@example.com'))
+        db.session.flush()
+        assert User.query.filter(User.email=='primary@example.com').first() is not None
+        db.session.commit()
+
+        # After a commit, the user's reads are pinned to the primary for a while, with a cookie
+        # that is only set by this request (the Flask session is not modified)
+        response = replica_app.process_response(Response())
+        assert not request_context.session.modified
+        cookie = response.headers['Set-Cookie']
+        assert cookie.startswith(PRIMARY_PIN_COOKIE + '=')
+        db.session.remove()
+    primary_until = int(cookie.split(';')[0].split('=')[1])
+    assert primary_until > time.time()
+    cookie_header = {'Cookie': '%s=%d' % (PRIMARY_PIN_COOKIE, primary_until)}
+    assert find_user('GET', 'primary@example.com', headers=cookie_header) is not None
+    assert find_user('GET', 'primary@example.com') is None
+
+    with replica_app.app_context():
+        db.get_engine().dispose()
+        db.get_engine(bind='replica').dispose()
+        db.get_engine(bind='replica2').dispose()
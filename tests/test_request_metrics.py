@@ -0,0 +1,86 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from flask import url_for
+
+from app.services.request_metrics import MetricsRegistry, RequestMetrics, load_metrics_files, merge_metrics, \
+    remove_stale_metrics_files, render_prometheus, request_metrics
+
+
+def test_server_timing_and_metrics(app, monkeypatch):
+    monkeypatch.setattr(request_metrics, 'allowed_ips', frozenset(['127.0.0.1']))
+    client = app.test_client()
+
+    response = client.get(url_for('user.login'))
+    server_timing = response.headers['Server-Timing']
+    assert 'sql;dur=' in server_timing
+    assert 'tpl;dur=' in server_timing
+    assert 'total;dur=' in server_timing
+
+    response = client.get(url_for('metrics'))
+    assert response.status_code==200
+    assert response.mimetype=='text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE app_request_duration_seconds histogram' in text
+    assert 'app_request_duration_seconds_count{endpoint="user.login"}' in text
+    assert 'app_requests_total{endpoint="user.login",method="GET",status="200"}' in text
+
+
+def test_merge_metrics_of_processes():
+    # Two worker processes, each with one request
+    registries = [MetricsRegistry(), MetricsRegistry()]
+    for registry, duration in zip(registries, (0.003, 0.2)):
+        registry.observe('app_request_duration_seconds', 'main.home_page', duration)
+        registry.count_request('main.home_page', 'GET', 200)
+
+    text = render_prometheus(merge_metrics([registry.to_dict() for registry in registries]))
+    assert 'app_request_duration_seconds_bucket{endpoint="main.home_page",le="0.005"} 1' in text
+    assert 'app_request_duration_seconds_bucket{endpoint="main.home_page",le="0.25"} 2' in text
+    assert 'app_request_duration_seconds_count{endpoint="main.home_page"} 2' in text
+    assert 'app_requests_total{endpoint="main.home_page",method="GET",status="200"} 2' in text
+
+
+def test_metrics_access(app, monkeypatch):
+    client = app.test_client()
+    # Denied by default
+    assert client.get(url_for('metrics')).status_code==403
+
+    monkeypatch.setattr(request_metrics, 'token', 'secret')
+    assert client.get(url_for('metrics'), headers={'Authorization': 'Bearer wrong'}).status_code==403
+    assert client.get(url_for('metrics'), headers={'Authorization': 'Bearer secret'}).status_code==200
+
+
+def test_remove_stale_metrics_files(tmpdir):
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    for pid in (exited.pid, os.getpid()):
+        with open(str(tmpdir.join('metrics-%d-abcdef12.json' % pid)), 'w') as metrics_file:
+            json.dump(MetricsRegistry().to_dict(), metrics_file)
+    assert remove_stale_metrics_files(str(tmpdir))==1
+    assert os.listdir(str(tmpdir))==['metrics-%d-abcdef12.json' % os.getpid()]
+
+
+def test_concurrent_saves(tmpdir):
+    metrics = RequestMetrics()
+    metrics.directory = str(tmpdir)
+    metrics._check_pid()
+    metrics.registry.count_request('main.home_page', 'GET', 200)
+    threads = [threading.Thread(target=metrics.save) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [metrics['counters'] for metrics in load_metrics_files(str(tmpdir))]==[{'main.home_page|GET|200': 1}]
+    assert not [filename for filename in os.listdir(str(tmpdir)) if filename.endswith('.tmp')]
+
+    # Save errors are logged, not raised into the request
+    metrics.directory = str(tmpdir.join('missing'))
+    assert metrics.save() is False
@@ -0,0 +1,49 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import datetime
+
+from flask import url_for
+
+from app.models.session_models import ServerSession
+from app.models.user_models import User
+from app.services.session_store import revoke_user_sessions
+
+
+def test_server_side_sessions(app, db):
+    client = app.test_client()
+    session_interface = app.session_interface
+    saves = []
+    original_save = session_interface.store.save
+    session_interface.store.save = lambda *args: saves.append(args) or original_save(*args)
+    try:
+        client.post(url_for('user.login'), data=dict(email='member@example.com', password='Password1'))
+        member = User.query.filter(User.email == 'member@example.com').one()
+        assert ServerSession.query.filter_by(user_id=member.id).count()==1
+        assert saves
+
+        # Unmodified sessions are not written
+        client.get(url_for('main.member_page'))  # Shows and removes the 'signed in' flash message
+        del saves[:]
+        response = client.get(url_for('main.member_page'))
+        assert response.status_code==200
+        assert not saves
+
+        # Revoked sessions are logged out
+        assert revoke_user_sessions(app, member.id)==1
+        response = client.get(url_for('main.member_page'))
+        assert response.status_code==302
+    finally:
+        session_interface.store.save = original_save
+
+
+def test_sweep_expired_sessions(app, db):
+    session_interface = app.session_interface
+    now = datetime.datetime.utcnow()
+    session_interface.store.save('expired', u'{}', None, now - datetime.timedelta(seconds=1))
+    session_interface.store.save('current', u'{}', None, now + datetime.timedelta(hours=1))
+    assert session_interface.sweep()==1
+    assert ServerSession.query.get('current')
+    session_interface.store.delete('current')
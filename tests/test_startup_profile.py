@@ -0,0 +1,32 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+
+from app import create_app
+from app.services.startup_profile import parse_import_times
+
+
+def test_entry_points():
+    settings = dict(SQLALCHEMY_DATABASE_URI='sqlite://', TESTING=True)
+
+    cli_app = create_app(settings, entry_point='cli')
+    assert 'main' not in cli_app.blueprints
+    assert 'migrate' not in cli_app.extensions
+    assert cli_app.user_manager
+    steps = [step for step, seconds in cli_app.extensions['startup_timings'].steps]
+    assert steps==['Settings', 'Flask-SQLAlchemy', 'Flask-Mail', 'Flask-User']
+
+    db_app = create_app(settings, entry_point='db')
+    assert 'migrate' in db_app.extensions
+    assert not hasattr(db_app, 'user_manager')
+
+
+def test_parse_import_times():
+    output = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       120 |        120 |     json.decoder',
+        'import time:       500 |       2620 | json',
+    ])
+    assert parse_import_times(output)==[('json', 0.0005, 0.00262), ('json.decoder', 0.00012, 0.00012)]
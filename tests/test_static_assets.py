@@ -0,0 +1,45 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import gzip
+
+from flask import Flask, url_for
+
+from app.services.static_assets import build_assets, init_static_assets
+
+
+def test_build_and_serve_assets(tmpdir):
+    static_folder = tmpdir.mkdir('static')
+    static_folder.mkdir('css').join('app.css').write('body { color: red; }\n' * 100)
+    manifest = build_assets(str(static_folder))
+    fingerprinted = manifest['css/app.css']
+    assert fingerprinted.startswith('dist/css/app.') and fingerprinted.endswith('.css')
+    assert static_folder.join(fingerprinted + '.gz').check()
+
+    app = Flask(__name__, static_folder=str(static_folder))
+    init_static_assets(app)
+    client = app.test_client()
+    with app.test_request_context('/'):
+        url = url_for('static', filename='css/app.css')
+    assert url=='/static/' + fingerprinted
+
+    # Precompressed, with far-future cache headers
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code==200
+    assert response.headers['Content-Encoding']=='gzip'
+    assert response.mimetype=='text/css'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data)==b'body { color: red; }\n' * 100
+
+    # Clients that do not accept gzip get the plain file
+    response = client.get(url)
+    assert 'Content-Encoding' not in response.headers
+    assert response.data==b'body { color: red; }\n' * 100
+
+    # Files outside the manifest are still served
+    response = client.get('/static/css/app.css')
+    assert response.status_code==200
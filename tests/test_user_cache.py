@@ -0,0 +1,75 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+import time
+
+from flask import url_for
+
+from app.models.user_models import User
+from app.services.lru_cache import LRUCache
+from app.services.user_cache import user_cache
+
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2, ttl=None)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a')==1  # 'a' is now most recently used
+    cache.set('c', 3)  # evicts 'b'
+    assert cache.get('b') is None
+    assert cache.get('c')==3
+    stats = cache.stats()
+    assert stats['hits']==2 and stats['misses']==1 and stats['evictions']==1
+
+    # Expired entries are misses
+    cache = LRUCache(max_size=2, ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+
+def test_current_user_cache(app):
+    client = app.test_client()
+    user_cache.clear()
+
+    # Login as admin
+    response = client.post(url_for('user.login'), follow_redirects=True,
+                           data=dict(email='admin@example.com', password='Password1'))
+    assert response.status_code==200
+
+    # Repeated page views are served from the cache
+    client.get(url_for('main.admin_page'))
+    hits = user_cache.stats()['hits']
+    response = client.get(url_for('main.admin_page'))
+    assert response.status_code==200
+    assert user_cache.stats()['hits']==hits+1
+
+    # Saving the profile invalidates the cached user
+    response = client.post(url_for('main.user_profile_page'), follow_redirects=True,
+                           data=dict(first_name='Admin', last_name='Changed'))
+    assert response.status_code==200
+    response = client.get(url_for('main.member_page'))
+    assert response.status_code==200
+    admin = User.query.filter(User.email=='admin@example.com').first()
+    assert user_cache.cache.get(admin.id).last_name=='Changed'
+
+    # Restore the profile and logout
+    client.post(url_for('main.user_profile_page'), data=dict(first_name='Admin', last_name='Example'))
+    client.get(url_for('user.logout'))
+
+
+def test_role_names(app, db):
+    admin = User.query.filter(User.email=='admin@example.com').first()
+    assert admin.role_names==frozenset(['admin'])
+    assert admin.has_role('admin')
+    assert admin.has_roles('admin', ('admin', 'other'))
+    assert not admin.has_roles('other')
+
+    # Changing the roles resets the precomputed role set
+    role = admin.roles.pop()
+    assert not admin.has_role('admin')
+    admin.roles.append(role)
+    assert admin.has_role('admin')
+    db.session.rollback()
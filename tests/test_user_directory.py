@@ -0,0 +1,73 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+from __future__ import print_function  # Use print() instead of print
+from flask import url_for
+
+from app.models.user_models import User
+from app.services.user_directory import approximate_count, clear_counts, search_users
+
+
+def add_users(db, count):
+    db.session.execute(User.__table__.insert(), [
+        dict(email='directory%d@example.com' % i, first_name=u'Dir', last_name=u'Zimmer%02d' % i,
+             password='x', is_active=True) for i in range(count)])
+    db.session.commit()
+
+
+def remove_users(db):
+    User.query.filter(User.email.like('directory%')).delete(synchronize_session=False)
+    db.session.commit()
+    clear_counts()
+
+
+def test_keyset_pagination(app, db):
+    add_users(db, 7)
+    try:
+        with app.test_request_context('/'):
+            for sort in ('last_name', 'id'):
+                seen = []
+                users, cursor = search_users(u'zimmer', sort=sort, per_page=3)
+                seen.extend(users)
+                while cursor:
+                    users, cursor = search_users(u'zimmer', sort=sort, after=cursor, per_page=3)
+                    seen.extend(users)
+                assert [user.last_name for user in seen]==[u'Zimmer%02d' % i for i in range(7)]
+
+            # Short search terms use prefix searches
+            users, cursor = search_users(u'zi', per_page=100)
+            assert len(users)==7
+
+            # Role filter
+            users, cursor = search_users(u'', role_name='admin')
+            assert [user.email for user in users]==['admin@example.com']
+            assert search_users(u'', role_name='no-such-role')==([], None)
+
+            # Counts are capped
+            clear_counts()
+            app.config['USER_DIRECTORY_COUNT_LIMIT'] = 5
+            assert approximate_count(u'zimmer')==(5, False)
+            app.config['USER_DIRECTORY_COUNT_LIMIT'] = 10000
+            assert approximate_count(u'zimmer')==(7, True)
+    finally:
+        remove_users(db)
+
+
+def test_user_directory_page(client):
+    client.post(url_for('user.login'), data=dict(email='admin@example.com', password='Password1'))
+    response = client.get(url_for('main.user_directory_page', q='example', sort='id'))
+    assert response.status_code==200
+    assert b'member@example.com' in response.data
+    response = client.get(url_for('main.user_directory_page', after='not-a-cursor'))
+    assert response.status_code==400
+    client.get(url_for('user.logout'))
+
+
+def test_user_directory_of_many_users(app, seed_users):
+    user_ids = seed_users(5000)
+    with app.test_request_context('/'):
+        # The last page takes as few queries as the first
+        users, cursor = search_users(u'', sort='id', after=str(user_ids[-101]), per_page=50)
+        assert [user.id for user in users]==user_ids[-100:-50]
+        assert approximate_count(u'seed')==(5000, True)
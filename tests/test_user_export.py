@@ -0,0 +1,75 @@
+# Copyright 2014 SolidBuilds.com. All rights reserved
+#
+# Authors: Ling Thio <ling.thio@gmail.com>
+
+import csv
+import gzip
+import io
+import json
+
+from flask import url_for
+from sqlalchemy import event
+from sqlalchemy.dialects import mysql, postgresql
+
+from app.commands.export_users import ExportUsersCommand
+from app.models.user_models import Role
+from app.services.user_export import _aggregate_names, export_users
+
+
+def test_user_export(app, db, seed_users):
+    seed_users(2500, role_name='admin')
+    client = app.test_client()
+    client.post(url_for('user.login'), data=dict(email='admin@example.com', password='Password1'))
+    try:
+        # Rows are streamed from one query, however many users there are
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            response = client.get(url_for('main.user_export', format='csv', gzip=1))
+            data = gzip.decompress(response.data).decode('utf-8')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert response.status_code==200
+        assert response.mimetype=='application/gzip'
+        assert response.headers['Content-Disposition'].endswith('.csv.gz')
+        rows = list(csv.DictReader(io.StringIO(data)))
+        assert len(rows)==2502
+        assert [row['roles'] for row in rows if row['email']=='admin@example.com']==['admin']
+        assert rows[-1]['roles']=='admin' and rows[-1]['first_name']=='Seed'
+        assert len([statement for statement in statements if 'group_concat' in statement])==1
+
+        # JSON lines, filtered like the user directory
+        response = client.get(url_for('main.user_export', format='jsonl', q='member'))
+        assert response.mimetype=='application/x-ndjson'
+        rows = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+        assert [row['email'] for row in rows]==['member@example.com']
+        assert rows[0]['roles']=='' and rows[0]['active'] is True
+
+        assert client.get(url_for('main.user_export', format='xml')).status_code==400
+    finally:
+        client.get(url_for('user.logout'))
+
+    # Only admins may export
+    assert app.test_client().get(url_for('main.user_export')).status_code==302
+
+
+def test_export_users_command(app, db, seed_users, tmpdir):
+    seed_users(10)
+    path = str(tmpdir.join('users.jsonl.gz'))
+    ExportUsersCommand().run(format=None, output=path, compress=False, search=u'seed', role=None)
+    with gzip.open(path, 'rt') as export_file:
+        rows = [json.loads(line) for line in export_file]
+    assert len(rows)==10
+    assert set(rows[0])=={'id', 'email', 'first_name', 'last_name', 'active', 'email_confirmed_at', 'roles'}
+
+    # Unknown roles export just the CSV header
+    assert b''.join(export_users(db.engine, 'csv', role_name='unknown'))==b'id,email,first_name,last_name,active,email_confirmed_at,roles\n'
+
+
+def test_aggregate_names_per_dialect(app):
+    name = Role.__table__.c.name
+    assert str(_aggregate_names(name, 'mysql').compile(dialect=mysql.dialect()))== \
+        "group_concat(roles.name SEPARATOR ';')"
+    assert str(_aggregate_names(name, 'postgresql').compile(dialect=postgresql.dialect()))== \
+        'string_agg(roles.name, %(param_1)s)'